@@ -0,0 +1,78 @@
+'''
+
+=====================
+Import Time Benchmark
+=====================
+
+Times importing 'seo_tools' and a few of its entry points in fresh
+    interpreters, and checks that a bare 'import seo_tools' does not load
+    any of the heavy dependencies, which are only meant to be imported by
+    the features that use them.
+
+    python benchmarks/import_time.py [--runs 10] [--max-ms 50]
+
+Exits with status 1 when a heavy dependency is loaded eagerly, or when the
+    median time of 'import seo_tools' exceeds --max-ms.
+
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+heavy = ('aiohttp', 'pandas', 'numpy', 'lxml', 'whois', 'ipwhois', 'requests', 'pyarrow', 'orjson')
+
+cases = {
+    'python': 'pass',
+    'import seo_tools': 'import seo_tools',
+    'https()': 'from seo_tools import https; import seo_tools.generic',
+    'SEOClient': 'from seo_tools import SEOClient',
+    'google_search()': 'from seo_tools import serp_frame',
+    'blighthouse --help': 'import sys; sys.argv = ["blighthouse", "--help"]\n'
+                          'from seo_tools.__main__ import blighthouse\n'
+                          'try:\n    blighthouse()\nexcept SystemExit:\n    pass',
+}
+
+
+def _time(code):
+    ''' Returns the wall time in seconds of running code in a new interpreter '''
+    script = f'import time; _start = time.perf_counter()\n{code}\nprint(time.perf_counter() - _start)'
+    out = subprocess.run([sys.executable, '-c', script], cwd=root, check=True, capture_output=True, text=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _loaded():
+    ''' Returns the heavy dependencies loaded by a bare 'import seo_tools' '''
+    code = f'import sys, seo_tools; print(",".join(m for m in {heavy!r} if m in sys.modules))'
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, check=True, capture_output=True, text=True)
+    return [m for m in out.stdout.strip().split(',') if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='interpreters started per case')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail above this median for import seo_tools')
+    args = parser.parse_args()
+
+    medians = {}
+    for name, code in cases.items():
+        times = [_time(code) * 1000 for _ in range(args.runs)]
+        medians[name] = statistics.median(times)
+        print(f'{name:<20} median {medians[name]:>8.1f} ms   min {min(times):>8.1f} ms')
+
+    failed = False
+    loaded = _loaded()
+    if loaded:
+        print(f'import seo_tools loaded: {", ".join(loaded)}')
+        failed = True
+    if args.max_ms is not None and medians['import seo_tools'] > args.max_ms:
+        print(f'import seo_tools took {medians["import seo_tools"]:.1f} ms, above {args.max_ms} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
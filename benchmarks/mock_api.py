@@ -0,0 +1,238 @@
+'''
+
+===============
+Mock API Server
+===============
+
+A local aiohttp stand-in for the PageSpeed Insights, GT Metrix (start and
+    poll), Moz url-metrics and Google search endpoints, so the network layer
+    can be load tested without spending quota. Latency, error and throttling
+    behaviour and the size of the Lighthouse payload are configurable.
+
+    python benchmarks/mock_api.py --port 8080 --latency lognormal:0.3,0.6 --throttle-rate 0.02
+
+'use' points 'config.APIs' at a running server:
+
+    from mock_api import use
+
+    use('http://127.0.0.1:8080')
+
+Latencies are given as 'fixed:S', 'uniform:LOW,HIGH', 'lognormal:MEDIAN,SIGMA'
+    or 'exp:MEAN', in seconds.
+
+'''
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import math
+import os
+import random
+import sys
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seo_tools.config import APIs
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'serp_*.html')
+
+
+def distribution(spec):
+    '''
+        Parses a latency distribution and returns a function drawing seconds
+            from it
+    '''
+    kind, _, params = spec.partition(':')
+    params = [float(p) for p in params.split(',') if p]
+    if kind == 'fixed':
+        return lambda: params[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+    if kind == 'lognormal':
+        mu = math.log(params[0])
+        return lambda: random.lognormvariate(mu, params[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / params[0])
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def use(base):
+    ''' Points every API url of 'config.APIs' at a mock server '''
+    APIs.lh_api = base + '/pagespeedonline/v5/runPagespeed?url=%s&%s&strategy=%s&key=%s'
+    APIs.gtm_start = base + '/gtmetrix/api/0.1/test'
+    APIs.gtm_fetch = base + '/gtmetrix/api/0.1/test/%s'
+    APIs.moz_api = base + '/linkscape/url-metrics/%s?%s'
+    APIs.moz_batch_api = base + '/linkscape/url-metrics/?%s'
+    APIs.google_search = base + '/search?start=%i&num=%i&q=%s'
+
+
+def lighthouse_payload(categories, audits=150, details_bytes=2000):
+    ''' Builds a PageSpeed Insights response of roughly realistic shape '''
+    return {
+        'lighthouseResult': {
+            'requestedUrl': 'https://www.example.com/',
+            'finalUrl': 'https://www.example.com/',
+            'fetchTime': '2020-01-01T00:00:00.000Z',
+            'categories': {c: {'id': c, 'title': c, 'score': round(random.random(), 2)} for c in categories},
+            'audits': {
+                f'audit-{i}': {
+                    'id': f'audit-{i}',
+                    'title': f'Audit number {i}',
+                    'score': round(random.random(), 2),
+                    'numericValue': random.random() * 5000,
+                    'displayValue': f'{random.random() * 5:.1f} s',
+                    'details': {'type': 'table', 'items': [{'url': 'x' * 80}] * (details_bytes // 90)},
+                } for i in range(audits)
+            },
+        }
+    }
+
+
+class MockAPI:
+    '''
+        The mock server application
+
+        Kwargs:
+
+            latency (str): Response latency distribution of every endpoint
+
+            error_rate (float): Share of requests answered with a 500
+
+            throttle_rate (float): Share of requests answered with a 429 and
+                a Retry-After header
+
+            retry_after (int): Seconds sent in the Retry-After header
+
+            audits (int), details_bytes (int): Size of the Lighthouse payload,
+                the number of audits and the bytes of details of each
+
+            test_duration (str): Distribution of the time a GT Metrix test
+                takes to complete
+    '''
+
+    def __init__(self, latency='lognormal:0.2,0.5', error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 audits=150, details_bytes=2000, test_duration='uniform:0.5,2'):
+        self.latency = distribution(latency)
+        self.test_duration = distribution(test_duration)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.audits = audits
+        self.details_bytes = details_bytes
+        self.requests = 0
+        self._bodies = {}
+        self._tests = {}
+        self._ids = itertools.count(1)
+        self._serps = []
+        for path in sorted(glob.glob(fixtures)):
+            with open(path, 'rb') as f:
+                self._serps.append(f.read())
+
+    def app(self):
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_get('/pagespeedonline/v5/runPagespeed', self.pagespeed)
+        app.router.add_post('/gtmetrix/api/0.1/test', self.gtm_start)
+        app.router.add_get('/gtmetrix/api/0.1/test/{test_id}', self.gtm_poll)
+        app.router.add_post('/linkscape/url-metrics/', self.moz_batch)
+        app.router.add_get('/linkscape/url-metrics/{url:.*}', self.moz_single)
+        app.router.add_get('/search', self.search)
+        return app
+
+    @web.middleware
+    async def _faults(self, request, handler):
+        self.requests += 1
+        await asyncio.sleep(self.latency())
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return web.json_response({'error': {'code': 429, 'message': 'Quota exceeded'}}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        if roll < self.throttle_rate + self.error_rate:
+            return web.json_response({'error': {'code': 500, 'message': 'Backend error'}}, status=500)
+        return await handler(request)
+
+    async def pagespeed(self, request):
+        categories = tuple(request.query.getall('category', APIs.lh_cats))
+        if categories not in self._bodies:
+            payload = lighthouse_payload(categories, self.audits, self.details_bytes)
+            self._bodies[categories] = json.dumps(payload).encode('utf-8')
+        return web.Response(body=self._bodies[categories], content_type='application/json')
+
+    async def gtm_start(self, request):
+        data = await request.post()
+        test_id = f'test{next(self._ids)}'
+        loop = asyncio.get_running_loop()
+        self._tests[test_id] = (data.get('url'), loop.time() + self.test_duration())
+        return web.json_response({
+            'test_id': test_id,
+            'poll_state_url': str(request.url.with_path(f'/gtmetrix/api/0.1/test/{test_id}').with_query(None)),
+            'credits_left': 100,
+        })
+
+    async def gtm_poll(self, request):
+        test_id = request.match_info['test_id']
+        if test_id not in self._tests:
+            return web.json_response({'error': 'Test not found'}, status=404)
+        url, ready = self._tests[test_id]
+        if asyncio.get_running_loop().time() < ready:
+            return web.json_response({'state': 'started', 'error': '', 'results': {}, 'resources': {}})
+        del self._tests[test_id]
+        return web.json_response({'state': 'completed', 'error': '', 'results': {
+            'report_url': f'https://gtmetrix.com/reports/{test_id}',
+            'pagespeed_score': random.randint(50, 100),
+            'yslow_score': random.randint(50, 100),
+            'html_bytes': random.randint(10000, 100000),
+            'page_load_time': random.randint(500, 5000),
+            'page_elements': random.randint(20, 200),
+        }})
+
+    def _moz_metrics(self):
+        return {'pda': random.randint(1, 100), 'upa': random.randint(1, 100)}
+
+    async def moz_single(self, request):
+        return web.json_response(self._moz_metrics())
+
+    async def moz_batch(self, request):
+        urls = await request.json()
+        return web.json_response([self._moz_metrics() for _ in urls])
+
+    async def search(self, request):
+        if not self._serps:
+            return web.Response(status=404)
+        return web.Response(body=random.choice(self._serps), content_type='text/html')
+
+
+def _parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_arguments(parser)
+    return parser
+
+
+def add_arguments(parser):
+    ''' Adds the MockAPI settings to an argument parser '''
+    parser.add_argument('--latency', default='lognormal:0.2,0.5', help='response latency distribution')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--audits', type=int, default=150, help='audits per Lighthouse report')
+    parser.add_argument('--details-bytes', type=int, default=2000, help='details bytes per audit')
+    parser.add_argument('--test-duration', default='uniform:0.5,2', help='GT Metrix test duration distribution')
+
+
+def from_arguments(args):
+    ''' Creates a MockAPI from parsed 'add_arguments' settings '''
+    return MockAPI(args.latency, args.error_rate, args.throttle_rate, args.retry_after,
+                   args.audits, args.details_bytes, args.test_duration)
+
+
+def main():
+    args = _parser().parse_args()
+    web.run_app(from_arguments(args).app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
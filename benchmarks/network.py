@@ -0,0 +1,157 @@
+'''
+
+=======================
+Network Layer Benchmark
+=======================
+
+Runs 'lighthouse', 'pagespeed', 'moz' and 'gt_metrix' workloads of several
+    batch sizes against the mock API server (see mock_api.py) through the
+    methods of the same name of an SEOClient, and reports the throughput in
+    urls per second, the requests sent, the p50/p99 latency per request and
+    peak traced memory of each. The server runs in its own process so it
+    does not compete with the client for the event loop.
+
+    python benchmarks/network.py --sizes 10,100,500 --latency lognormal:0.2,0.5 --error-rate 0.01
+
+Rate limits, the response cache and quota accounting are disabled unless
+    --rates, --cache and --quotas are given, so the numbers measure the
+    network layer itself. Quota counters are always kept in a temporary
+    file, never in the real ones. Request latencies are taken from the
+    'end' hook of 'metrics', retries included. --json writes the results
+    for comparison between runs.
+
+'''
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_api
+
+from seo_tools import SEOClient, config, metrics
+from seo_tools._gt_metrix import GTMetrixPoller
+from seo_tools.utils import run
+
+# Workloads and the provider their requests are sent to
+workloads = {'lighthouse': 'pagespeed', 'pagespeed': 'pagespeed', 'moz': 'moz', 'gt_metrix': 'gt_metrix'}
+options = {'lighthouse': {'details': False}}
+
+
+def _serve(args, port, ready):
+    from aiohttp import web
+
+    async def main():
+        runner = web.AppRunner(mock_api.from_arguments(args).app())
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _failed(result):
+    if isinstance(result, list):
+        return any(r is None or isinstance(r, Exception) for r in result)
+    return result is None or isinstance(result, Exception)
+
+
+async def _workload(name, urls, args):
+    rates = None if args.rates else dict.fromkeys(config.Limits.rates)
+    async with SEOClient(cache=args.cache, rates=rates, concurrency=args.concurrency,
+                         max_tests=args.max_tests) as client:
+        return await getattr(client, name)(urls, **options.get(name, {}))
+
+
+def measure(name, size, args):
+    '''
+        Runs one workload of 'size' urls and returns its measurements as a
+            dict
+    '''
+    urls = [f'https://www.example{i}.com/page' for i in range(size)]
+    requests = metrics.Aggregator().attach()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        results = run(_workload(name, urls, args))
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        requests.detach()
+    errors = sum(map(_failed, results))
+    provider = workloads[name]
+    p50, p99 = (requests.percentile(provider, p) for p in (50, 99))
+    return {
+        'workload': name, 'size': size, 'seconds': elapsed, 'errors': errors,
+        'throughput': size / elapsed, 'requests': requests.providers[provider].requests,
+        'p50': float('nan') if p50 is None else p50,
+        'p99': float('nan') if p99 is None else p99, 'peak_bytes': peak,
+    }
+
+
+def _parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,500', help='comma separated batch sizes')
+    parser.add_argument('--workloads', default=','.join(workloads), help='comma separated workloads')
+    parser.add_argument('--concurrency', type=int, default=None, help='defaults to config.Limits.concurrency')
+    parser.add_argument('--max-tests', type=int, default=10, help='concurrent GT Metrix tests')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='first GT Metrix poll interval')
+    parser.add_argument('--rates', action='store_true', help='keep config.Limits.rates')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--quotas', action='store_true', help='keep quota accounting, against a temporary file')
+    parser.add_argument('--json', help='write the results to this file')
+    mock_api.add_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    port = _free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve, args=(args, port, ready), daemon=True)
+    server.start()
+    if not ready.wait(10):
+        server.terminate()
+        sys.exit('The mock server did not start')
+
+    mock_api.use(f'http://127.0.0.1:{port}')
+    config.Cache.enabled = args.cache
+    config.Quotas.enabled = args.quotas
+    config.Quotas.path = os.path.join(tempfile.mkdtemp(), 'quotas.sqlite')
+    GTMetrixPoller.min_interval = args.poll_interval
+    GTMetrixPoller.max_interval = args.poll_interval * 10
+
+    results = []
+    print(f'{"workload":<11} {"size":>6} {"urls/s":>9} {"requests":>9} {"p50 ms":>9} {"p99 ms":>9} '
+          f'{"errors":>7} {"peak MiB":>9}')
+    try:
+        for name in args.workloads.split(','):
+            for size in map(int, args.sizes.split(',')):
+                r = measure(name, size, args)
+                results.append(r)
+                print(f'{name:<11} {size:>6} {r["throughput"]:>9.1f} {r["requests"]:>9} {r["p50"] * 1000:>9.1f} '
+                      f'{r["p99"] * 1000:>9.1f} {r["errors"]:>7} {r["peak_bytes"] / 2 ** 20:>9.1f}')
+    finally:
+        server.terminate()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
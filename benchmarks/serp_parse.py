@@ -0,0 +1,84 @@
+'''
+
+====================
+SERP Parse Benchmark
+====================
+
+Measures how many saved Google SERP pages per second 'parse_serp' handles,
+    and the throughput of building one DataFrame from the records of every
+    page. When BeautifulSoup is installed, the previous select() based parser
+    is timed as a baseline.
+
+    python benchmarks/serp_parse.py [--seconds 2]
+
+'''
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seo_tools._google_search import parse_serp, to_frame
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'serp_*.html')
+
+
+def _soup_parse(html, q):
+    from bs4 import BeautifulSoup
+
+    records = []
+    r = 0
+    for s in BeautifulSoup(html, 'lxml').select('#search')[0].select('.g'):
+        if s.select('.st') != [] and s.select('h3') != [] and s.select('a') != []:
+            r += 1
+            u = s.select('a')[0]['href']
+            if '/url?q=' in u:
+                u = u.split('&')[0].replace('/url?q=', '')
+            records.append({'Rank': r, 'Query': q, 'Title': s.select('h3')[0].text,
+                            'Description': s.select('.st')[0].text, 'URL': u})
+    return records
+
+
+def _bench(name, parse, pages, seconds):
+    parsed = results = 0
+    records = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for i, html in enumerate(pages):
+            found = parse(html, f'query {i}')
+            records.extend(found)
+            results += len(found)
+            parsed += 1
+    elapsed = time.perf_counter() - start
+    frame_start = time.perf_counter()
+    frame = to_frame(records)
+    frame_time = time.perf_counter() - frame_start
+    print(f'{name:<12} {parsed / elapsed:>9.1f} pages/sec {results / elapsed:>11.0f} results/sec '
+          f'{len(frame):>9} rows concatenated in {frame_time * 1000:.1f} ms')
+    return parsed / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=2, help='time spent per parser')
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(fixtures)):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    print(f'{len(pages)} fixtures, {sum(map(len, pages)) / 1024:.0f} KiB')
+
+    rate = _bench('parse_serp', parse_serp, pages, args.seconds)
+    try:
+        import bs4
+    except ImportError:
+        return
+    baseline = _bench('bs4 select', _soup_parse, pages, args.seconds)
+    print(f'speed-up     {rate / baseline:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,63 @@
-import asyncio
-
-from seo_tools._lighthouse import LighthouseReport
-from seo_tools._gt_metrix import GTMetrix
-from seo_tools._moz import moz_single, moz_batch
-from seo_tools.generic import _cdn, _domain_age, _http2, _https, _mobile_friendly, _pagespeed, _lighthouse
-from seo_tools._google_search import search
-from seo_tools.utils import batch
-
-from functools import partial
-from concurrent.futures import ThreadPoolExecutor
+import importlib
+
+# Names re-exported from the submodules, which are only imported on first
+# use: aiohttp, pandas, lxml and the WHOIS libraries are slow to load, and
+# most callers only need a few of them.
+_lazy = {
+    'LighthouseReport': ('seo_tools._lighthouse', 'LighthouseReport'),
+    'GTMetrix': ('seo_tools._gt_metrix', 'GTMetrix'),
+    'GTMetrixPoller': ('seo_tools._gt_metrix', 'GTMetrixPoller'),
+    'moz_single': ('seo_tools._moz', 'moz_single'),
+    'moz_batch': ('seo_tools._moz', 'moz_batch'),
+    '_alpn_probe': ('seo_tools.generic', '_alpn_probe'),
+    '_cdn': ('seo_tools.generic', '_cdn'),
+    '_domain_age': ('seo_tools.generic', '_domain_age'),
+    '_http2': ('seo_tools.generic', '_http2'),
+    '_https': ('seo_tools.generic', '_https'),
+    '_redirects': ('seo_tools.generic', '_redirects'),
+    '_mobile_friendly': ('seo_tools.generic', '_mobile_friendly'),
+    '_pagespeed': ('seo_tools.generic', '_pagespeed'),
+    '_lighthouse': ('seo_tools.generic', '_lighthouse'),
+    'search': ('seo_tools._google_search', 'search'),
+    'search_records': ('seo_tools._google_search', 'search_records'),
+    'serp_frame': ('seo_tools._google_search', 'to_frame'),
+    'domain_ages': ('seo_tools._whois', 'domain_ages'),
+    'aiter_audit': ('seo_tools.pipeline', 'aiter_audit'),
+    'audit_frame': ('seo_tools.pipeline', 'audit_frame'),
+    'SEOClient': ('seo_tools.client', 'SEOClient'),
+    'default_client': ('seo_tools.client', 'default_client'),
+    'batch': ('seo_tools.utils', 'batch'),
+    'run': ('seo_tools.utils', 'run'),
+    'set_rate_limit': ('seo_tools.utils', 'set_rate_limit'),
+    'stream': ('seo_tools.utils', 'stream'),
+    'iterate': ('seo_tools.utils', 'iterate'),
+    'set_retry_policy': ('seo_tools.retry', 'set_retry_policy'),
+    'metrics': ('seo_tools.metrics', None),
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module, attr = _lazy[name]
+    value = importlib.import_module(module)
+    if attr is not None:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
+
+def _call(method, *args, **kwargs):
+    ''' Runs a method of a new 'client.default_client' on a new event loop '''
+    from seo_tools.client import default_client
+    from seo_tools.utils import run
+
+    async def main():
+        async with default_client() as client:
+            return await getattr(client, method)(*args, **kwargs)
+    return run(main())
 
 def lighthouse(url, **kwargs):
     '''
@@ -42,20 +91,41 @@ def lighthouse(url, **kwargs):
                     Options: 'accessibility' || 'best-practices'
                                || 'performance' || 'pwa' || 'seo'
 
+            split (bool): request each category separately and concurrently,
+                merging the results into one report per strategy. A strategy
+                is None unless every one of its categories succeeded
+
+            fields (list): audit fields kept on the reports. Defaults to
+                'score', 'numericValue' and 'displayValue'
+
+            details (bool or str): keep the compressed audit details for
+                on-demand parsing. False drops them, 'all' also keeps
+                screenshots and filmstrips
+
+            incremental (bool): only audit pages that changed since their
+                last stored result, see 'incremental.if_changed'
+
+            concurrency (int): Maximum number of urls audited at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
+            rate (float): Queries per second allowed against the PageSpeed API
+                by this call. Defaults to 'config.Limits.rates'
+
+            burst (int): Queries that may be sent back to back before 'rate'
+                applies
+
         Returns:
 
             Single Lighthouse object or a list of
-                Lighthouse objects.
+                Lighthouse objects. When both strategies are run, a
+                [mobile, desktop] pair is returned per url, with None in
+                place of a strategy that failed.
 
             Documentation on the Lighthouse object can be found under
                 the _lighthouse.py file
     '''
 
-    strategy = kwargs.get('strategy') if 'strategy' in kwargs else None
-    if isinstance(url, str):
-        return asyncio.run(_lighthouse(url, strategy=strategy))
-    elif isinstance(url, list):
-        return asyncio.run(batch(_lighthouse, url, strategy=strategy))
+    return _call('lighthouse', url, **kwargs)
 
 def mobile_friendly(url):
     '''
@@ -84,12 +154,9 @@ def mobile_friendly(url):
                 the _mobile_friendly.py file
     '''
 
-    if isinstance(url, str):
-        return asyncio.run(_mobile_friendly(url, strategy=strategy))
-    elif isinstance(url, list):
-        return asyncio.run(batch(_mobile_friendly, url, strategy=strategy))
+    return _call('mobile_friendly', url)
 
-def gt_metrix(url):
+def gt_metrix(url, **kwargs):
     '''
         Runs a GT Metrix test of a given url or list of urls
 
@@ -107,6 +174,12 @@ def gt_metrix(url):
 
             url (str or list): A url or list of urls to be tested
 
+        Kwargs:
+
+            max_tests (int): Tests allowed to run at once, the concurrent
+                test limit of the account. Defaults to
+                'config.Limits.gt_metrix_tests'
+
         Returns:
 
             Single GTMetrix object or a list of
@@ -115,9 +188,9 @@ def gt_metrix(url):
             Documentation on the GTMetrix object can be found under
                 the _gt_metrix.py file
     '''
-    return run(GTMetrix, url)
+    return _call('gt_metrix', url, **kwargs)
 
-def moz(url, cols=103079215104):
+def moz(url, cols=103079215104, **kwargs):
     '''
         Runs a MozScapes API call of a given url or list of urls for the
             specified parameters.
@@ -136,6 +209,20 @@ def moz(url, cols=103079215104):
 
             url (str or list): A url or list of urls to be tested
 
+        Kwargs:
+
+            concurrency (int): Maximum number of requests in flight when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
+            chunk_size (int): Urls sent per request when a list is given.
+                Defaults to 'config.Limits.moz_batch_size'
+
+            rate (float): Queries per second allowed against the Moz API by
+                this call. Defaults to 'config.Limits.rates'
+
+            burst (int): Queries that may be sent back to back before 'rate'
+                applies
+
         Returns:
 
             Single Moz Object
@@ -143,12 +230,9 @@ def moz(url, cols=103079215104):
             Documentation on the Moz object can be found under
                 the _moz.py file
     '''
-    if isinstance(url, str):
-        return asyncio.run(moz_single(url))
-    elif isinstance(url, list):
-        return asyncio.run(moz_batch(url))
+    return _call('moz', url, cols, **kwargs)
 
-def cdn(url):
+def cdn(url, **kwargs):
     '''
         Fetches CDN for a given url or list of urls
 
@@ -164,16 +248,18 @@ def cdn(url):
 
             url (str or list): A url or list of urls to be tested
 
+        Kwargs:
+
+            concurrency (int): Maximum number of urls looked up at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
         Returns:
 
             CDN or a list of CDN's (str, list(str))
     '''
-    if isinstance(url, str):
-        return _cdn(url)
-    elif isinstance(url, list):
-        return [_cdn(u) for u in url]
+    return _call('cdn', url, **kwargs)
 
-def domain_age(url):
+def domain_age(url, **kwargs):
     '''
         Fetches the domain age for a given url or list of urls
 
@@ -187,19 +273,25 @@ def domain_age(url):
 
         Args:
 
-            url (str or list): A url or list of urls to be tested
+            url (str or list): A url or list of urls to be tested. Urls on the
+                same registrable domain are looked up once.
+
+        Kwargs:
+
+            concurrency (int): Maximum WHOIS lookups in flight. Defaults to
+                'config.Limits.concurrency'
+
+            per_server (int): Maximum lookups in flight against one WHOIS
+                server. Defaults to 'config.Limits.whois_per_server'
 
         Returns:
 
             Domain Creation Date or a list of Domain Creation Dates
                 (datetime.datetime, list(datetime.datetime))
     '''
-    if isinstance(url, str):
-        return _domain_age(url)
-    elif isinstance(url, list):
-        return [_domain_age(u) for u in url]
+    return _call('domain_age', url, **kwargs)
 
-def http2(url):
+def http2(url, **kwargs):
     '''
         Determines if the given url or list of urls supports the HTTP/2
             Protocol
@@ -216,16 +308,49 @@ def http2(url):
 
             url (str or list): A url or list of urls to be tested
 
+        Kwargs:
+
+            concurrency (int): Maximum number of hosts probed at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
         Returns:
 
             Supports HTTP/2? or list of support as (boolean || list(boolean))
     '''
-    if isinstance(url, str):
-        return _http2(url)
-    elif isinstance(url, list):
-        return [_http2(u) for u in url]
+    return _call('http2', url, **kwargs)
+
+def protocol(url, **kwargs):
+    '''
+        Reports the protocol negotiated through TLS ALPN for the given url or
+            list of urls, along with the TLS handshake time
+
+        Example:
+
+            In [1]:    from seo_tools import protocol
+
+                       protocol('https://www.example.com').protocol
+
+            Out [1]:   'h2'
+
+        Args:
+
+            url (str or list): A url or list of urls to be tested
+
+        Kwargs:
+
+            concurrency (int): Maximum number of hosts probed at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
+            timeout (float): Seconds allowed per probe. Defaults to
+                'config.Network.probe_timeout'
+
+        Returns:
+
+            ProtocolProbe or list(ProtocolProbe), see 'generic._alpn_probe'
+    '''
+    return _call('protocol', url, **kwargs)
 
-def https(url):
+def https(url, **kwargs):
     '''
         Determines if the given url or list of urls supports the HTTPS
             Protocol
@@ -242,16 +367,46 @@ def https(url):
 
             url (str or list): A url or list of urls to be tested
 
+        Kwargs:
+
+            concurrency (int): Maximum number of urls checked at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
         Returns:
 
             Supports HTTPS? or list of support as (boolean || list(boolean))
     '''
-    if isinstance(url, str):
-        return asyncio.run(_https(url))
-    elif isinstance(url, list):
-        return asyncio.run(batch(_https, url))
+    return _call('https', url, **kwargs)
+
+def redirects(url, **kwargs):
+    '''
+        Follows the redirect chain of the given url or list of urls without
+            downloading any page bodies
+
+        Example:
+
+            In [1]:    from seo_tools import redirects
+
+                       redirects('http://example.com').final_url
+
+            Out [1]:   'https://www.example.com/'
+
+        Args:
+
+            url (str or list): A url or list of urls to be followed
+
+        Kwargs:
+
+            concurrency (int): Maximum number of chains followed at once when
+                a list is given. Defaults to 'config.Limits.concurrency'
+
+        Returns:
+
+            RedirectChain or list(RedirectChain), see 'generic._redirects'
+    '''
+    return _call('redirects', url, **kwargs)
 
-def google_search(q, num=100):
+def google_search(q, num=100, **kwargs):
     '''
         Runs a google search and returns a Pandas DataFrame of the results
             (Rank as int, Title as str, link as str, and domain as str)
@@ -269,19 +424,195 @@ def google_search(q, num=100):
             keyword (str or list): A search query or list of queriess to
                 be searched
 
-        Returns:
+            num (int): Results requested per page
+
+        Kwargs:
+
+            pages (int): Result pages fetched per query. Defaults to 1
+
+            concurrency (int): Maximum number of queries run at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
 
-            Search Results Pandas.DataFrame or list(Pandas.DataFrame)
+            rate (float): Queries per second sent to Google by this call.
+                Defaults to 'config.Limits.rates'
 
-        ToDo:
+            burst (int): Queries that may be sent back to back before 'rate'
+                applies
+
+        Returns:
 
-            Make more robust
+            Search Results Pandas.DataFrame. For a list of queries the results
+                of every query are combined into one DataFrame indexed by
+                Query and Rank; queries that failed, e.g. stayed blocked by
+                Google, are logged and left out.
     '''
-    return run(search, q, num=100)
+    return _call('google_search', q, num, **kwargs)
 
 def pagespeed(url, **kwargs):
-    strategy = kwargs.get('strategy') if 'strategy' in kwargs else None
-    if isinstance(url, str):
-        return asyncio.run(_pagespeed(url, strategy=strategy))
-    elif isinstance(url, list):
-        return asyncio.run(batch(_pagespeed, url, strategy=strategy))
+    '''
+        Fetches the PageSpeed performance score of a given url or list of urls
+
+        Example:
+
+            In [1]:    from seo_tools import pagespeed
+
+                       pagespeed('https://www.example.com')
+
+            Out [1]:   [54, 87]
+
+        Args:
+
+            url (str or list): A url or list of urls to be tested
+
+        Kwargs:
+
+            strategy (str): strategy for the audit to
+                be run as. If none is given, both mobile and desktop
+                will be run.
+
+                    Options: 'mobile' || 'desktop'
+
+            incremental (bool): only audit pages that changed since their
+                last stored result, see 'incremental.if_changed'
+
+            concurrency (int): Maximum number of urls audited at once when a
+                list is given. Defaults to 'config.Limits.concurrency'
+
+            rate (float): Queries per second allowed against the PageSpeed API
+                by this call. Defaults to 'config.Limits.rates'
+
+            burst (int): Queries that may be sent back to back before 'rate'
+                applies
+
+        Returns:
+
+            Performance score or [mobile, desktop] scores (int || list(int)),
+                or a list of those for a list of urls. A strategy that failed
+                scores None.
+    '''
+    return _call('pagespeed', url, **kwargs)
+
+def aiter_lighthouse(urls, **kwargs):
+    '''
+        Streams lighthouse audits of an iterable of urls, yielding each result
+            as soon as it completes. Must be consumed inside a running event
+            loop; await 'seo_tools.utils.close_session()' when done.
+
+        Example:
+
+            In [1]:    from seo_tools import aiter_lighthouse
+
+                       async for url, reports in aiter_lighthouse(urls):
+                           writer.write(url, reports)
+
+        Args:
+
+            urls (iterable): Urls to be audited, consumed lazily
+
+        Kwargs:
+
+            strategy, category, split, fields, details, incremental: As for
+                'lighthouse'
+
+            concurrency, rate, burst: As for 'lighthouse'
+
+            ordered (bool): Yield results in input order instead of
+                completion order
+
+            buffer (int): Maximum results held back for ordered output,
+                defaults to twice the concurrency
+
+        Yields:
+
+            (url, result) tuples. The result is what 'lighthouse' would return
+                for the url, or the exception raised while auditing it
+    '''
+    from seo_tools.client import _audit_function, _audit_options, _stream_options
+    from seo_tools.generic import _lighthouse
+    from seo_tools.utils import stream
+
+    func = _audit_function(_lighthouse, kwargs)
+    return stream(func, urls, provider='pagespeed', **_audit_options(kwargs), **_stream_options(kwargs))
+
+def iter_lighthouse(urls, **kwargs):
+    '''
+        Synchronous version of 'aiter_lighthouse'
+
+        Example:
+
+            In [1]:    from seo_tools import iter_lighthouse
+
+                       for url, reports in iter_lighthouse(urls):
+                           writer.write(url, reports)
+
+        Args and Kwargs are the same as for 'aiter_lighthouse'
+    '''
+    from seo_tools.utils import iterate
+
+    return iterate(aiter_lighthouse(urls, **kwargs))
+
+def aiter_pagespeed(urls, **kwargs):
+    '''
+        Streams PageSpeed scores of an iterable of urls, yielding each result
+            as soon as it completes. Takes the same arguments as
+            'aiter_lighthouse'
+    '''
+    from seo_tools.client import _audit_function, _stream_options
+    from seo_tools.generic import _pagespeed
+    from seo_tools.utils import stream
+
+    return stream(_audit_function(_pagespeed, kwargs), urls, strategy=kwargs.get('strategy'), provider='pagespeed', **_stream_options(kwargs))
+
+def iter_pagespeed(urls, **kwargs):
+    ''' Synchronous version of 'aiter_pagespeed' '''
+    from seo_tools.utils import iterate
+
+    return iterate(aiter_pagespeed(urls, **kwargs))
+
+def audit(urls, checks=None, **kwargs):
+    '''
+        Runs several checks over a list of urls in one pass and returns the
+            combined results
+
+        Example:
+
+            In [1]:    from seo_tools import audit
+
+                       audit(urls, ['https', 'http2', 'pagespeed'])
+
+            Out [1]:   DataFrame
+
+        Args:
+
+            urls (list): Urls to be audited
+
+            checks (list): Checks to be run. Defaults to 'cdn', 'domain_age',
+                'http2', 'https', 'pagespeed' and 'moz'
+
+                    Options: 'cdn' || 'domain_age' || 'http2' || 'https'
+                               || 'pagespeed' || 'lighthouse' || 'moz'
+                               || 'mobile_friendly' || 'gt_metrix'
+
+        Kwargs:
+
+            concurrency (int): Urls audited at once. Defaults to
+                'config.Limits.concurrency'
+
+            workers (int): Threads used for blocking lookups such as WHOIS
+
+        Returns:
+
+            Pandas.DataFrame indexed by url with a column per check result and
+                an 'errors' column, see 'pipeline.aiter_audit'
+    '''
+    return _call('audit', urls, checks, **kwargs)
+
+def iter_audit(urls, checks=None, **kwargs):
+    '''
+        Streams the rows of 'audit' as (url, row dict) tuples as each url
+            completes. Takes the same arguments as 'audit', plus 'ordered'
+    '''
+    from seo_tools.pipeline import aiter_audit
+    from seo_tools.utils import iterate
+
+    return iterate(aiter_audit(urls, checks, **kwargs))
@@ -1,21 +1,210 @@
+import argparse
+import os
 import sys
 
-from datetime import datetime
-from seo_tools import lighthouse
-
-fname = "pyblighthouse_{}.csv".format(str(datetime.now())[:11])
-
-def blighthouse(urlLs=None):
-    f = open(sys.argv[1], 'r').read()
-    urlLs = [site for site in f.split('\n') if site != '']
-    lh = lighthouse(urlLs)
-    print('Writing Reports')
-    c = list(lh[0].desktop.categories.keys())
-    a = list(lh[0].mobile.audits.keys())
-    h = ['URL', 'Device'] + c + a
-    f = open(fname, 'w+')
-    f.write(",".join(h) + "\n")
-    for l in lh:
-        r = l.to_csv(c, a, f)
-    f.close()
-    return lh
+from datetime import datetime, timezone
+from seo_tools import iter_lighthouse, metrics
+from seo_tools.config import APIs, Jobs, Quotas
+from seo_tools.quota import QuotaExceeded
+
+fname = "pyblighthouse_{}.csv".format(str(datetime.now())[:10])
+
+
+def _read_urls(path, done):
+    ''' Streams the urls of an input file, skipping blanks and finished urls '''
+    with open(path, 'r') as f:
+        for line in f:
+            url = line.strip()
+            if url and url not in done:
+                yield url
+
+
+def _read_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def _read_columns(path):
+    ''' Returns the score columns of an existing output file, None if it is new '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'r') as f:
+        header = f.readline().strip().split(',')
+    return [c for c in header if c not in ('url', 'strategy', 'fetch_time')]
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='blighthouse',
+        description='Runs Lighthouse audits of a file of urls, one per line, writing each result '
+                    'to a CSV as soon as it completes. Finished urls are recorded in a checkpoint '
+                    'file, so a rerun with the same output skips them.')
+    parser.add_argument('input', help='file with one url per line')
+    parser.add_argument('-o', '--output', default=fname, help='CSV file to write (default: %(default)s)')
+    parser.add_argument('--checkpoint', help='file of finished urls (default: OUTPUT.done)')
+    parser.add_argument('--concurrency', type=int, help='urls audited at once')
+    parser.add_argument('--strategy', choices=['mobile', 'desktop'], help='run one strategy only (default: both)')
+    parser.add_argument('--categories', help='comma separated categories (default: %s)' % ','.join(APIs.lh_cats))
+    parser.add_argument('--incremental', action='store_true',
+                        help='only audit pages that changed since their last stored result')
+    parser.add_argument('--metrics', action='store_true', help='print request latency histograms when done')
+    return parser
+
+
+def blighthouse(argv=None):
+    args = _parser().parse_args(argv)
+    from seo_tools.export import to_frame
+
+    checkpoint = args.checkpoint or args.output + '.done'
+    done = _read_checkpoint(checkpoint)
+    columns = _read_columns(args.output)
+    if done:
+        print(f'Resuming: skipping {len(done)} finished urls', file=sys.stderr)
+
+    options = {'details': False}
+    if args.concurrency:
+        options['concurrency'] = args.concurrency
+    if args.strategy:
+        options['strategy'] = args.strategy
+    if args.categories:
+        options['category'] = [c.strip() for c in args.categories.split(',') if c.strip()]
+    if args.incremental:
+        options['incremental'] = True
+
+    if args.metrics:
+        metrics.collect()
+
+    rows = failed = deferred = 0
+    exceeded = None
+    with open(args.output, 'a') as out, open(checkpoint, 'a') as log:
+        for url, result in iter_lighthouse(_read_urls(args.input, done), **options):
+            if isinstance(result, QuotaExceeded):
+                # Not checkpointed either, reported once below
+                deferred += 1
+                exceeded = result
+                continue
+            if isinstance(result, Exception) or (isinstance(result, list) and None in result):
+                # Not checkpointed, a rerun retries it and the response
+                # cache serves any strategy that did succeed
+                failed += 1
+                print(f'Failed: {url}: {result!r}', file=sys.stderr)
+                continue
+            frame = to_frame([(url, result)], columns)
+            if columns is None:
+                columns = [c for c in frame.columns if c not in ('url', 'strategy', 'fetch_time')]
+                frame.to_csv(out, index=False)
+            else:
+                frame.to_csv(out, index=False, header=False)
+            out.flush()
+            log.write(url + '\n')
+            log.flush()
+            rows += len(frame)
+    print(f'Wrote {rows} rows to {args.output} ({failed} urls failed)', file=sys.stderr)
+    if deferred:
+        print(f'Deferred {deferred} urls, rerun once the quota resets: {exceeded}', file=sys.stderr)
+    if args.incremental:
+        from seo_tools.incremental import stats
+        print(f'{stats["unchanged"]} unchanged pages reused their stored results', file=sys.stderr)
+    if args.metrics:
+        metrics.collect().dump()
+    return rows
+
+
+def _queue_parser():
+    parser = argparse.ArgumentParser(
+        prog='seo_tools',
+        description='Runs audits through a durable job queue shared by any number of worker processes, '
+                    'see seo_tools.jobs.')
+    parser.add_argument('--queue', help='job queue file (default: %s)' % Jobs.path)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='add a job per url and check')
+    enqueue.add_argument('input', help='file with one url per line')
+    enqueue.add_argument('--checks', help='comma separated checks (default: pipeline.default_checks)')
+    enqueue.add_argument('--priority', type=int, default=Quotas.default_priority,
+                         help='higher priorities run first and may use more of a quota (default: %(default)s)')
+    enqueue.add_argument('--requeue', action='store_true', help='run finished and failed jobs again')
+
+    worker = commands.add_parser('worker', help='lease and run jobs until stopped')
+    worker.add_argument('--concurrency', type=int, help='jobs run at once')
+    worker.add_argument('--exit-when-done', action='store_true', help='stop once no job is queued or leased')
+    worker.add_argument('--metrics', action='store_true', help='print request latency histograms when done')
+
+    commands.add_parser('status', help='count jobs per check and state')
+
+    results = commands.add_parser('results', help='write finished jobs to a CSV, one row per url')
+    results.add_argument('-o', '--output', default='seo_tools_audit.csv', help='CSV file to write (default: %(default)s)')
+    results.add_argument('--errors', action='store_true', help='write the failed jobs instead')
+
+    retry = commands.add_parser('retry', help='queue failed jobs again')
+    retry.add_argument('--check', help='only jobs of this check')
+
+    commands.add_parser('quota', help='show the usage of every quota this period')
+    return parser
+
+
+def main(argv=None):
+    args = _queue_parser().parse_args(argv)
+    from seo_tools.jobs import JobQueue, states
+
+    queue = JobQueue(args.queue)
+    if args.command == 'enqueue':
+        from seo_tools.pipeline import default_checks
+
+        checks = [c.strip() for c in args.checks.split(',') if c.strip()] if args.checks else default_checks
+        added = queue.enqueue(_read_urls(args.input, ()), checks, args.priority, requeue=args.requeue)
+        print(f'Queued {added} jobs', file=sys.stderr)
+    elif args.command == 'worker':
+        from seo_tools.jobs import work, worker_name
+        from seo_tools.utils import run
+
+        if args.metrics:
+            metrics.collect()
+        name = worker_name()
+        print(f'Worker {name} started on {queue.path}', file=sys.stderr)
+        try:
+            counts = run(work(queue, concurrency=args.concurrency, worker=name, exit_when_done=args.exit_when_done))
+            print(f'Worker {name} ran {counts["done"]} jobs, {counts["failed"]} failed, '
+                  f'{counts["deferred"]} deferred by a quota', file=sys.stderr)
+        except KeyboardInterrupt:
+            print(f'Worker {name} stopped', file=sys.stderr)
+        if args.metrics:
+            metrics.collect().dump()
+    elif args.command == 'status':
+        print(f'{"check":<16}' + ''.join(f'{s:>9}' for s in states))
+        for check, counts in sorted(queue.status().items()):
+            print(f'{check:<16}' + ''.join(f'{counts[s]:>9}' for s in states))
+        for name, leased in queue.workers().items():
+            print(f'{name} holds {leased} jobs')
+        for check, (deferred, available) in queue.deferred().items():
+            print(f'{deferred} {check} jobs deferred by a quota until {datetime.fromtimestamp(available, timezone.utc):%Y-%m-%d %H:%M} UTC')
+    elif args.command == 'results':
+        import pandas as pd
+
+        if args.errors:
+            frame = pd.DataFrame.from_records(list(queue.errors()), columns=['url', 'check', 'attempts', 'error'])
+        else:
+            rows = {}
+            for url, _, result in queue.results():
+                row = rows.setdefault(url, {'url': url})
+                if result.get('errors'):
+                    result['errors'] = '; '.join(filter(None, [row.get('errors'), result['errors']]))
+                row.update(result)
+            frame = pd.DataFrame.from_records(list(rows.values()))
+        frame.to_csv(args.output, index=False)
+        print(f'Wrote {len(frame)} rows to {args.output}', file=sys.stderr)
+    elif args.command == 'retry':
+        print(f'Queued {queue.retry_failed(args.check)} failed jobs again', file=sys.stderr)
+    elif args.command == 'quota':
+        from seo_tools.quota import usage
+
+        for row in usage():
+            print(f'{row["provider"]:<16}{row["credential"]:<24}{row["period"]:<12}'
+                  f'{row["used"]:>9} of {row["budget"]:<9}{row["used"] / row["budget"]:>7.1%}')
+    queue.close()
+
+
+if __name__ == '__main__':
+    blighthouse()
@@ -1,13 +1,17 @@
 #!usr/bin/python
-import pandas as pd
-import requests
+import asyncio
+import logging
+import random
 
-from time import sleep
-from pprint import pprint
-from bs4 import BeautifulSoup
-from urllib.request import urlopen, Request
+import lxml.html
+
+from lxml import etree
 from urllib.parse import quote_plus
 
+from seo_tools.config import APIs
+from seo_tools.metrics import RequestRecord
+from seo_tools.utils import APIError, get, headers
+
 '''
 
 =====================
@@ -17,86 +21,167 @@ Conduct Google Search
 Conducts a google search and returns a Pandas DataFrame of SERP
     Names and Domains
 
+Queries run concurrently under the 'google' rate limit, retry policy and
+    circuit breaker, like the requests of every other provider. A captcha
+    or automation block is detected from the page that was fetched, and
+    only the blocked query backs off and retries; other queries carry on.
+
 '''
 
-def parseSERP(s, dat=None):
-    try:
-        t = s.find('h3').text
-    except:
-        t = None
-
-    try:
-        d = s.find('span', {'class': 'st'}).text
-    except:
-        d = None
-
-    try:
-        u = s.find('a')['href']
-        if '/url?q=' in u:
-            u = u.split('&')[0].replace('/url?q=','')
-    except:
-        u = None
-
-    if dat is None:
-        return {
-            'title':t,
-            'description':d,
-            'url':u
-        }
-    else:
-        dat['Title'].append(t)
-        dat['Description'].append(d)
-        dat['URL'].append(u)
-        return dat
-
-def _captchaCheck(u):
-    res = requests.get(u)
-    if res.status_code != 200:
-        print('Something went wrong')
-        if "To continue, please type the characters below:" in res.text:
-            print('There is a Captcha check occuring')
-            sleep(900);
-            return True
-        elif "your computer or network may be sending automated queries" in res.text:
-            print('There is an automation check occuring')
-            sleep(900);
-            return True
-        elif len(res.text)<10240:
-            print('The page is oddly small')
-            sleep(900);
-            return True
-
-def search(q, num=100):
-    url = 'https://google.com/search?start=0&num=%i&q=%s' % (num, quote_plus(q))
-    print(url)
-    _captchaCheck(url)
-    headers = {
-        'User-Agent':'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-US; rv:1.9.0.7) Gecko/2009021910 Firefox/3.0.7'
-        }
-    req = Request(url,None,headers)
-    try:
-        serps = BeautifulSoup(urlopen(req), 'lxml').select('#search')[0].select('.g')
-    except:
-        raise Error('Could not read search data')
-    data = {
-        'Rank': [],
-        'Query':[],
-        'Title':[],
-        'Description':[],
-        'URL':[],
-    }
-    r = 0
-    for s in serps:
-        if s.select('.st') != [] and s.select('h3') != [] and s.select('a') != []:
-            r += 1
-            data['Rank'].append(r)
-            data['Title'].append(s.select('h3')[0].text)
-            data['Description'].append(s.select('.st')[0].text)
-            u = s.select('a')[0]['href']
-            if '/url?q=' in u:
-                u = u.split('&')[0].replace('/url?q=','')
-            data['URL'].append(u)
-
-    data['Query'] = [q] * len(data['URL'])
-
-    return pd.DataFrame(data).set_index('Rank')
+# Seconds waited after the first block, doubled on every further block
+_backoff = 60
+_max_backoff = 900
+_retries = 4
+
+_block_markers = (
+    "To continue, please type the characters below:",
+    "your computer or network may be sending automated queries",
+    "detected unusual traffic from your computer network",
+)
+
+
+class Blocked(APIError):
+    ''' Raised when Google answers a query with a captcha or automation check '''
+
+
+_results = etree.XPath('//*[@id="search"]//*[contains(concat(" ", normalize-space(@class), " "), " g ")]')
+_columns = ['Rank', 'Query', 'Title', 'Description', 'URL']
+
+
+def _clean_href(u):
+    if '/url?q=' in u:
+        u = u.split('&')[0].replace('/url?q=','')
+    return u
+
+def parse_serp(html, q=None, offset=0):
+    '''
+        Parses the organic results of a Google SERP
+
+        Each result block is walked once, picking up its first title (h3),
+            link (a[href]) and description (.st). Blocks missing any of
+            them are skipped.
+
+        Args:
+
+            html (str or bytes): The SERP document
+
+        Kwargs:
+
+            q (str): The query, stored on every record
+
+            offset (int): Rank of the result before the first one on the page
+
+        Returns:
+
+            A list of {'Rank', 'Query', 'Title', 'Description', 'URL'} dicts
+
+        Raises:
+
+            APIError: If the document has no search results container
+    '''
+    root = lxml.html.fromstring(html)
+    if root.get_element_by_id('search', None) is None:
+        raise APIError('Could not read search data')
+    records = []
+    rank = offset
+    for block in _results(root):
+        title = description = url = None
+        for el in block.iter('h3', 'a', 'span', 'div'):
+            tag = el.tag
+            if tag == 'h3':
+                if title is None:
+                    title = el.text_content()
+            elif tag == 'a':
+                if url is None and el.get('href') is not None:
+                    url = el.get('href')
+            elif description is None and 'st' in (el.get('class') or '').split():
+                description = el.text_content()
+        if title is not None and description is not None and url is not None:
+            rank += 1
+            records.append({'Rank': rank, 'Query': q, 'Title': title,
+                            'Description': description, 'URL': _clean_href(url)})
+    return records
+
+def _read_serp(body):
+    ''' Decodes a fetched SERP, raising Blocked if it is a captcha or automation check '''
+    text = body.decode('utf-8', errors='replace')
+    for marker in _block_markers:
+        if marker in text:
+            raise Blocked(f'Google blocked the request: {marker}')
+    if len(text) < 10240:
+        raise Blocked('The page is oddly small')
+    return text
+
+async def _fetch(url):
+    record = RequestRecord('google', 'GET', url)
+    text = await get(url, parse=_read_serp, provider='google', headers=headers, record=record)
+    if text is None:
+        # Blocks are answered with these statuses, which the 'google'
+        # retry policy leaves to the longer backoff of '_fetch_with_backoff'
+        if record.status in (429, 503):
+            raise Blocked(f'Google blocked the request ({record.status})')
+        raise APIError(f'Google search failed for {url}: {record.error}')
+    return text
+
+async def _fetch_with_backoff(url):
+    delay = _backoff
+    for attempt in range(_retries + 1):
+        try:
+            return await _fetch(url)
+        except Blocked as e:
+            if attempt == _retries:
+                raise
+            wait = min(delay, _max_backoff) * random.uniform(0.8, 1.2)
+            logging.warning('%s. Retrying %s in %.0fs', e, url, wait)
+            await asyncio.sleep(wait)
+            delay *= 2
+
+async def search_records(q, num=100, pages=1):
+    '''
+        Runs a google search of a query and returns its results as records
+
+        Args:
+
+            q (str): The search query
+
+        Kwargs:
+
+            num (int): Results requested per page
+
+            pages (int): Pages fetched, one after the other. Stops early when
+                a page has no results.
+
+        Returns:
+
+            A list of records, see 'parse_serp'
+
+        Raises:
+
+            Blocked: If Google keeps blocking the query after every retry
+    '''
+    records = []
+    for page in range(pages):
+        url = APIs.google_search % (page * num, num, quote_plus(q))
+        found = parse_serp(await _fetch_with_backoff(url), q, len(records))
+        if not found:
+            break
+        records.extend(found)
+    return records
+
+def to_frame(records):
+    ''' Builds one search results DataFrame from the records of any number of queries '''
+    import pandas as pd
+
+    return pd.DataFrame.from_records(records, columns=_columns)
+
+async def search(q, num=100, pages=1):
+    '''
+        Runs a google search of a query
+
+        Takes the same arguments as 'search_records'
+
+        Returns:
+
+            Search Results Pandas.DataFrame indexed by Rank
+    '''
+    return to_frame(await search_records(q, num, pages)).set_index('Rank')
@@ -1,46 +1,162 @@
+import aiohttp
+import asyncio
 import logging
+import math
 import time
 
-from seo_tools.config import Credentials, APIs
-from seo_tools.utils import get, post
-
-c = Credentials
+from seo_tools.config import APIs, Limits
+from seo_tools.retry import RetryPolicy
+from seo_tools.utils import APIError, credentials, get, post
 
 
 class GTMetrix:
+    ''' The GT Metrix result class. The test results are set as attributes '''
 
-    def __init__(self, url):
+    def __init__(self, url, test_id=None, poll_state_url=None):
         self.url = url
-        self.test()
-
-    def test(self):
-        logging.info('Starting GT Metrix Test: {}\n'.format(self.url))
-        r = self.start()
-        if r[0]:
-            return self.fetch((c.gt_metrix.id, c.gt_metrix.key))
-        else:
-            return r[1]
-
-    def start(self):
-        r = post(APIs.gtm_start, data={'url':self.url}, auth=(c.gt_metrix.id, c.gt_metrix.key))
-        if r[0]:
-            self.test_id = r[1]['test_id']
-            self.poll_state_url = r[1]['poll_state_url']
-        return r
-
-    def fetch(self, auth):
-        r = get(self.poll_state_url, auth=auth)
-        if r[0]:
-            if r[1]['state'] == 'completed':
-                return self.parse(r[1])
-            else:
-                logging.info('GT Metrix Test Not Completed. Waiting and then trying again.')
-                time.sleep(10)
-                return self.fetch(auth)
-        else:
-            return r
+        self.test_id = test_id
+        self.poll_state_url = poll_state_url
 
     def parse(self, r):
         for key, val in r['results'].items():
             setattr(self, key, val)
         return self
+
+    def __repr__(self):
+        return f'<GTMetrix {self.url} {self.test_id}>'
+
+
+class GTMetrixPoller:
+    '''
+        Runs GT Metrix tests concurrently
+
+        Tests are started up to the account's concurrent test limit and every
+            running test is polled on the schedule of a single scheduler
+            task, each poll in a task of its own so a poll held up by
+            retries does not delay the others. Each test is first polled
+            after 'min_interval' seconds and the interval grows by 'backoff'
+            on every poll that finds it unfinished, up to 'max_interval'. A
+            test fails when a poll fails for good, or when it has not
+            completed after 'max_wait' seconds.
+
+        Polls are free and retried under the 'gt_metrix' retry policy.
+            Starting a test uses a credit, so only the statuses in
+            'start_statuses', which say the test was not started, are
+            retried.
+
+        Example:
+
+            In [1]:    poller = GTMetrixPoller()
+
+                       results = await asyncio.gather(*[poller.test(u) for u in urls])
+
+        Kwargs:
+
+            max_tests (int): Tests allowed to run at once, defaults to
+                'config.Limits.gt_metrix_tests'
+    '''
+
+    min_interval = 3
+    max_interval = 30
+    backoff = 1.5
+    max_wait = 15 * 60
+    start_statuses = (429,)
+
+    def __init__(self, max_tests=None):
+        self.max_tests = max_tests or Limits.gt_metrix_tests
+        self._slots = asyncio.Semaphore(self.max_tests)
+        self._tests = {}
+        self._polls = set()
+        self._wakeup = None
+        self._scheduler = None
+
+    @property
+    def _auth(self):
+        auth = credentials().gt_metrix
+        return aiohttp.BasicAuth(auth.id, auth.key)
+
+    async def test(self, url):
+        '''
+            Starts a test of a url and waits for it to complete
+
+            Returns:
+
+                GTMetrix object holding the test results
+
+            Raises:
+
+                APIError: If the test could not be started or failed
+        '''
+        async with self._slots:
+            logging.info('Starting GT Metrix Test: %s', url)
+            r = await post(APIs.gtm_start, data={'url': url}, auth=self._auth, provider='gt_metrix',
+                           retry=RetryPolicy(statuses=self.start_statuses))
+            if not r or 'test_id' not in r:
+                raise APIError(f'Could not start GT Metrix test for {url}: {r}')
+            test = GTMetrix(url, r['test_id'], r['poll_state_url'])
+            done = asyncio.get_running_loop().create_future()
+            now = time.monotonic()
+            self._tests[test] = [now + self.min_interval, self.min_interval, done, now + self.max_wait]
+            self._ensure_scheduler()
+            return await done
+
+    def _ensure_scheduler(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._scheduler is None or self._scheduler.done():
+            self._wakeup = asyncio.Event()
+            self._scheduler = asyncio.ensure_future(self._schedule())
+
+    async def _schedule(self):
+        while self._tests:
+            now = time.monotonic()
+            for test, entry in self._tests.items():
+                if entry[0] <= now:
+                    # Not due again until the poll has rescheduled it
+                    entry[0] = math.inf
+                    task = asyncio.ensure_future(self._poll(test))
+                    self._polls.add(task)
+                    task.add_done_callback(self._polls.discard)
+            self._wakeup.clear()
+            due = min(entry[0] for entry in self._tests.values())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if due == math.inf else due - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, test):
+        entry = self._tests[test]
+        done = entry[2]
+        if done.cancelled():
+            del self._tests[test]
+            self._wakeup.set()
+            return
+        try:
+            r = await get(test.poll_state_url, auth=self._auth, provider='gt_metrix', cost=0)
+            if not isinstance(r, dict):
+                # get() returns None once retries are exhausted or on a
+                # status that is not retried, so polling again is futile
+                raise APIError(f'Could not poll GT Metrix test for {test.url}: {r!r}')
+            state = r.get('state')
+            if state == 'completed':
+                try:
+                    result = test.parse(r)
+                except (KeyError, AttributeError) as e:
+                    raise APIError(f'Unreadable GT Metrix results for {test.url}: {e!r}')
+                del self._tests[test]
+                if not done.done():
+                    done.set_result(result)
+            elif state == 'error':
+                raise APIError(f'GT Metrix test failed for {test.url}: {r.get("error")}')
+            elif time.monotonic() >= entry[3]:
+                raise APIError(f'GT Metrix test for {test.url} did not complete within {self.max_wait}s')
+            else:
+                logging.debug('GT Metrix Test Not Completed: %s (%s)', test.url, state)
+                entry[1] = min(entry[1] * self.backoff, self.max_interval)
+                entry[0] = time.monotonic() + entry[1]
+        except Exception as e:
+            self._tests.pop(test, None)
+            if not done.done():
+                done.set_exception(e)
+        finally:
+            self._wakeup.set()
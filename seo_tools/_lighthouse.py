@@ -1,22 +1,166 @@
+import json
+import math
+import zlib
+
+from array import array
+
+from seo_tools.utils import APIError, loads
+
+
+# Audit fields that can be kept on a report, in storage order
+_fields = ('score', 'numericValue', 'displayValue', 'title')
+_default_fields = ('score', 'numericValue', 'displayValue')
+# Details of these types are images and are only kept when asked for
+_image_details = ('screenshot', 'filmstrip')
+
+
+def _number(value):
+    return math.nan if value is None else float(value)
+
+
+def _value(number):
+    return None if math.isnan(number) else number
 
 
 class LighthouseReport:
-    ''' The Lighthouse report class. Used to parse results of an audit '''
+    '''
+        The Lighthouse report class. Used to parse results of an audit
+
+        Only the numbers of a report are kept: category scores and the
+            score/numericValue of every audit are stored in float arrays (NaN
+            where a value is missing), displayValues and titles only when
+            asked for. The heavy 'details' sections of the audits are kept
+            zlib compressed and parsed on demand through 'details', or dropped
+            entirely with details=False.
+
+        Example:
+
+            In [1]:    report = LighthouseReport('mobile', response)
+
+                       report.score('performance')
+
+            Out [1]:   0.93
+
+                       report.numeric_value('first-contentful-paint')
+
+            Out [2]:   1203.5
+
+        Args:
+
+            strategy (str): The strategy the audit was run as
 
-    def __init__(self, strategy, r=None):
+            r (dict): A PageSpeed Insights API response
+
+        Kwargs:
+
+            fields (list): Audit fields to keep, out of 'score',
+                'numericValue', 'displayValue' and 'title'. Defaults to score,
+                numericValue and displayValue
+
+            details (bool): Keep the compressed audit details. Screenshots and
+                filmstrips are only kept when details='all'
+    '''
+
+    __slots__ = ('strategy', 'url', 'fetch_time', 'fields', 'category_ids', 'category_scores',
+                 'audit_ids', 'audit_scores', 'numeric_values', 'display_values', 'titles',
+                 '_index', '_details')
+
+    def __init__(self, strategy, r=None, fields=None, details=True):
         self.strategy = strategy
+        self.url = None
+        self.fetch_time = None
+        self.fields = tuple(f for f in _fields if f in (fields or _default_fields))
+        self.category_ids = ()
+        self.category_scores = array('d')
+        self.audit_ids = ()
+        self.audit_scores = None
+        self.numeric_values = None
+        self.display_values = None
+        self.titles = None
+        self._index = {}
+        self._details = None
         if r is not None:
-            self._parse(r)
-
-    def _parse(self, resp):
-        self.categories = {}
-        for key, value in resp['lighthouseResult']['categories'].items():
-            self.categories[key] = value
-        self.audits = {}
-        for key, value in resp['lighthouseResult']['audits'].items():
-            self.audits[key] = value
-
-    def _to_csv(self, u,  f):
-        s = open(f, 'w+')
-        st = f'{u}'
-            
+            self._parse(r, details)
+
+    def _parse(self, resp, details=True):
+        result = resp['lighthouseResult']
+        self.url = result.get('finalUrl') or result.get('requestedUrl')
+        self.fetch_time = result.get('fetchTime')
+        categories = result['categories']
+        self.category_ids = tuple(categories)
+        self.category_scores = array('d', (_number(c.get('score')) for c in categories.values()))
+        audits = result['audits']
+        self.audit_ids = tuple(audits)
+        self._index = {a: i for i, a in enumerate(self.audit_ids)}
+        if 'score' in self.fields:
+            self.audit_scores = array('d', (_number(a.get('score')) for a in audits.values()))
+        if 'numericValue' in self.fields:
+            self.numeric_values = array('d', (_number(a.get('numericValue')) for a in audits.values()))
+        if 'displayValue' in self.fields:
+            self.display_values = tuple(a.get('displayValue') for a in audits.values())
+        if 'title' in self.fields:
+            self.titles = tuple(a.get('title') for a in audits.values())
+        if details:
+            kept = {k: a['details'] for k, a in audits.items() if 'details' in a
+                    and (details == 'all' or a['details'].get('type') not in _image_details)}
+            self._details = zlib.compress(json.dumps(kept, separators=(',', ':')).encode('utf-8'))
+
+    def score(self, category):
+        ''' Returns the 0-1 score of a category, None if it has no score '''
+        return _value(self.category_scores[self.category_ids.index(category)])
+
+    def audit_score(self, audit):
+        ''' Returns the 0-1 score of an audit, None if it has no score '''
+        return _value(self.audit_scores[self._index[audit]])
+
+    def numeric_value(self, audit):
+        ''' Returns the numericValue of an audit, None if it has none '''
+        return _value(self.numeric_values[self._index[audit]])
+
+    def display_value(self, audit):
+        return self.display_values[self._index[audit]]
+
+    def details(self, audit=None):
+        '''
+            Decompresses and returns the details section of an audit, or of
+                every audit when none is given. Returns None when the details
+                were not kept.
+        '''
+        if self._details is None:
+            return None
+        details = json.loads(zlib.decompress(self._details))
+        return details if audit is None else details.get(audit)
+
+    @property
+    def categories(self):
+        ''' Category scores as a dict of {category: {'score': score}} '''
+        return {c: {'score': _value(s)} for c, s in zip(self.category_ids, self.category_scores)}
+
+    @property
+    def audits(self):
+        ''' The kept audit fields as a dict of {audit: {field: value}} '''
+        columns = {'score': self.audit_scores, 'numericValue': self.numeric_values,
+                   'displayValue': self.display_values, 'title': self.titles}
+        audits = {}
+        for i, audit in enumerate(self.audit_ids):
+            audits[audit] = {}
+            for field in self.fields:
+                value = columns[field][i]
+                audits[audit][field] = _value(value) if isinstance(value, float) else value
+        return audits
+
+    def __repr__(self):
+        return f'<LighthouseReport {self.strategy} {self.url}>'
+
+
+def parse_report(strategy, fields, details, body):
+    '''
+        Decodes a raw PageSpeed Insights response body into a LighthouseReport
+
+        Safe to run in a process pool: only the compact report is sent back.
+            See 'config.Decoding'.
+    '''
+    data = loads(body)
+    if 'lighthouseResult' not in data:
+        raise APIError(f'PageSpeed returned no report ({strategy})')
+    return LighthouseReport(strategy, data, fields, details)
@@ -1,13 +1,9 @@
-import asyncio
-import aiohttp
-
 import logging
 
-from seo_tools.utils import post
-from seo_tools.config import Credentials
+from seo_tools.utils import credentials, post
+from seo_tools.config import APIs
 
 
 async def mf_single(url):
-    request_url = f'https://searchconsole.googleapis.com/v1/urlTestingTools/mobileFriendlyTest:run?url={url}&key=%s'
-    resp = await post(request_url % Credentials.google.key)
-    return r['mobileFriendliness'] == 'MOBILE_FRIENDLY'
+    resp = await post(APIs.mf_api % (url, credentials().google.key), provider='mobile_friendly')
+    return resp['mobileFriendliness'] == 'MOBILE_FRIENDLY'
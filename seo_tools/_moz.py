@@ -1,37 +1,158 @@
 import asyncio
-import aiohttp
-
 import time
 import hmac
 import base64
 from hashlib import sha1
 from urllib.parse import urlencode, quote
 
-from seo_tools.config import Credentials
-from seo_tools.utils import get, post
+from seo_tools.config import APIs, Limits
+from seo_tools.utils import APIError, batch, credentials, get, post
+
+# Seconds a signature is valid for, and how long before expiry it is renewed
+_lifetime = 300
+_renew = 30
+_signature = None
 
-c = Credentials
+
+def _signed_params():
+    ''' Returns the AccessID/Expires/Signature parameters, reusing them until shortly before expiry '''
+    global _signature
+    moz = credentials().moz
+    if _signature is None or _signature[0] - _renew <= time.time() or _signature[2] != (moz.id, moz.key):
+        expires = str(int(time.time() + _lifetime))
+        _signature = (int(expires), {
+            "AccessID": moz.id,
+            "Expires": expires,
+            "Signature": base64.b64encode(hmac.new(moz.key.encode('utf-8'), (moz.id + '\n' + expires).encode('utf-8'), sha1).digest())
+        }, (moz.id, moz.key))
+    return _signature[1]
 
 def generate_moz_credentials(cols=103079215104):
     ''' Generate the necessary credentials for MozScapes API calls '''
 
-    expires = str(int(time.time() + 300))
     return urlencode({
         "Cols": cols,
         "Limit": 4,
-        "AccessID": c.moz.id,
-        "Expires": expires,
-        "Signature": base64.b64encode(hmac.new(c.moz.key.encode('utf-8'), (c.moz.id + '\n' + expires).encode('utf-8'), sha1).digest())
+        **_signed_params()
     })
 
 async def moz_single(url, cols=103079215104):
-    request_url = f'http://lsapi.seomoz.com/linkscape/url-metrics/{quote(url)}?{generate_moz_credentials(cols)}'
-    async with aiohttp.ClientSession() as session:
-        r = await get(session=session, url=request_url)
+    # Signed per attempt, after the rate limit wait, so the signature has
+    # not expired by the time the request is sent
+    r = await get(url=lambda: APIs.moz_api % (quote(url), generate_moz_credentials(cols)), provider='moz')
+    if not isinstance(r, dict) or 'pda' not in r or 'upa' not in r:
+        raise APIError(f'Unexpected Moz response for {url}: {str(r)[:200]}')
     return [r['pda'], r['upa']]
 
-async def moz_batch(url_list, cols=103079215104):
-    request_url = f'http://lsapi.seomoz.com/linkscape/url-metrics/?{generate_moz_credentials(cols)}'
-    async with aiohttp.ClientSession() as session:
-        data = await post(session=session, url=request_url, json=url_list)
+async def _moz_chunk(url_list, cols):
+    data = await post(url=lambda: APIs.moz_batch_api % generate_moz_credentials(cols), json=url_list,
+                      provider='moz', cost=len(url_list))
+    if not isinstance(data, list) or len(data) != len(url_list):
+        raise APIError(f'Unexpected Moz response for {len(url_list)} urls: {str(data)[:200]}')
     return [(r['pda'], r['upa']) for r in data]
+
+async def moz_batch(url_list, cols=103079215104, concurrency=None, chunk_size=None, rate=None, burst=None):
+    '''
+        Fetches Moz metrics for a list of urls of any length
+
+        The list is split into requests of at most 'chunk_size' urls, which
+            are sent concurrently under the Moz rate limit and merged back in
+            input order. Signatures are reused across requests until shortly
+            before they expire.
+
+        Args:
+
+            url_list (list): Urls to be looked up
+
+        Kwargs:
+
+            cols (int): Moz column bit flags
+
+            concurrency (int): Requests in flight, defaults to
+                'config.Limits.concurrency'
+
+            chunk_size (int): Urls per request, defaults to
+                'config.Limits.moz_batch_size'
+
+            rate (float), burst (int): Moz rate limit of this call, see
+                'utils.batch'
+
+        Returns:
+
+            A list of (pda, upa) tuples in the order of url_list, with the
+                exception in place of urls whose request failed
+    '''
+    chunk_size = chunk_size or Limits.moz_batch_size
+    chunks = [url_list[i:i + chunk_size] for i in range(0, len(url_list), chunk_size)]
+    results = await batch(_moz_chunk, chunks, concurrency, provider='moz', rate=rate, burst=burst, cols=cols)
+    merged = []
+    for chunk, result in zip(chunks, results):
+        merged.extend([result] * len(chunk) if isinstance(result, Exception) else result)
+    return merged
+
+class MozBatcher:
+    '''
+        Gathers the single url lookups of concurrent callers into Moz batch
+            requests, so each request under the Moz rate limit carries up to
+            'chunk_size' urls
+
+        A batch is sent as soon as it is full, or 'delay' seconds after its
+            first url arrived.
+
+        Example:
+
+            In [1]:    batcher = MozBatcher()
+
+                       metrics = await asyncio.gather(*[batcher.lookup(u) for u in urls])
+
+        Kwargs:
+
+            cols (int): Moz column bit flags
+
+            chunk_size (int): Urls per request, defaults to
+                'config.Limits.moz_batch_size'
+
+            delay (float): Seconds a partial batch waits for more urls
+    '''
+
+    def __init__(self, cols=103079215104, chunk_size=None, delay=0.5):
+        self.cols = cols
+        self.chunk_size = chunk_size or Limits.moz_batch_size
+        self.delay = delay
+        self._pending = []
+        self._timer = None
+        self._requests = set()
+
+    async def lookup(self, url):
+        ''' Returns the [pda, upa] of a url, as 'moz_single' does '''
+        done = asyncio.get_running_loop().create_future()
+        self._pending.append((url, done))
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._flush)
+        return list(await done)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        chunk, self._pending = self._pending[:self.chunk_size], self._pending[self.chunk_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._flush)
+        if chunk:
+            request = asyncio.ensure_future(self._send(chunk))
+            self._requests.add(request)
+            request.add_done_callback(self._requests.discard)
+
+    async def _send(self, chunk):
+        try:
+            results = await _moz_chunk([url for url, _ in chunk], self.cols)
+        except Exception as e:
+            for _, done in chunk:
+                if not done.done():
+                    done.set_exception(e)
+            return
+        for (_, done), result in zip(chunk, results):
+            if not done.done():
+                done.set_result(result)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+from collections import defaultdict
+from datetime import datetime
+
+from seo_tools.cache import get_cache
+from seo_tools.config import Cache, Limits
+from seo_tools.utils import batch, hostname
+
+'''
+
+=================
+Domain Age Engine
+=================
+
+Looks up domain creation dates concurrently. Urls are collapsed to their
+    registrable domain so every domain is queried once, lookups are capped
+    per WHOIS server (one server per top level domain) to avoid throttling,
+    and creation dates are cached on disk.
+
+'''
+
+# Public suffixes with more than one label that are common enough to matter
+_multi_label_suffixes = {
+    'ac.uk', 'co.uk', 'gov.uk', 'ltd.uk', 'me.uk', 'net.uk', 'org.uk', 'plc.uk',
+    'com.au', 'edu.au', 'gov.au', 'net.au', 'org.au',
+    'co.nz', 'net.nz', 'org.nz',
+    'co.jp', 'ne.jp', 'or.jp',
+    'co.in', 'net.in', 'org.in',
+    'co.za', 'org.za',
+    'com.br', 'net.br', 'org.br',
+    'com.cn', 'net.cn', 'org.cn',
+    'com.mx', 'com.ar', 'com.tr', 'com.sg', 'com.hk', 'com.tw', 'co.kr', 'co.il',
+}
+
+
+def registrable_domain(url):
+    '''
+        Returns the registrable domain of a url, e.g. 'blog.example.co.uk/page'
+            becomes 'example.co.uk'. Returns None for IP addresses and bare
+            host names.
+    '''
+    labels = hostname(url).rstrip('.').split('.')
+    if len(labels) < 2 or labels[-1].isdigit():
+        return None
+    size = 3 if '.'.join(labels[-2:]) in _multi_label_suffixes else 2
+    if len(labels) < size:
+        return None
+    return '.'.join(labels[-size:])
+
+
+def _creation_date(domain):
+    import whois
+
+    date = whois.whois(domain).creation_date
+    if isinstance(date, list):
+        date = min(d for d in date if isinstance(d, datetime)) if date else None
+    return date if isinstance(date, datetime) else None
+
+
+class DomainAges:
+    '''
+        Looks up domain creation dates for any number of concurrent callers
+
+        Lookups share one cap per WHOIS server, and callers asking for a
+            domain while it is being looked up share that lookup. Dates are
+            kept in the on-disk cache.
+
+        Kwargs:
+
+            per_server (int): Maximum lookups in flight against one WHOIS
+                server, defaults to 'config.Limits.whois_per_server'
+
+            executor (concurrent.futures.Executor): Where the blocking WHOIS
+                queries run, defaults to the loop's default executor
+    '''
+
+    def __init__(self, per_server=None, executor=None):
+        self.per_server = per_server or Limits.whois_per_server
+        self.executor = executor
+        self._servers = defaultdict(lambda: asyncio.Semaphore(self.per_server))
+        self._lookups = {}
+        self._cache = get_cache('whois', ttl=Cache.whois_ttl, max_bytes=None)
+
+    async def lookup(self, domain):
+        ''' Returns the creation date (datetime.datetime or None) of a registrable domain '''
+        if domain not in self._lookups:
+            self._lookups[domain] = asyncio.ensure_future(self._lookup(domain))
+            self._lookups[domain].add_done_callback(lambda _: self._lookups.pop(domain, None))
+        return await asyncio.shield(self._lookups[domain])
+
+    async def _lookup(self, domain):
+        cached = self._cache.get(domain)
+        if cached is not None:
+            return datetime.fromisoformat(cached)
+        async with self._servers[domain.rsplit('.', 1)[-1]]:
+            date = await asyncio.get_running_loop().run_in_executor(self.executor, _creation_date, domain)
+        if date is not None:
+            self._cache.set(domain, date.isoformat())
+        return date
+
+
+async def domain_ages(urls, concurrency=None, per_server=None):
+    '''
+        Fetches the creation dates of the domains of a list of urls
+
+        Args:
+
+            urls (list): Urls whose domain ages are to be fetched
+
+        Kwargs:
+
+            concurrency (int): Maximum WHOIS lookups in flight, defaults to
+                'config.Limits.concurrency'
+
+            per_server (int): Maximum lookups in flight against one WHOIS
+                server, defaults to 'config.Limits.whois_per_server'
+
+        Returns:
+
+            A list of datetime.datetime, or None where the date could not be
+                found, in the order of the urls
+    '''
+    ages = DomainAges(per_server)
+    domains = [registrable_domain(u) for u in urls]
+    unique = list(dict.fromkeys(d for d in domains if d))
+    dates = {}
+    results = await batch(ages.lookup, unique, concurrency)
+    for domain, result in zip(unique, results):
+        if isinstance(result, Exception):
+            logging.info('WHOIS lookup failed for %s: %r', domain, result)
+            result = None
+        dates[domain] = result
+    return [dates.get(d) for d in domains]
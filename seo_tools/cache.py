@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from seo_tools.config import Cache
+
+'''
+
+===========
+Local Cache
+===========
+
+A small SQLite backed key/value store with per-entry expiry and
+    size-bounded LRU eviction. Values are stored zlib compressed, either as
+    raw bytes or as JSON.
+
+'''
+
+_caches = {}
+_private_params = ('key', 'AccessID', 'Expires', 'Signature')
+
+
+class SQLiteCache:
+    '''
+        A persistent key/value cache stored in a single SQLite table
+
+        Args:
+
+            path (str): Path of the SQLite database file
+
+        Kwargs:
+
+            table (str): Name of the table holding the entries, so several
+                caches can share one file
+
+            ttl (int): Default lifetime of an entry in seconds, None to keep
+                entries until they are evicted
+
+            max_bytes (int): Maximum size of the stored payloads, None for no
+                limit
+    '''
+
+    def __init__(self, path, table='responses', ttl=None, max_bytes=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL,
+                accessed REAL NOT NULL
+            )''')
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+
+    def get_bytes(self, key):
+        ''' Returns the bytes stored under key, or None if missing or expired '''
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f'SELECT value, expires FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= now:
+                self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return None
+            self._db.execute(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', (now, key))
+        return zlib.decompress(row[0])
+
+    def set_bytes(self, key, value, ttl=None):
+        ''' Stores bytes, e.g. a raw response body, under key '''
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        blob = zlib.compress(value)
+        with self._lock:
+            self._db.execute(
+                f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)',
+                (key, blob, len(blob), now + ttl if ttl else None, now))
+            self._evict(now)
+
+    def get(self, key, default=None):
+        ''' Returns the value stored under key, or default if missing or expired '''
+        value = self.get_bytes(key)
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ''' Stores a JSON serialisable value under key '''
+        self.set_bytes(key, json.dumps(value, separators=(',', ':')).encode('utf-8'), ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute(f'DELETE FROM {self.table}')
+
+    def size(self):
+        ''' Returns the total size of the stored payloads in bytes '''
+        with self._lock:
+            return self._db.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def _evict(self, now):
+        self._db.execute(f'DELETE FROM {self.table} WHERE expires <= ?', (now,))
+        if self.max_bytes is None:
+            return
+        total = self._db.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        stale = []
+        for key, size in self._db.execute(f'SELECT key, size FROM {self.table} ORDER BY accessed'):
+            stale.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._db.executemany(f'DELETE FROM {self.table} WHERE key = ?', stale)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_cache(table='responses', **kwargs):
+    '''
+        Returns the process-wide cache stored in the table of the file named
+            by 'config.Cache.path', creating it on first use. Keyword
+            arguments are only applied when the cache is created.
+    '''
+    if table not in _caches:
+        kwargs.setdefault('ttl', Cache.ttl)
+        kwargs.setdefault('max_bytes', Cache.max_bytes)
+        _caches[table] = SQLiteCache(Cache.path, table=table, **kwargs)
+    return _caches[table]
+
+
+def normalize_url(url):
+    '''
+        Normalizes a page url so equivalent spellings share a cache entry:
+            lower-cases the scheme and host, drops default ports, fragments
+            and a bare trailing slash.
+    '''
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path if parts.path not in ('', '/') else ''
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+def request_key(method, url):
+    '''
+        Builds the cache key of an API request. Query parameters are sorted,
+            credentials are dropped and a 'url' parameter is normalized, so
+            the key depends only on the audited url, strategy and categories.
+    '''
+    parts = urlsplit(url)
+    params = []
+    for k, v in parse_qsl(parts.query, keep_blank_values=True):
+        if k in _private_params:
+            continue
+        params.append((k, normalize_url(v) if k == 'url' else v))
+    query = urlencode(sorted(params))
+    return f'{method} {parts.scheme}://{parts.netloc.lower()}{parts.path}?{query}'
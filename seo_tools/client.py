@@ -0,0 +1,262 @@
+import logging
+
+from contextlib import contextmanager
+
+from seo_tools.cache import SQLiteCache, get_cache
+from seo_tools.config import Cache, Credentials, Limits
+from functools import partial
+
+from seo_tools.generic import _alpn_probe, _cdn, _domain_age, _http2, _https, _lighthouse, _mobile_friendly, _pagespeed, _redirects
+from seo_tools.incremental import if_changed
+from seo_tools.utils import _client, _limiters, batch, new_session
+from seo_tools._gt_metrix import GTMetrixPoller
+from seo_tools._moz import moz_single, moz_batch
+from seo_tools._whois import domain_ages
+
+'''
+
+==========
+SEO Client
+==========
+
+An async client that can be kept for the lifetime of a service and used
+    from inside its event loop, e.g. from Jupyter or an aiohttp handler.
+    Connections stay warm across calls, which the synchronous functions of
+    'seo_tools' cannot offer as each of them runs its own event loop.
+
+'''
+
+
+def _batch_options(kwargs):
+    ''' Picks the batch settings out of the keyword arguments of a shell function '''
+    return {k: kwargs[k] for k in ('concurrency', 'rate', 'burst') if k in kwargs}
+
+def _audit_options(kwargs):
+    ''' Picks the lighthouse audit settings out of the keyword arguments of a shell function '''
+    return {k: kwargs[k] for k in ('strategy', 'category', 'split', 'fields', 'details') if k in kwargs}
+
+def _audit_function(func, kwargs):
+    ''' Wraps a lighthouse or pagespeed audit in 'incremental.if_changed' when kwargs ask for it '''
+    return partial(if_changed, func) if kwargs.get('incremental') else func
+
+def _stream_options(kwargs):
+    ''' Picks the streaming settings out of the keyword arguments of a shell function '''
+    options = _batch_options(kwargs)
+    options.update({k: kwargs[k] for k in ('ordered', 'buffer') if k in kwargs})
+    return options
+
+
+class SEOClient:
+    '''
+        The async client of every check of the toolkit
+
+        The client owns a connection pool, a response cache, rate limiters,
+            a GT Metrix poller and a set of credentials. They are used by
+            every call made through it, including the requests it sends
+            concurrently, and are released by 'close'.
+
+        Every method takes a url or a list of urls and the same keyword
+            arguments as the function of the same name in 'seo_tools', and
+            returns the same results.
+
+        Example:
+
+            In [1]:    async with SEOClient() as client:
+
+                           report = await client.lighthouse('https://www.example.com', strategy='mobile')
+
+                           scores = await client.pagespeed(urls)
+
+        Kwargs:
+
+            credentials (object): Holds 'google', 'gt_metrix' and 'moz'
+                config.Auth credentials. Defaults to 'config.Credentials'
+
+            cache (bool, str or SQLiteCache): The response cache. True opens
+                one at 'config.Cache.path' when 'config.Cache.enabled' is set,
+                a str opens one at that path, False disables caching. A cache
+                that is passed in is not closed by the client
+
+            rates (dict): Overrides of 'config.Limits.rates'
+
+            limiters (dict): Rate limiters to share with other clients,
+                keyed by provider. Defaults to a set of the client's own
+
+            concurrency (int): Calls in flight when a list is given. Defaults
+                to 'config.Limits.concurrency'
+
+            max_tests (int): GT Metrix tests run at once, defaults to
+                'config.Limits.gt_metrix_tests'
+    '''
+
+    def __init__(self, credentials=None, cache=True, rates=None, limiters=None, concurrency=None, max_tests=None):
+        self.credentials = credentials or Credentials
+        self.rates = {**Limits.rates, **(rates or {})}
+        self.concurrency = concurrency or Limits.concurrency
+        self._limiters = {} if limiters is None else limiters
+        self._owns_cache = cache is True or isinstance(cache, str)
+        if cache is True:
+            cache = SQLiteCache(Cache.path, ttl=Cache.ttl, max_bytes=Cache.max_bytes) if Cache.enabled else None
+        elif isinstance(cache, str):
+            cache = SQLiteCache(cache, ttl=Cache.ttl, max_bytes=Cache.max_bytes)
+        # An empty SQLiteCache is falsy, so test for identity
+        self.cache = None if cache is None or cache is False else cache
+        self._session = None
+        self._poller = GTMetrixPoller(max_tests)
+
+    @property
+    def session(self):
+        ''' The client's aiohttp.ClientSession, created on first use inside the event loop '''
+        if self._session is None or self._session.closed:
+            self._session = new_session()
+        return self._session
+
+    async def close(self):
+        ''' Closes the connection pool, and the response cache if the client opened it '''
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._owns_cache and self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @contextmanager
+    def _active(self):
+        ''' Routes the sessions, limiters, cache and credentials of the calls made within to the client '''
+        token = _client.set(self)
+        try:
+            yield self
+        finally:
+            _client.reset(token)
+
+    def _options(self, kwargs):
+        options = _batch_options(kwargs)
+        options.setdefault('concurrency', self.concurrency)
+        return options
+
+    async def lighthouse(self, url, **kwargs):
+        ''' Runs lighthouse audits, see 'seo_tools.lighthouse' '''
+        func = _audit_function(_lighthouse, kwargs)
+        with self._active():
+            if isinstance(url, str):
+                return await func(url, **_audit_options(kwargs))
+            return await batch(func, url, provider='pagespeed', **_audit_options(kwargs), **self._options(kwargs))
+
+    async def pagespeed(self, url, **kwargs):
+        ''' Fetches PageSpeed performance scores, see 'seo_tools.pagespeed' '''
+        strategy = kwargs.get('strategy')
+        func = _audit_function(_pagespeed, kwargs)
+        with self._active():
+            if isinstance(url, str):
+                return await func(url, strategy=strategy)
+            return await batch(func, url, strategy=strategy, provider='pagespeed', **self._options(kwargs))
+
+    async def moz(self, url, cols=103079215104, **kwargs):
+        ''' Fetches Moz metrics, see 'seo_tools.moz' '''
+        with self._active():
+            if isinstance(url, str):
+                return await moz_single(url, cols)
+            return await moz_batch(list(url), cols, kwargs.get('concurrency', self.concurrency), kwargs.get('chunk_size'),
+                                   kwargs.get('rate'), kwargs.get('burst'))
+
+    async def gt_metrix(self, url, **kwargs):
+        '''
+            Runs GT Metrix tests, see 'seo_tools.gt_metrix'. Tests of every
+                call share the client's poller, and so its test limit, unless
+                'max_tests' is given
+        '''
+        poller = GTMetrixPoller(kwargs['max_tests']) if kwargs.get('max_tests') else self._poller
+        with self._active():
+            if isinstance(url, str):
+                return await poller.test(url)
+            return await batch(poller.test, url, concurrency=poller.max_tests)
+
+    async def mobile_friendly(self, url, **kwargs):
+        ''' Runs Mobile Friendly tests, see 'seo_tools.mobile_friendly' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _mobile_friendly(url)
+            return await batch(_mobile_friendly, url, provider='mobile_friendly', **self._options(kwargs))
+
+    async def cdn(self, url, **kwargs):
+        ''' Looks up CDNs, see 'seo_tools.cdn' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _cdn(url)
+            return await batch(_cdn, url, **self._options(kwargs))
+
+    async def domain_age(self, url, **kwargs):
+        ''' Looks up domain creation dates, see 'seo_tools.domain_age' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _domain_age(url)
+            return await domain_ages(url, kwargs.get('concurrency'), kwargs.get('per_server'))
+
+    async def http2(self, url, **kwargs):
+        ''' Checks for HTTP/2 support, see 'seo_tools.http2' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _http2(url)
+            return await batch(_http2, url, **self._options(kwargs))
+
+    async def protocol(self, url, **kwargs):
+        ''' Probes the negotiated protocol, see 'seo_tools.protocol' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _alpn_probe(url, kwargs.get('timeout'))
+            return await batch(_alpn_probe, url, timeout=kwargs.get('timeout'), **self._options(kwargs))
+
+    async def https(self, url, **kwargs):
+        ''' Checks for HTTPS redirects, see 'seo_tools.https' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _https(url)
+            return await batch(_https, url, **self._options(kwargs))
+
+    async def redirects(self, url, **kwargs):
+        ''' Follows redirect chains, see 'seo_tools.redirects' '''
+        with self._active():
+            if isinstance(url, str):
+                return await _redirects(url)
+            return await batch(_redirects, url, **self._options(kwargs))
+
+    async def google_search(self, q, num=100, **kwargs):
+        ''' Runs google searches, see 'seo_tools.google_search' '''
+        from seo_tools._google_search import search, search_records, to_frame as serp_frame
+
+        pages = kwargs.get('pages', 1)
+        with self._active():
+            if isinstance(q, str):
+                return await search(q, num, pages)
+            q = list(q)
+            results = await batch(search_records, q, provider='google', num=num, pages=pages, **self._options(kwargs))
+        records = []
+        for query, result in zip(q, results):
+            if isinstance(result, Exception):
+                logging.warning('Search failed for %r: %r', query, result)
+            else:
+                records.extend(result)
+        return serp_frame(records).set_index(['Query', 'Rank'])
+
+    async def audit(self, urls, checks=None, **kwargs):
+        ''' Runs several checks over a list of urls, see 'seo_tools.audit' '''
+        from seo_tools.pipeline import audit_frame
+
+        kwargs.setdefault('concurrency', self.concurrency)
+        with self._active():
+            return await audit_frame(urls, checks, **kwargs)
+
+
+def default_client():
+    '''
+        Returns a new SEOClient sharing the process-wide rate limiters and
+            response cache, as used by the synchronous functions of
+            'seo_tools'
+    '''
+    return SEOClient(cache=get_cache() if Cache.enabled else False, limiters=_limiters)
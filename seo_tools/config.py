@@ -18,6 +18,165 @@ class Credentials:
     moz = Auth(('account', 'key'))
 
 
+class Network:
+    '''
+        Settings for the shared connection pool used by every async API call.
+
+        Change these before the first request is sent, e.g.
+
+            from seo_tools.config import Network
+            Network.limit_per_host = 20
+    '''
+
+    limit = 100
+    limit_per_host = 10
+    ttl_dns_cache = 300
+    keepalive_timeout = 30
+    timeout = 120
+    probe_timeout = 10
+
+
+class Limits:
+    '''
+        Default batch concurrency and per-provider rate limits.
+
+        Rates are given as (queries per second, burst) and are shared by every
+            request sent to that provider within the process. A rate of None
+            disables limiting for the provider.
+    '''
+
+    concurrency = 20
+    whois_per_server = 2
+    gt_metrix_tests = 2
+    moz_batch_size = 10
+    rates = {
+        'pagespeed': (4, 10),           # 400 queries per 100 seconds
+        'mobile_friendly': (1, 5),
+        'moz': (0.1, 1),                # free tier, one call every ten seconds
+        'gt_metrix': (1, 2),
+        'google': (0.2, 1),
+    }
+
+
+class Retries:
+    '''
+        Retry policy of API requests, see 'retry.RetryPolicy'.
+
+        A request is retried on connection errors, timeouts and the
+            'statuses' below, up to 'attempts' attempts in all. Each retry
+            waits a random time between zero and backoff * 2 ** attempt
+            seconds, capped at 'max_backoff', or longer if the server asks
+            for it with Retry-After. No retry is made once the request has
+            taken 'deadline' seconds. 'providers' overrides any of these
+            per provider.
+
+        The circuit breaker of a provider opens when at least
+            'breaker_threshold' of its last 'breaker_window' attempts failed,
+            pausing every request to it for 'breaker_cooldown' seconds.
+    '''
+
+    attempts = 4
+    statuses = (429, 500, 502, 503, 504)
+    backoff = 0.5
+    max_backoff = 30
+    deadline = 300
+    providers = {
+        'google': {'statuses': (500, 502, 504)},       # 429 and 503 are blocks, see '_google_search'
+        'moz': {'backoff': 10, 'max_backoff': 60},     # free tier, one call every ten seconds
+    }
+    breaker_window = 20
+    breaker_threshold = 0.5
+    breaker_cooldown = 30
+
+
+class Quotas:
+    '''
+        Usage budgets of the credentials in 'Credentials', see 'quota'.
+
+        'budgets' gives a provider's budget as (units, 'day' or 'month') per
+            credential, None for no budget. A request uses one unit, except
+            that GT Metrix polls are free and Moz batches use one unit per
+            url. Periods follow UTC.
+
+        Work of a priority may only use its share of a budget, looked up in
+            'shares' (the share of the highest level at or below it), so
+            that low priority work stops early and leaves the rest for
+            more important work. Work without a priority runs at
+            'default_priority'. Usage counters are kept at 'path'.
+    '''
+
+    enabled = True
+    path = os.path.join(os.path.expanduser('~'), '.cache', 'seo_tools', 'quotas.sqlite')
+    budgets = {
+        'pagespeed': (25000, 'day'),
+        'mobile_friendly': (2000, 'day'),
+        'moz': None,                    # e.g. (5000, 'month') for your plan's rows
+        'gt_metrix': None,              # e.g. (200, 'month') for your plan's credits
+    }
+    shares = {0: 0.8, 1: 0.95, 2: 1.0}
+    default_priority = 1
+
+
+class Cache:
+    '''
+        Settings for the local on-disk cache of API responses.
+
+        PageSpeed/Lighthouse responses are kept for 'ttl' seconds. Once the
+            stored (compressed) payloads exceed 'max_bytes', the least recently
+            used entries are evicted. Domain creation dates practically never
+        change and are kept for 'whois_ttl' seconds.
+
+        Incremental audits keep the last result of every page, together with
+            its validators, for 'audit_ttl' seconds, after which the page is
+            audited again even if it did not change. They are evicted beyond
+            'audit_max_bytes'.
+    '''
+
+    enabled = True
+    path = os.path.join(os.path.expanduser('~'), '.cache', 'seo_tools', 'cache.sqlite')
+    ttl = 12 * 60 * 60
+    max_bytes = 256 * 1024 * 1024
+    whois_ttl = 365 * 24 * 60 * 60
+    audit_ttl = 7 * 24 * 60 * 60
+    audit_max_bytes = 512 * 1024 * 1024
+
+
+class Jobs:
+    '''
+        Settings of the job queue run by 'seo_tools worker', see 'jobs'.
+
+        A leased job that is not finished or extended within 'visibility'
+            seconds is handed to another worker. Failed jobs are retried
+            after retry_delay * 2 ** (attempts - 1) seconds, up to
+            'max_attempts' attempts. Idle workers look for new jobs every
+            'poll_interval' seconds.
+    '''
+
+    path = os.path.join(os.path.expanduser('~'), '.cache', 'seo_tools', 'jobs.sqlite')
+    visibility = 15 * 60
+    max_attempts = 3
+    retry_delay = 60
+    poll_interval = 5
+
+
+class Decoding:
+    '''
+        Where response bodies are decoded and parsed.
+
+        Lighthouse responses run to several megabytes of JSON, and decoding
+            them on the event loop stalls every other request in flight.
+            Bodies of at least 'min_bytes' are handed to a pool instead:
+            'thread' uses the loop's default thread pool, 'process' a pool
+            of 'workers' processes that send back only the parsed result.
+            None decodes everything inline. orjson is used for decoding when
+            it is installed.
+    '''
+
+    executor = None
+    workers = None
+    min_bytes = 256 * 1024
+
+
 class APIs:
 
     lh_cats = ['accessibility', 'best-practices', 'performance', 'pwa', 'seo']
@@ -28,6 +187,4 @@ class APIs:
     gtm_fetch = 'https://gtmetrix.com/api/0.1/test/%s'
     moz_api = 'http://lsapi.seomoz.com/linkscape/url-metrics/%s?%s'
     moz_batch_api = 'http://lsapi.seomoz.com/linkscape/url-metrics/?%s'
-
-
-    lh_api = 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url=%s&category=performance&strategy=mobile&key=%s'
+    google_search = 'https://www.google.com/search?start=%i&num=%i&q=%s'
@@ -0,0 +1,207 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from seo_tools._lighthouse import LighthouseReport
+
+'''
+
+=========================
+Lighthouse Result Exports
+=========================
+
+Turns batches of Lighthouse results into one wide DataFrame, with a row per
+    url and strategy, category scores as 'category.<id>' columns and audit
+    numericValues as 'audit.<id>' columns, all typed float64. The writers
+    export in chunks, so result streams of any length can be written with
+    flat memory.
+
+Results are passed as (url, result) pairs, e.g.
+    zip(urls, lighthouse(urls)) or the output of iter_lighthouse(urls).
+
+'''
+
+_key_columns = ['url', 'strategy', 'fetch_time']
+
+
+def _reports(pairs):
+    for url, result in pairs:
+        if isinstance(result, LighthouseReport):
+            yield url, result
+        elif isinstance(result, (list, tuple)):
+            for report in result:
+                if isinstance(report, LighthouseReport):
+                    yield url, report
+
+
+class _Columns:
+    ''' Maps category and audit ids to column positions, growing as new ids are seen '''
+
+    def __init__(self, columns=None):
+        self.names = []
+        self.positions = {}
+        self._cache = {}
+        for name in columns or ():
+            self._add(name)
+
+    def _add(self, name):
+        if name not in self.positions:
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+
+    def index(self, prefix, ids, grow=True):
+        ''' Returns (source positions, column positions) of the ids that have a column '''
+        key = (prefix, ids, grow)
+        if key not in self._cache:
+            names = [f'{prefix}.{i}' for i in ids]
+            if grow:
+                for name in names:
+                    self._add(name)
+            found = [(i, self.positions[n]) for i, n in enumerate(names) if n in self.positions]
+            self._cache[key] = (np.array([f[0] for f in found], dtype=np.intp),
+                                np.array([f[1] for f in found], dtype=np.intp))
+        return self._cache[key]
+
+
+def to_frame(pairs, columns=None):
+    '''
+        Builds a DataFrame of Lighthouse results
+
+        Example:
+
+            In [1]:    from seo_tools import lighthouse
+                       from seo_tools.export import to_frame
+
+                       df = to_frame(zip(urls, lighthouse(urls)))
+
+                       df['category.performance'].mean()
+
+            Out [1]:   0.71
+
+        Args:
+
+            pairs (iterable): (url, result) pairs, where result is a
+                LighthouseReport or a list of them. Failed results (None or
+                exceptions) are skipped.
+
+        Kwargs:
+
+            columns (list): Fixed set of score columns to build. Ids outside
+                of it are dropped and missing ones are NaN. By default every
+                category and audit seen becomes a column.
+
+        Returns:
+
+            Pandas.DataFrame with 'url', 'strategy' and 'fetch_time' columns
+                followed by the float score columns
+    '''
+    layout = _Columns(columns)
+    grow = columns is None
+    keys = []
+    rows = []
+    for url, report in _reports(pairs):
+        keys.append((url, report.strategy, report.fetch_time))
+        rows.append(report)
+    placed = []
+    for report in rows:
+        category = layout.index('category', report.category_ids, grow)
+        audit = layout.index('audit', report.audit_ids, grow) if report.numeric_values is not None else None
+        placed.append((report, category, audit))
+    values = np.full((len(rows), len(layout.names)), np.nan)
+    for row, (report, category, audit) in enumerate(placed):
+        values[row, category[1]] = np.frombuffer(report.category_scores)[category[0]]
+        if audit is not None:
+            values[row, audit[1]] = np.frombuffer(report.numeric_values)[audit[0]]
+    frame = pd.DataFrame(values, columns=layout.names)
+    frame.insert(0, 'url', [k[0] for k in keys])
+    frame.insert(1, 'strategy', [k[1] for k in keys])
+    frame.insert(2, 'fetch_time', [k[2] for k in keys])
+    return frame
+
+
+def _chunks(pairs, chunksize):
+    pairs = iter(pairs)
+    while True:
+        chunk = list(itertools.islice(pairs, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _frames(pairs, chunksize, columns):
+    empty = None
+    for chunk in _chunks(pairs, chunksize):
+        frame = to_frame(chunk, columns)
+        if columns is None:
+            if frame.empty:
+                # Only failed results, which say nothing about the columns
+                empty = frame
+                continue
+            columns = [c for c in frame.columns if c not in _key_columns]
+        yield frame
+    if columns is None and empty is not None:
+        yield empty
+
+
+def write_csv(pairs, path, chunksize=1000, columns=None):
+    '''
+        Writes Lighthouse results to a CSV file, chunksize rows at a time.
+            The score columns are fixed by 'columns' or by the first chunk
+            with a successful result.
+
+        Returns:
+
+            The number of rows written
+    '''
+    written = 0
+    for frame in _frames(pairs, chunksize, columns):
+        frame.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += len(frame)
+    return written
+
+
+def _write_arrow(pairs, path, chunksize, columns, open_writer):
+    import pyarrow as pa
+
+    writer = None
+    written = 0
+    try:
+        for frame in _frames(pairs, chunksize, columns):
+            frame['fetch_time'] = frame['fetch_time'].astype('string')
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = open_writer(path, schema)
+            writer.write_table(table.cast(schema))
+            written += len(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def write_parquet(pairs, path, chunksize=1000, columns=None):
+    '''
+        Writes Lighthouse results to a Parquet file, one row group per chunk.
+            Requires pyarrow.
+
+        Returns:
+
+            The number of rows written
+    '''
+    import pyarrow.parquet as pq
+    return _write_arrow(pairs, path, chunksize, columns, pq.ParquetWriter)
+
+
+def write_feather(pairs, path, chunksize=1000, columns=None):
+    '''
+        Writes Lighthouse results to a Feather (Arrow IPC) file, one record
+            batch per chunk. Requires pyarrow.
+
+        Returns:
+
+            The number of rows written
+    '''
+    import pyarrow as pa
+    return _write_arrow(pairs, path, chunksize, columns, pa.ipc.new_file)
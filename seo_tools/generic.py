@@ -1,18 +1,51 @@
+import aiohttp
 import asyncio
-import socket
-import whois
+import ssl
+import time
 import logging
-import requests
 
-from ipwhois import IPWhois
-from hyper import HTTP20Connection
+from collections import namedtuple
+from functools import partial
+from urllib.parse import quote
+from yarl import URL
 
-from seo_tools.utils import get, clean_url
-from seo_tools._lighthouse import LighthouseReport
+from seo_tools.config import APIs, Network
+from seo_tools.resolver import get_resolver
+from seo_tools._whois import domain_ages
+from seo_tools.utils import APIError, batch, credentials, get, post, get_session, clean_url, hostname, loads
+from seo_tools.quota import QuotaExceeded
+from seo_tools._lighthouse import LighthouseReport, parse_report
 
 
+ProtocolProbe = namedtuple('ProtocolProbe', ['url', 'protocol', 'handshake_time', 'error'])
+RedirectHop = namedtuple('RedirectHop', ['url', 'status', 'latency'])
+_alpn_context = None
+_redirect_statuses = (301, 302, 303, 307, 308)
 
-def _cdn(url):
+
+class RedirectChain(namedtuple('RedirectChain', ['url', 'hops', 'final_url', 'error'])):
+    ''' The hops followed from a url to its final destination '''
+
+    __slots__ = ()
+
+    @property
+    def https(self):
+        ''' True if the chain ends on an https url '''
+        return self.final_url is not None and self.final_url.startswith('https://')
+
+    @property
+    def latency(self):
+        ''' Total time to the headers of every hop in seconds '''
+        return sum(h.latency for h in self.hops)
+
+
+def _network_name(ip):
+    # ipwhois is slow to import, it is only loaded once a lookup is needed
+    from ipwhois import IPWhois
+
+    return IPWhois(ip).lookup_whois()['nets'][0]['name']
+
+async def _cdn(url, executor=None):
     '''
         Fetches the cdn of a url
 
@@ -22,9 +55,9 @@ def _cdn(url):
 
         Example:
 
-            In [1]:    from seo_tools.generic import _domain_age
+            In [1]:    from seo_tools.generic import _cdn
 
-                       _cdn('https://www.example.com')
+                       await _cdn('https://www.example.com')
 
             Out [1]:   'INSTARTLOGIC-NET2'
 
@@ -32,20 +65,23 @@ def _cdn(url):
 
             url (str): A url whose cdn is to be fetched.
 
+            executor (concurrent.futures.Executor): Where the blocking IP
+                WHOIS query runs, defaults to the loop's default executor
+
         Returns:
 
             cdn (str): A string that defined the cdn of the provided url
     '''
 
+    host = hostname(url)
     try:
-        url = 'www.' + clean_url(url)
-        res = socket.gethostbyname(url)
-        obj = IPWhois(res).lookup_whois()
-        return obj['nets'][0]['name']
-    except:
+        ip = (await get_resolver().resolve(host))[0]
+        return await asyncio.get_running_loop().run_in_executor(executor, _network_name, ip)
+    except Exception as e:
+        logging.info('Could not fetch the CDN of %s: %r', host, e)
         return None
 
-def _domain_age(url):
+async def _domain_age(url):
     '''
         Fetches Datetime object of the creation date of the domain
 
@@ -57,7 +93,7 @@ def _domain_age(url):
 
             In [1]:    from seo_tools.generic import _domain_age
 
-                       _domain_age('https://www.example.com')
+                       await _domain_age('https://www.example.com')
 
             Out [1]:   datetime.datetime(1997, 10, 18, 4, 0)
 
@@ -71,13 +107,60 @@ def _domain_age(url):
                 A string that defined the cdn of the provided url
     '''
 
+    return (await domain_ages([url]))[0]
+
+async def _alpn_probe(url, timeout=None):
+    '''
+        Negotiates a TLS connection with the host of a url and reports which
+            application protocol the server selects through ALPN. No request
+            is sent.
+
+        Example:
+
+            In [1]:    from seo_tools.generic import _alpn_probe
+
+                       await _alpn_probe('https://www.example.com')
+
+            Out [1]:   ProtocolProbe(url='https://www.example.com',
+                           protocol='h2', handshake_time=0.041, error=None)
+
+        Attributes:
+
+            url (str): A url whose host is to be probed
+
+            timeout (float): Seconds allowed for the connection and TLS
+                handshake, defaults to 'config.Network.probe_timeout'
+
+        Returns:
+
+            ProtocolProbe (namedtuple):
+                protocol is 'h2' or 'http/1.1', or None if the probe failed.
+                handshake_time is the TCP connect and TLS handshake time in
+                seconds, excluding DNS resolution.
+    '''
+    global _alpn_context
+    if _alpn_context is None:
+        _alpn_context = ssl.create_default_context()
+        _alpn_context.set_alpn_protocols(['h2', 'http/1.1'])
+    host = hostname(url)
     try:
-        w = whois.whois(url)
-        return w.creation_date
-    except:
-        return None
+        ip = (await get_resolver().resolve(host))[0]
+        start = time.monotonic()
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(ip, 443, ssl=_alpn_context, server_hostname=host),
+            timeout or Network.probe_timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        return ProtocolProbe(url, None, None, repr(e))
+    handshake_time = time.monotonic() - start
+    protocol = writer.get_extra_info('ssl_object').selected_alpn_protocol() or 'http/1.1'
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+    return ProtocolProbe(url, protocol, handshake_time, None)
 
-def _http2(url):
+async def _http2(url):
     '''
         Determines if a given url supports HTTP/2 protocol
 
@@ -89,7 +172,7 @@ def _http2(url):
 
             In [1]:    from seo_tools.generic import _http2
 
-                       _http2('https://www.example.com')
+                       await _http2('https://www.example.com')
 
             Out [1]:   True
 
@@ -105,13 +188,70 @@ def _http2(url):
                 True, if supported
                 False, if not supported
     '''
-    url = clean_url(url)
-    c = HTTP20Connection(url)
+    return (await _alpn_probe(url)).protocol == 'h2'
+
+async def _probe_headers(session, url):
+    '''
+        Returns the status and Location header of a url without downloading
+            its body: HEAD first, then a GET whose connection is dropped as
+            soon as the headers have arrived.
+    '''
     try:
-        c.request('GET', '/')
-        return True
-    except AssertionError:
-        return False
+        async with session.head(url, allow_redirects=False) as resp:
+            if resp.status not in (405, 501):
+                return resp.status, resp.headers.get('Location')
+    except aiohttp.ClientResponseError:
+        pass
+    async with session.get(url, allow_redirects=False) as resp:
+        status, location = resp.status, resp.headers.get('Location')
+        resp.close()
+    return status, location
+
+async def _redirects(url, max_redirects=10):
+    '''
+        Follows the redirect chain of a url hop by hop without downloading
+            any response bodies
+
+        Example:
+
+            In [1]:    from seo_tools.generic import _redirects
+
+                       chain = await _redirects('http://example.com')
+
+                       [(h.url, h.status) for h in chain.hops]
+
+            Out [1]:   [('http://example.com', 301),
+                        ('https://www.example.com/', 200)]
+
+        Attributes:
+
+            url (str): The url the chain starts at. 'http://' is assumed when
+                no protocol is given.
+
+            max_redirects (int): Hops followed before giving up
+
+        Returns:
+
+            RedirectChain (namedtuple):
+                hops is a list of RedirectHop(url, status, latency), with the
+                latency to the response headers in seconds. final_url is None
+                if the chain could not be followed to the end, in which case
+                error says why.
+    '''
+    session = get_session()
+    current = url if '//' in url else 'http://' + url
+    hops = []
+    for _ in range(max_redirects + 1):
+        start = time.monotonic()
+        try:
+            status, location = await _probe_headers(session, current)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return RedirectChain(url, hops, None, repr(e))
+        hops.append(RedirectHop(current, status, time.monotonic() - start))
+        if status not in _redirect_statuses or not location:
+            return RedirectChain(url, hops, current, None)
+        current = str(URL(current).join(URL(location)))
+    return RedirectChain(url, hops, None, 'Too many redirects')
 
 async def _https(url):
     '''
@@ -125,7 +265,7 @@ async def _https(url):
 
             In [1]:    from seo_tools.generic import _https
 
-                       _https('https://www.example.com')
+                       await _https('https://www.example.com')
 
             Out [1]:   True
 
@@ -141,41 +281,148 @@ async def _https(url):
                 True, if supported
                 False, if not supported
     '''
-    session = aiohttp.ClientSession()
-    url = 'http://' + clean_url(url)
-    async with session.request('GET', url=url) as resp:
-        u = await resp.url
-        return ('https://' in resp.url)
+    return (await _redirects('http://' + clean_url(url))).https
 
 async def _mobile_friendly(url):
-    request_url = f'https://searchconsole.googleapis.com/v1/urlTestingTools/mobileFriendlyTest:run?url={url}&key=key'
-    resp = await post(request_url)
-    return r['mobileFriendliness'] == 'MOBILE_FRIENDLY'
+    resp = await post(APIs.mf_api % (url, credentials().google.key), provider='mobile_friendly')
+    if not isinstance(resp, dict) or 'mobileFriendliness' not in resp:
+        raise APIError(f'Unexpected Mobile Friendly response for {url}: {str(resp)[:200]}')
+    return resp['mobileFriendliness'] == 'MOBILE_FRIENDLY'
+
+def _pagespeed_url(url, strategy, categories):
+    ''' Builds a PageSpeed Insights API request url '''
+    categories = '&'.join(f'category={c}' for c in categories)
+    return APIs.lh_api % (quote(url, safe=''), categories, strategy, credentials().google.key)
+
+def _performance_score(body):
+    data = loads(body)
+    if 'lighthouseResult' not in data:
+        raise APIError('PageSpeed returned no report')
+    return int(data['lighthouseResult']['categories']['performance']['score'] * 100)
+
+async def _fetch_pagespeed(job, url, parse=None):
+    strategy, categories = job
+    data = await get(url=_pagespeed_url(url, strategy, categories), provider='pagespeed', cache=True,
+                     parse=parse and parse(strategy))
+    if data is None or (parse is None and 'error' in data):
+        raise APIError(f'PageSpeed request failed for {url} ({strategy})')
+    return data
+
+async def _run_pagespeed(url, strategies, categories, split=False, parse=None):
+    '''
+        Sends the PageSpeed requests of every strategy, and of every category
+            when split, concurrently and merges them back per strategy.
+
+        Kwargs:
+
+            parse (callable): Called with a strategy, returns the function
+                that turns a raw response body of that strategy into the
+                result, run where 'config.Decoding' says. Ignored when split,
+                as split responses are merged before they are parsed.
+
+        Returns:
+
+            A list with the merged response (or parsed result) of each
+                strategy, or None for a strategy any of whose requests
+                failed, so a split report never lacks a category
+
+        Raises:
+
+            APIError: If every strategy failed
+
+            quota.QuotaExceeded: If the quota stopped any of the requests
+    '''
+    groups = [[c] for c in categories] if split else [list(categories)]
+    jobs = [(strategy, group) for strategy in strategies for group in groups]
+    results = await batch(_fetch_pagespeed, jobs, concurrency=len(jobs), url=url,
+                          parse=None if split else parse)
+    exceeded = next((r for r in results if isinstance(r, QuotaExceeded)), None)
+    if exceeded is not None:
+        # Not returned as a partial result, a later call is served the
+        # responses that did arrive from the cache
+        raise exceeded
+    merged = {}
+    failed = set()
+    for (strategy, _), data in zip(jobs, results):
+        if isinstance(data, Exception):
+            logging.info('%s', data)
+            failed.add(strategy)
+            continue
+        if strategy not in merged:
+            merged[strategy] = data
+        else:
+            result = merged[strategy]['lighthouseResult']
+            result['categories'].update(data['lighthouseResult']['categories'])
+            result['audits'].update(data['lighthouseResult']['audits'])
+    for strategy in failed:
+        merged.pop(strategy, None)
+    if not merged:
+        raise next(r for r in results if isinstance(r, Exception))
+    return [merged.get(strategy) for strategy in strategies]
+
+def _categories(category):
+    if category is None:
+        return APIs.lh_cats
+    return [category] if isinstance(category, str) else category
 
 async def _pagespeed(url, strategy=None):
-    if strategy is not None:
-        request_url = f'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url={url}&category=performance&strategy={strategy}&key=key'
-        data = await get(url=request_url_m)
-        return int(data['lighthouseResult']['categories']['performance']['score'] * 100)
-    else:
-        request_url_m = f'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url={url}&category=performance&strategy=mobile&key=key'
-        m_data = await get(url=request_url_m)
-        mobile_ps = int(m_data['lighthouseResult']['categories']['performance']['score'] * 100)
-        request_url_d = f'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url={url}&category=performance&strategy=desktop&key=key'
-        d_data = await get(url=request_url_d)
-        desktop_ps = int(d_data['lighthouseResult']['categories']['performance']['score'] * 100)
-        return [mobile_ps, desktop_ps]
-
-async def _lighthouse(url, strategy=None):
-    if strategy is not None:
-        request_url = f'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url={url}&category=accessibility&category=best-practices&category=performance&category=pwa&category=seo&strategy={strategy}&key=key'
-        data = await get(url=request_url)
-        return LighthouseReport(strategy, data)
-    else:
-        request_url_m = f'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url={url}&category=accessibility&category=best-practices&category=performance&category=pwa&category=seo&strategy=mobile&key=key'
-        m_data = await get(url=request_url_m)
+    '''
+        Fetches the PageSpeed performance score of a url
+
+        Ths function serves as the function run by the shell within the
+            '__init__.py' file of this module. To run multiple tests concurrently,
+            send a list of urls to the 'pagespeed' function found there.
+
+        Attributes:
+
+            url (str): A url to be audited
 
-        request_url_d = f'https://www.googleapis.com/pagespeedonline/v5/runPagespeed?url={url}&category=accessibility&category=best-practices&category=performance&category=pwa&category=seo&strategy=desktop&key=key'
-        d_data = await get(url=request_url_d)
-        s = [LighthouseReport('mobile', m_data), LighthouseReport('desktop', d_data)]
-        return s
+            strategy (str): 'mobile' or 'desktop'. If none is given, both are
+                requested concurrently.
+
+        Returns:
+
+            Performance score (int) for a single strategy, or
+                [mobile, desktop] scores with None for a strategy that failed
+    '''
+    strategies = [strategy] if strategy is not None else ['mobile', 'desktop']
+    scores = await _run_pagespeed(url, strategies, ['performance'], parse=lambda s: _performance_score)
+    return scores[0] if strategy is not None else scores
+
+async def _lighthouse(url, strategy=None, category=None, split=False, fields=None, details=True):
+    '''
+        Runs a lighthouse audit of a url
+
+        Ths function serves as the function run by the shell within the
+            '__init__.py' file of this module. To run multiple tests concurrently,
+            send a list of urls to the 'lighthouse' function found there.
+
+        Attributes:
+
+            url (str): A url to be audited
+
+            strategy (str): 'mobile' or 'desktop'. If none is given, both are
+                requested concurrently.
+
+            category (str or list): Categories to be audited, defaults to
+                every category
+
+            split (bool): Request each category separately and concurrently,
+                merging the results into one report per strategy. A strategy
+                is None unless every one of its categories succeeded
+
+            fields (list), details (bool): Passed on to LighthouseReport
+
+        Returns:
+
+            LighthouseReport for a single strategy, or [mobile, desktop]
+                reports with None for a strategy that failed
+    '''
+    strategies = [strategy] if strategy is not None else ['mobile', 'desktop']
+    if split:
+        data = await _run_pagespeed(url, strategies, _categories(category), split)
+        reports = [None if d is None else LighthouseReport(s, d, fields, details) for s, d in zip(strategies, data)]
+    else:
+        reports = await _run_pagespeed(url, strategies, _categories(category),
+                                       parse=lambda s: partial(parse_report, s, fields, details))
+    return reports[0] if strategy is not None else reports
@@ -0,0 +1,125 @@
+import aiohttp
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+
+from collections import Counter
+
+from seo_tools.cache import get_cache, normalize_url
+from seo_tools.config import Cache
+from seo_tools.utils import get_session, headers
+
+'''
+
+==================
+Incremental Audits
+==================
+
+Skips audits of pages that did not change since they were last audited.
+    Before a page is audited, it is fetched with a conditional request built
+    from the validators stored with its last result: If-None-Match for an
+    ETag, If-Modified-Since for a Last-Modified date. A 304, or a body with
+    the same content hash as before, reuses the stored result; anything else
+    runs the audit and stores its result with the new validators.
+
+Results and validators are kept in the 'audits' table of the local cache for
+    'config.Cache.audit_ttl' seconds, so every page is audited afresh at
+    least that often. Failed or partial results are never stored.
+
+'''
+
+# Pages found changed and unchanged by this process
+stats = Counter()
+
+
+def _store():
+    return get_cache('audits', ttl=Cache.audit_ttl, max_bytes=Cache.audit_max_bytes)
+
+
+def _key(kind, url, options):
+    return f'{kind} {json.dumps(options, sort_keys=True, default=str)} {normalize_url(url)}'
+
+
+def _complete(result):
+    if isinstance(result, list):
+        return all(r is not None for r in result)
+    return result is not None
+
+
+async def page_changed(url, validators=None):
+    '''
+        Checks whether a page changed since its validators were taken
+
+        Args:
+
+            url (str): The page
+
+        Kwargs:
+
+            validators (dict): 'etag', 'last_modified' and 'hash' of the page
+                as returned by an earlier call
+
+        Returns:
+
+            (changed, validators) tuple. The page counts as changed when it
+                has no validators, or could not be fetched, in which case
+                the returned validators are None.
+    '''
+    request_headers = dict(headers)
+    if validators:
+        if validators.get('etag'):
+            request_headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            request_headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        async with get_session().get(url, headers=request_headers) as resp:
+            if resp.status == 304 and validators:
+                return False, validators
+            if resp.status >= 400:
+                logging.info('Could not check %s for changes: %s', url, resp.status)
+                return True, None
+            body = await resp.read()
+            fresh = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'hash': hashlib.sha256(body).hexdigest(),
+            }
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.info('Could not check %s for changes: %r', url, e)
+        return True, None
+    return not validators or validators.get('hash') != fresh['hash'], fresh
+
+
+async def if_changed(func, url, **options):
+    '''
+        Runs func(url, **options) only if the page changed since the result
+            stored for the same function and options, otherwise returns the
+            stored result
+
+        Example:
+
+            In [1]:    report = await if_changed(_lighthouse, url, strategy='mobile')
+
+        Args:
+
+            func (coroutine function): The audit, e.g. '_lighthouse' or
+                '_pagespeed'. Its results must be picklable
+
+            url (str): The page to be audited
+    '''
+    store = _store()
+    key = _key(func.__name__, url, options)
+    stored = store.get_bytes(key)
+    validators, result = pickle.loads(stored) if stored is not None else (None, None)
+    changed, fresh = await page_changed(url, validators)
+    if not changed:
+        stats['unchanged'] += 1
+        logging.info('%s is unchanged, reusing its stored result', url)
+        return result
+    stats['changed'] += 1
+    result = await func(url, **options)
+    if fresh is not None and _complete(result):
+        store.set_bytes(key, pickle.dumps((fresh, result)))
+    return result
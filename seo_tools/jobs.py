@@ -0,0 +1,420 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from seo_tools.config import Jobs, Quotas
+from seo_tools.quota import QuotaExceeded, priority
+
+'''
+
+=========
+Job Queue
+=========
+
+A durable queue of (url, check) jobs kept in a local SQLite file, so an
+    audit of any size can be spread over as many worker processes as
+    needed: every worker leases a few jobs at a time, runs them and stores
+    their results in the same file.
+
+    seo_tools enqueue urls.txt --checks https,http2,pagespeed
+    seo_tools worker --concurrency 20 &
+    seo_tools worker --concurrency 20 &
+    seo_tools status
+    seo_tools results -o audit.csv
+
+A lease expires after 'config.Jobs.visibility' seconds unless the worker
+    extends it, after which the job goes to the next worker that asks, so
+    jobs of a worker that died are not lost. Failed jobs are retried with
+    backoff up to 'config.Jobs.max_attempts' attempts.
+
+Jobs are leased highest priority first and run at their priority, see
+    'quota'. A job stopped by a quota is put back until the quota resets,
+    without counting as an attempt, while jobs of other providers go on.
+
+    seo_tools enqueue key_pages.txt --checks pagespeed --priority 2
+
+The file is opened in WAL mode, which needs every worker on the same host.
+
+'''
+
+Job = namedtuple('Job', ['id', 'url', 'check', 'attempts', 'priority'])
+
+states = ('queued', 'leased', 'done', 'failed')
+
+# Workers update the queue off the event loop, one call at a time per
+# process, as a call may wait up to a minute on the lock of another process
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class JobQueue:
+    '''
+        The SQLite backed job queue
+
+        Kwargs:
+
+            path (str): Path of the SQLite database file, defaults to
+                'config.Jobs.path'
+
+            visibility (float), max_attempts (int), retry_delay (float):
+                Default to the settings of 'config.Jobs'
+    '''
+
+    def __init__(self, path=None, visibility=None, max_attempts=None, retry_delay=None):
+        self.path = path or Jobs.path
+        self.visibility = visibility or Jobs.visibility
+        self.max_attempts = max_attempts or Jobs.max_attempts
+        self.retry_delay = Jobs.retry_delay if retry_delay is None else retry_delay
+        self._lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                check_name TEXT NOT NULL,
+                state TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 1,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available REAL NOT NULL,
+                worker TEXT,
+                error TEXT,
+                result TEXT,
+                updated REAL NOT NULL,
+                UNIQUE (url, check_name)
+            )''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_available ON jobs (state, available)')
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def enqueue(self, urls, checks, priority=None, requeue=False):
+        '''
+            Adds a job for every url and check
+
+            Args:
+
+                urls (iterable): Urls to be audited, normalized as by
+                    'pipeline.aiter_audit'
+
+                checks (list): Check names, out of the keys of
+                    'pipeline.available_checks'
+
+            Kwargs:
+
+                priority (int): Jobs of a higher priority are leased first,
+                    and may use more of a quota, see 'config.Quotas'.
+                    Defaults to 'config.Quotas.default_priority'. Jobs
+                    queued before keep theirs unless requeued
+
+                requeue (bool): Run jobs that already finished or failed
+                    again, e.g. for a nightly rerun. Leased jobs are left
+                    alone.
+
+            Returns:
+
+                The number of jobs added or requeued
+        '''
+        from seo_tools.pipeline import _normalize, available_checks
+
+        unknown = [c for c in checks if c not in available_checks]
+        if unknown:
+            raise ValueError(f'Unknown checks: {unknown}. Options: {list(available_checks)}')
+        now = time.time()
+        priority = Quotas.default_priority if priority is None else priority
+        if requeue:
+            sql = '''INSERT INTO jobs (url, check_name, state, priority, available, updated)
+                     VALUES (?, ?, 'queued', ?, ?, ?)
+                     ON CONFLICT (url, check_name) DO UPDATE SET state = 'queued', attempts = 0,
+                     priority = excluded.priority, available = excluded.available, error = NULL,
+                     updated = excluded.updated WHERE state != 'leased' '''
+        else:
+            sql = '''INSERT OR IGNORE INTO jobs (url, check_name, state, priority, available, updated)
+                     VALUES (?, ?, 'queued', ?, ?, ?)'''
+        added = 0
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                for url in urls:
+                    url = _normalize(url)
+                    for check in checks:
+                        added += self._db.execute(sql, (url, check, priority, now, now)).rowcount
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return added
+
+    def lease(self, worker, n=1):
+        '''
+            Leases up to n available jobs to a worker for 'visibility'
+                seconds, highest priority first
+
+            Jobs whose lease expired on their last allowed attempt are marked
+                failed instead.
+
+            Returns:
+
+                A list of Job tuples
+        '''
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute(
+                    '''UPDATE jobs SET state = 'failed', error = 'lease expired', updated = ?
+                       WHERE state = 'leased' AND available <= ? AND attempts >= ?''',
+                    (now, now, self.max_attempts))
+                rows = self._db.execute(
+                    '''SELECT id, url, check_name, attempts, priority FROM jobs
+                       WHERE state IN ('queued', 'leased') AND available <= ?
+                       ORDER BY priority DESC, available, id LIMIT ?''', (now, n)).fetchall()
+                self._db.executemany(
+                    '''UPDATE jobs SET state = 'leased', attempts = attempts + 1, available = ?,
+                       worker = ?, updated = ? WHERE id = ?''',
+                    [(now + self.visibility, worker, now, row[0]) for row in rows])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return [Job(id, url, check, attempts + 1, level) for id, url, check, attempts, level in rows]
+
+    def extend(self, job_ids, worker):
+        ''' Extends the leases a worker holds on jobs by another 'visibility' seconds '''
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                '''UPDATE jobs SET available = ?, updated = ? WHERE id = ? AND worker = ? AND state = 'leased' ''',
+                [(now + self.visibility, now, job_id, worker) for job_id in job_ids])
+
+    def release(self, job_ids, worker, until=None, error=None):
+        '''
+            Hands jobs a worker leased back to the queue without counting the
+                attempt, to be leased again from 'until' (epoch time) on
+        '''
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                '''UPDATE jobs SET state = 'queued', attempts = attempts - 1, available = ?, worker = NULL,
+                   error = ?, updated = ? WHERE id = ? AND worker = ? AND state = 'leased' ''',
+                [(until or now, error, now, job_id, worker) for job_id in job_ids])
+
+    def complete(self, job, result, worker=None):
+        ''' Stores the result (a JSON serialisable dict) of a leased job '''
+        now = time.time()
+        return self._write(
+            '''UPDATE jobs SET state = 'done', result = ?, error = NULL, available = ?, updated = ?
+               WHERE id = ? AND state = 'leased' AND (? IS NULL OR worker = ?)''',
+            (json.dumps(result, default=str), now, now, job.id, worker, worker)) > 0
+
+    def fail(self, job, error, worker=None):
+        '''
+            Records the failure of a leased job. It is queued again after a
+                backoff, or marked failed on its last allowed attempt.
+        '''
+        now = time.time()
+        if job.attempts >= self.max_attempts:
+            state, available = 'failed', now
+        else:
+            state, available = 'queued', now + self.retry_delay * 2 ** (job.attempts - 1)
+        return self._write(
+            '''UPDATE jobs SET state = ?, error = ?, available = ?, updated = ?
+               WHERE id = ? AND state = 'leased' AND (? IS NULL OR worker = ?)''',
+            (state, str(error), available, now, job.id, worker, worker)) > 0
+
+    def retry_failed(self, check=None):
+        ''' Queues failed jobs, of one check or of all, for another round of attempts '''
+        now = time.time()
+        return self._write(
+            '''UPDATE jobs SET state = 'queued', attempts = 0, available = ?, updated = ?
+               WHERE state = 'failed' AND (? IS NULL OR check_name = ?)''', (now, now, check, check))
+
+    def status(self):
+        ''' Returns {check: {state: count}} '''
+        counts = defaultdict(lambda: dict.fromkeys(states, 0))
+        with self._lock:
+            rows = self._db.execute('SELECT check_name, state, COUNT(*) FROM jobs GROUP BY check_name, state').fetchall()
+        for check, state, count in rows:
+            counts[check][state] = count
+        return dict(counts)
+
+    def workers(self):
+        ''' Returns {worker: leased jobs} of the workers holding unexpired leases '''
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT worker, COUNT(*) FROM jobs WHERE state = 'leased' AND available > ?
+                   GROUP BY worker''', (time.time(),)).fetchall()
+        return dict(rows)
+
+    def pending(self, until=None):
+        ''' Returns the number of jobs that are leased, or queued and available before 'until' (epoch time) '''
+        with self._lock:
+            return self._db.execute(
+                '''SELECT COUNT(*) FROM jobs WHERE state = 'leased'
+                   OR (state = 'queued' AND (? IS NULL OR available < ?))''', (until, until)).fetchone()[0]
+
+    def deferred(self):
+        ''' Returns {check: (jobs, epoch time they become available)} of the jobs put back by a quota '''
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT check_name, COUNT(*), MIN(available) FROM jobs WHERE state = 'queued'
+                   AND error LIKE 'QuotaExceeded%' GROUP BY check_name''').fetchall()
+        return {check: (count, available) for check, count, available in rows}
+
+    def results(self, check=None):
+        ''' Yields (url, check, result dict) of the finished jobs '''
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT url, check_name, result FROM jobs WHERE state = 'done'
+                   AND (? IS NULL OR check_name = ?) ORDER BY id''', (check, check)).fetchall()
+        for url, check_name, result in rows:
+            yield url, check_name, json.loads(result)
+
+    def errors(self, check=None):
+        ''' Yields (url, check, attempts, error) of the failed jobs '''
+        with self._lock:
+            rows = self._db.execute(
+                '''SELECT url, check_name, attempts, error FROM jobs WHERE state = 'failed'
+                   AND (? IS NULL OR check_name = ?) ORDER BY id''', (check, check)).fetchall()
+        yield from rows
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+async def _run_job(job, shared):
+    from seo_tools.pipeline import available_checks
+
+    context = dict(shared, errors={})
+    with priority(job.priority):
+        result = await available_checks[job.check](job.url, context)
+    if context['errors']:
+        result['errors'] = '; '.join(f'{k}: {v}' for k, v in context['errors'].items())
+    return result
+
+
+def _executor():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(1, thread_name_prefix='seo_tools-jobs')
+    return _writer
+
+
+async def _call(method, *args):
+    ''' Runs a JobQueue method in the queue's thread, see '_executor' '''
+    return await asyncio.get_running_loop().run_in_executor(_executor(), method, *args)
+
+
+async def work(queue, client=None, concurrency=None, worker=None, exit_when_done=False):
+    '''
+        Leases and runs jobs of a queue, keeping up to 'concurrency' of them
+            in flight and extending their leases while they run. Jobs still
+            running when the worker is stopped are released to the others.
+
+        The queue is updated in a thread of its own, so a database locked
+            by another worker does not hold up the requests in flight. A
+            result that cannot be stored is logged, and the job goes to the
+            next worker once its lease expires.
+
+        Args:
+
+            queue (JobQueue): The queue to work on
+
+        Kwargs:
+
+            client (SEOClient): The client the checks run through. Defaults
+                to 'client.default_client()'
+
+            concurrency (int): Jobs run at once, defaults to the client's
+
+            worker (str): Name the leases are held under, defaults to
+                host:pid
+
+            exit_when_done (bool): Return once no job is leased or due to
+                be retried, instead of waiting for new ones. Jobs deferred
+                by a quota are left for a later run
+
+        Returns:
+
+            A {'done': n, 'failed': n, 'deferred': n} dict of the jobs this
+                worker ran
+    '''
+    from seo_tools.client import default_client
+
+    owned = client is None
+    client = client or default_client()
+    concurrency = concurrency or client.concurrency
+    worker = worker or worker_name()
+    from seo_tools.pipeline import available_checks, shared_state
+
+    shared = dict(shared_state(available_checks), gt_metrix=client._poller)
+    running = {}
+    counts = {'done': 0, 'failed': 0, 'deferred': 0}
+    # Jobs available later than this were deferred by a quota
+    horizon = queue.retry_delay * 2 ** queue.max_attempts + Jobs.poll_interval
+    extended = time.monotonic()
+    try:
+        with client._active():
+            while True:
+                if len(running) < concurrency:
+                    try:
+                        leased = await _call(queue.lease, worker, concurrency - len(running))
+                    except sqlite3.OperationalError as e:
+                        logging.warning('Could not lease jobs: %r', e)
+                        leased = []
+                    for job in leased:
+                        running[asyncio.ensure_future(_run_job(job, shared))] = job
+                if not running:
+                    if exit_when_done and not await _call(queue.pending, time.time() + horizon):
+                        return counts
+                    await asyncio.sleep(Jobs.poll_interval)
+                    continue
+                done, _ = await asyncio.wait(running, timeout=Jobs.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    job = running.pop(task)
+                    try:
+                        if task.exception() is None:
+                            await _call(queue.complete, job, task.result(), worker)
+                            counts['done'] += 1
+                        elif isinstance(task.exception(), QuotaExceeded):
+                            logging.info('Deferring %s of %s: %s', job.check, job.url, task.exception())
+                            await _call(queue.release, [job.id], worker, task.exception().reset,
+                                        repr(task.exception()))
+                            counts['deferred'] += 1
+                        else:
+                            logging.info('%s of %s failed on attempt %i: %r', job.check, job.url, job.attempts,
+                                         task.exception())
+                            await _call(queue.fail, job, repr(task.exception()), worker)
+                            counts['failed'] += 1
+                    except sqlite3.OperationalError as e:
+                        logging.warning('Could not store %s of %s, it runs again once its lease expires: %r',
+                                        job.check, job.url, e)
+                if running and time.monotonic() - extended > queue.visibility / 3:
+                    try:
+                        await _call(queue.extend, [job.id for job in running.values()], worker)
+                        extended = time.monotonic()
+                    except sqlite3.OperationalError as e:
+                        logging.warning('Could not extend leases: %r', e)
+    finally:
+        for task in running:
+            task.cancel()
+        await _call(queue.release, [job.id for job in running.values()], worker)
+        if owned:
+            await client.close()
@@ -0,0 +1,313 @@
+import bisect
+import logging
+import sys
+import time
+
+from array import array
+from collections import Counter, defaultdict
+
+'''
+
+=======================
+Request Instrumentation
+=======================
+
+Every API request sent through 'utils.get' and 'utils.post' is described by
+    a RequestRecord: its provider, attempts, status, byte counts and the
+    time spent in each phase of its last attempt. Hooks registered with
+    'add_hook' are called with the record on
+
+        'start'     before every attempt is sent
+        'retry'     when an attempt failed and another will be made
+        'end'       once per request, after the response was decoded
+
+'collect' attaches an Aggregator that keeps per-provider latency histograms,
+    which can be printed at any time:
+
+    from seo_tools import metrics
+
+    metrics.collect()
+    pagespeed(urls)
+    metrics.collect().dump()
+
+'''
+
+events = ('start', 'retry', 'end')
+_hooks = {event: [] for event in events}
+_aggregator = None
+
+
+def add_hook(event, func):
+    ''' Registers func(record) to be called on 'start', 'retry' or 'end' '''
+    if event not in _hooks:
+        raise ValueError(f'Unknown event {event!r}, expected one of {events}')
+    _hooks[event].append(func)
+
+
+def remove_hook(event, func):
+    if func in _hooks.get(event, ()):
+        _hooks[event].remove(func)
+
+
+def emit(event, record):
+    ''' Calls the hooks of an event. A failing hook is logged and never breaks the request. '''
+    for func in list(_hooks[event]):
+        try:
+            func(record)
+        except Exception:
+            logging.exception('Metrics hook %r failed on %s', func, event)
+
+
+class RequestRecord:
+    '''
+        The measurements of one API request
+
+        Phase timings are in seconds and describe the last attempt:
+
+            queue       waiting on the circuit breaker, rate limiter and a
+                        free pooled connection
+            dns         resolving the host, when it was not cached
+            connect     opening a new connection, including dns and TLS
+            ttfb        from the request being sent to its response headers
+            body        reading the response body
+            decode      decoding and parsing the body
+
+        'elapsed' is the time of the whole request, retries included.
+    '''
+
+    __slots__ = ('provider', 'method', 'url', 'attempt', 'status', 'error', 'delay', 'cached',
+                 'queue', 'dns', 'connect', 'ttfb', 'body', 'decode', 'bytes_sent', 'bytes_received',
+                 'started', 'elapsed', '_mark')
+
+    phases = ('queue', 'dns', 'connect', 'ttfb', 'body', 'decode')
+
+    def __init__(self, provider, method, url):
+        self.provider = provider
+        self.method = method
+        self.url = url
+        self.cached = False
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.begin(0)
+
+    def begin(self, attempt):
+        ''' Resets the per-attempt measurements '''
+        self.attempt = attempt
+        self.status = None
+        self.error = None
+        self.delay = None
+        self.queue = self.dns = self.connect = self.ttfb = self.body = self.decode = 0.0
+        self.bytes_sent = self.bytes_received = 0
+        self._mark = time.perf_counter()
+
+    def sent(self):
+        ''' Ends the queue phase of the attempt, right before it is sent '''
+        self.queue = time.perf_counter() - self._mark
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def __repr__(self):
+        return f'<RequestRecord {self.provider} {self.method} {self.status} {self.url}>'
+
+
+def _record(trace_config_ctx):
+    record = trace_config_ctx.trace_request_ctx
+    return record if isinstance(record, RequestRecord) else None
+
+
+async def _on_request_start(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record._mark = time.perf_counter()
+
+
+async def _on_queued_start(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record._mark = time.perf_counter()
+
+
+async def _on_queued_end(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record.queue += time.perf_counter() - record._mark
+
+
+async def _on_create_start(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record._mark = time.perf_counter()
+
+
+async def _on_create_end(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        now = time.perf_counter()
+        record.connect = now - record._mark
+        record._mark = now
+
+
+async def _on_reuse(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record._mark = time.perf_counter()
+
+
+async def _on_dns_start(session, ctx, params):
+    ctx.dns_start = time.perf_counter()
+
+
+async def _on_dns_end(session, ctx, params):
+    record = _record(ctx)
+    if record is not None and hasattr(ctx, 'dns_start'):
+        record.dns = time.perf_counter() - ctx.dns_start
+
+
+async def _on_chunk_sent(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record.bytes_sent += len(params.chunk)
+
+
+async def _on_request_end(session, ctx, params):
+    record = _record(ctx)
+    if record is not None:
+        record.ttfb = time.perf_counter() - record._mark
+
+
+def trace_config():
+    '''
+        Returns an aiohttp.TraceConfig filling in the connection phases of
+            the RequestRecord passed as a request's 'trace_request_ctx'
+    '''
+    import aiohttp
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_connection_queued_start.append(_on_queued_start)
+    config.on_connection_queued_end.append(_on_queued_end)
+    config.on_connection_create_start.append(_on_create_start)
+    config.on_connection_create_end.append(_on_create_end)
+    config.on_connection_reuseconn.append(_on_reuse)
+    config.on_dns_resolvehost_start.append(_on_dns_start)
+    config.on_dns_resolvehost_end.append(_on_dns_end)
+    config.on_request_chunk_sent.append(_on_chunk_sent)
+    config.on_request_end.append(_on_request_end)
+    return config
+
+
+class _Stats:
+
+    __slots__ = ('requests', 'cached', 'failed', 'retries', 'statuses', 'bytes_sent', 'bytes_received',
+                 'latencies', 'phases')
+
+    def __init__(self):
+        self.requests = self.cached = self.failed = self.retries = 0
+        self.statuses = Counter()
+        self.bytes_sent = self.bytes_received = 0
+        self.latencies = array('d')
+        self.phases = dict.fromkeys(RequestRecord.phases, 0.0)
+
+
+class Aggregator:
+    '''
+        Collects per-provider request counts, statuses, byte counts, phase
+            times and latency histograms from the 'retry' and 'end' hooks
+
+        Latencies are those of whole requests, retries included. Cache hits
+            are counted but kept out of the latencies.
+    '''
+
+    # Upper bounds of the histogram buckets, in seconds
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+
+    def __init__(self):
+        self.providers = defaultdict(_Stats)
+
+    def attach(self):
+        add_hook('retry', self.on_retry)
+        add_hook('end', self.on_end)
+        return self
+
+    def detach(self):
+        remove_hook('retry', self.on_retry)
+        remove_hook('end', self.on_end)
+
+    def reset(self):
+        self.providers.clear()
+
+    def on_retry(self, record):
+        stats = self.providers[record.provider or 'other']
+        stats.retries += 1
+        stats.statuses[record.status or 'error'] += 1
+
+    def on_end(self, record):
+        stats = self.providers[record.provider or 'other']
+        stats.requests += 1
+        if record.cached:
+            stats.cached += 1
+            return
+        stats.statuses[record.status or 'error'] += 1
+        if record.error is not None:
+            stats.failed += 1
+        stats.bytes_sent += record.bytes_sent
+        stats.bytes_received += record.bytes_received
+        stats.latencies.append(record.elapsed)
+        for phase in RequestRecord.phases:
+            stats.phases[phase] += getattr(record, phase)
+
+    def histogram(self, provider):
+        ''' Returns [(upper bound, count)] of the request latencies of a provider '''
+        counts = [0] * len(self.buckets)
+        for latency in self.providers[provider].latencies:
+            counts[bisect.bisect_left(self.buckets, latency)] += 1
+        return list(zip(self.buckets, counts))
+
+    def percentile(self, provider, p):
+        latencies = sorted(self.providers[provider].latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+
+    def summary(self):
+        ''' Returns the collected figures as a dict of {provider: {name: value}} '''
+        summary = {}
+        for provider, stats in self.providers.items():
+            sent = len(stats.latencies)
+            summary[provider] = {
+                'requests': stats.requests, 'cached': stats.cached, 'failed': stats.failed,
+                'retries': stats.retries, 'statuses': dict(stats.statuses),
+                'bytes_sent': stats.bytes_sent, 'bytes_received': stats.bytes_received,
+                'p50': self.percentile(provider, 50), 'p90': self.percentile(provider, 90),
+                'p99': self.percentile(provider, 99),
+                'mean_phases': {k: v / sent for k, v in stats.phases.items()} if sent else {},
+                'histogram': self.histogram(provider),
+            }
+        return summary
+
+    def dump(self, file=None):
+        ''' Prints the summary and latency histogram of every provider '''
+        file = file or sys.stderr
+        for provider, s in sorted(self.summary().items()):
+            print(f'{provider}: {s["requests"]} requests, {s["cached"]} cached, {s["failed"]} failed, '
+                  f'{s["retries"]} retries, {s["bytes_received"] / 1024:.0f} KiB in, '
+                  f'{s["bytes_sent"] / 1024:.0f} KiB out', file=file)
+            if s['p50'] is None:
+                continue
+            statuses = ', '.join(f'{k}: {v}' for k, v in sorted(s['statuses'].items(), key=str))
+            print(f'    statuses  {statuses}', file=file)
+            print('    latency   p50 %.3fs  p90 %.3fs  p99 %.3fs' % (s['p50'], s['p90'], s['p99']), file=file)
+            print('    phases    ' + '  '.join(f'{k} {v:.3f}s' for k, v in s['mean_phases'].items()), file=file)
+            top = max(count for _, count in s['histogram']) or 1
+            for bound, count in s['histogram']:
+                if count:
+                    print(f'    <= {bound:>6}s {count:>7} {"#" * max(1, round(40 * count / top))}', file=file)
+
+
+def collect():
+    ''' Returns the process-wide Aggregator, attaching it on first use '''
+    global _aggregator
+    if _aggregator is None:
+        _aggregator = Aggregator().attach()
+    return _aggregator
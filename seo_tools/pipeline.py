@@ -0,0 +1,223 @@
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from seo_tools.cache import normalize_url
+from seo_tools.config import APIs
+from seo_tools.generic import _alpn_probe, _cdn, _lighthouse, _mobile_friendly, _pagespeed, _redirects
+from seo_tools.resolver import get_resolver
+from seo_tools.utils import clean_url, hostname, stream
+from seo_tools._gt_metrix import GTMetrixPoller
+from seo_tools._moz import MozBatcher
+from seo_tools._whois import DomainAges, registrable_domain
+
+'''
+
+===================
+Site Audit Pipeline
+===================
+
+Runs any number of checks over a url list in one pass. Every url is
+    normalized once, its host is resolved once into the shared resolver
+    cache, and all of its checks then run concurrently over the shared
+    connection pool. Lookups are shared across urls where the provider
+    allows it: WHOIS queries once per domain under the per-server cap, Moz
+    in batches of urls. Blocking lookups (WHOIS) run in a thread pool.
+    Results are streamed per url as a flat dict, so a full audit costs
+    about as much as its slowest check rather than the sum of all of them.
+
+'''
+
+default_checks = ['cdn', 'domain_age', 'http2', 'https', 'pagespeed', 'moz']
+
+
+def _error(check, e):
+    logging.info('%s check failed: %r', check, e)
+    return repr(e)
+
+
+async def _check_cdn(url, context):
+    return {'cdn': await _cdn(url, context.get('executor'))}
+
+async def _check_domain_age(url, context):
+    domain = registrable_domain(url)
+    return {'domain_age': await context['whois'].lookup(domain) if domain else None}
+
+async def _check_http2(url, context):
+    probe = await _alpn_probe(url)
+    if probe.error is not None:
+        context['errors']['http2'] = probe.error
+    return {'http2': probe.protocol == 'h2' if probe.protocol else None,
+            'protocol': probe.protocol, 'tls_handshake_time': probe.handshake_time}
+
+async def _check_https(url, context):
+    chain = await _redirects('http://' + clean_url(url))
+    if chain.error is not None:
+        context['errors']['https'] = chain.error
+    return {'https': chain.https if chain.final_url else None, 'final_url': chain.final_url,
+            'redirects': max(len(chain.hops) - 1, 0), 'redirect_time': chain.latency}
+
+async def _check_pagespeed(url, context):
+    mobile, desktop = await _pagespeed(url)
+    return {'pagespeed_mobile': mobile, 'pagespeed_desktop': desktop}
+
+async def _check_lighthouse(url, context):
+    row = {}
+    for report in await _lighthouse(url, details=False):
+        if report is not None:
+            for category, score in report.categories.items():
+                row[f'lighthouse_{report.strategy}_{category}'] = score['score']
+    return row
+
+async def _check_moz(url, context):
+    da, pa = await context['moz'].lookup(url)
+    return {'moz_da': da, 'moz_pa': pa}
+
+async def _check_mobile_friendly(url, context):
+    return {'mobile_friendly': await _mobile_friendly(url)}
+
+_gt_metrix_fields = ('pagespeed_score', 'yslow_score', 'page_load_time')
+
+async def _check_gt_metrix(url, context):
+    result = await context['gt_metrix'].test(url)
+    return {f'gtmetrix_{k}': getattr(result, k, None) for k in _gt_metrix_fields}
+
+available_checks = {
+    'cdn': _check_cdn,
+    'domain_age': _check_domain_age,
+    'http2': _check_http2,
+    'https': _check_https,
+    'pagespeed': _check_pagespeed,
+    'lighthouse': _check_lighthouse,
+    'moz': _check_moz,
+    'mobile_friendly': _check_mobile_friendly,
+    'gt_metrix': _check_gt_metrix,
+}
+
+# Columns the checks add to a row, for the frame of an audit without urls
+check_columns = {
+    'cdn': ['cdn'],
+    'domain_age': ['domain_age'],
+    'http2': ['http2', 'protocol', 'tls_handshake_time'],
+    'https': ['https', 'final_url', 'redirects', 'redirect_time'],
+    'pagespeed': ['pagespeed_mobile', 'pagespeed_desktop'],
+    'lighthouse': [f'lighthouse_{s}_{c}' for s in ('mobile', 'desktop') for c in APIs.lh_cats],
+    'moz': ['moz_da', 'moz_pa'],
+    'mobile_friendly': ['mobile_friendly'],
+    'gt_metrix': [f'gtmetrix_{k}' for k in _gt_metrix_fields],
+}
+
+
+def shared_state(checks, executor=None):
+    '''
+        Returns the state the checks of an audit share across urls: the GT
+            Metrix poller, WHOIS lookups, Moz batches and the executor of
+            blocking lookups
+    '''
+    shared = {'executor': executor}
+    if 'gt_metrix' in checks:
+        shared['gt_metrix'] = GTMetrixPoller()
+    if 'domain_age' in checks:
+        shared['whois'] = DomainAges(executor=executor)
+    if 'moz' in checks:
+        shared['moz'] = MozBatcher()
+    return shared
+
+
+def _normalize(url):
+    url = url.strip()
+    return normalize_url(url if '//' in url else 'http://' + url)
+
+
+async def _audit_url(url, selected, shared):
+    context = dict(shared, errors={})
+    try:
+        await get_resolver().resolve(hostname(url))
+    except OSError as e:
+        context['errors']['dns'] = repr(e)
+    results = await asyncio.gather(*[available_checks[c](url, context) for c in selected], return_exceptions=True)
+    row = {'url': url}
+    for check, result in zip(selected, results):
+        if isinstance(result, Exception):
+            context['errors'][check] = _error(check, result)
+        else:
+            row.update(result)
+    row['errors'] = '; '.join(f'{k}: {v}' for k, v in context['errors'].items()) or None
+    return row
+
+
+def _unique(urls):
+    seen = set()
+    for url in urls:
+        url = _normalize(url)
+        if url not in seen:
+            seen.add(url)
+            yield url
+
+
+async def aiter_audit(urls, checks=None, concurrency=None, workers=None, ordered=False):
+    '''
+        Streams a multi-check audit of an iterable of urls
+
+        Example:
+
+            In [1]:    from seo_tools.pipeline import aiter_audit
+
+                       async for url, row in aiter_audit(urls, ['https', 'http2']):
+                           print(row['https'], row['protocol'])
+
+        Args:
+
+            urls (iterable): Urls to be audited, consumed lazily. Duplicates
+                are audited once.
+
+        Kwargs:
+
+            checks (list): Checks to be run, out of the keys of
+                'pipeline.available_checks'. Defaults to
+                'pipeline.default_checks'
+
+            concurrency (int): Urls audited at once. Defaults to
+                'config.Limits.concurrency'
+
+            workers (int): Size of a thread pool of the audit's own that
+                blocking lookups run in, shut down when the audit ends.
+                Defaults to the default executor of the running loop
+
+            ordered (bool): Yield rows in input order
+
+        Yields:
+
+            (url, row) tuples, row being a flat dict of the check results
+                with an 'errors' column naming the checks that failed
+    '''
+    selected = list(checks or default_checks)
+    unknown = [c for c in selected if c not in available_checks]
+    if unknown:
+        raise ValueError(f'Unknown checks: {unknown}. Options: {list(available_checks)}')
+    executor = ThreadPoolExecutor(workers) if workers else None
+    shared = shared_state(selected, executor)
+    try:
+        async for url, row in stream(_audit_url, _unique(urls), concurrency, ordered=ordered,
+                                     selected=selected, shared=shared):
+            if isinstance(row, Exception):
+                row = {'url': url, 'errors': _error('audit', row)}
+            yield url, row
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+async def audit_frame(urls, checks=None, **kwargs):
+    '''
+        Runs a multi-check audit and returns one DataFrame with a row per url
+            in input order. Takes the same arguments as 'aiter_audit'.
+    '''
+    import pandas as pd
+
+    rows = [row async for _, row in aiter_audit(urls, checks, ordered=True, **kwargs)]
+    if not rows:
+        columns = [c for check in checks or default_checks for c in check_columns.get(check, [])]
+        return pd.DataFrame(columns=columns + ['errors'], index=pd.Index([], name='url'))
+    return pd.DataFrame.from_records(rows).set_index('url')
@@ -0,0 +1,273 @@
+import asyncio
+import contextvars
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from seo_tools.config import Credentials, Quotas
+
+'''
+
+======
+Quotas
+======
+
+Keeps the usage of every credential within its daily or monthly budget,
+    see 'config.Quotas'. Every request sent to a provider with a budget is
+    counted against the credential it is billed to, in a local SQLite file
+    shared by every process, before it is sent. A request that would go
+    beyond the share of the budget allowed to the current priority raises
+    QuotaExceeded instead of running into a flood of 429s. A batch or
+    stream over the provider then starts no further urls; they are returned
+    with that same QuotaExceeded in place of a result, see 'utils.batch'.
+
+    from seo_tools import pagespeed
+    from seo_tools.quota import priority
+
+    with priority(2):
+        scores = pagespeed(key_pages)
+    scores = pagespeed(other_pages)     # stops at 95% of the daily quota
+
+The job queue runs every job at the priority it was queued with, leases
+    higher priority jobs first and defers a job that hits a quota until
+    the quota resets.
+
+'''
+
+# Credential of 'config.Credentials' each provider is billed to
+owners = {'pagespeed': 'google', 'mobile_friendly': 'google', 'moz': 'moz', 'gt_metrix': 'gt_metrix'}
+
+_priority = contextvars.ContextVar('seo_tools_priority', default=None)
+_store = None
+_store_lock = threading.Lock()
+# Counters are updated off the event loop, one at a time per process, as a
+# write may wait on the SQLite lock held by another process
+_writer = None
+
+
+class QuotaExceeded(Exception):
+    '''
+        Raised instead of sending a request that would take the usage of a
+            credential beyond the share of its budget allowed to the
+            current priority
+
+        Attributes:
+
+            provider (str), credential (str): Whose budget is used up
+
+            used (int), allowed (int): Units used and allowed this period
+
+            reset (float): Epoch time at which the period ends
+    '''
+
+    def __init__(self, provider, credential, used, allowed, reset):
+        self.provider = provider
+        self.credential = credential
+        self.used = used
+        self.allowed = allowed
+        self.reset = reset
+        until = datetime.fromtimestamp(reset, timezone.utc)
+        super().__init__(f'{provider} quota of {credential} used up ({used} of {allowed} units allowed '
+                         f'at this priority) until {until:%Y-%m-%d %H:%M} UTC')
+
+
+class UsageStore:
+    '''
+        Usage counters per provider, credential and period, kept in a SQLite
+            file that several processes can update at once
+
+        Args:
+
+            path (str): Path of the SQLite database file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS usage (
+                provider TEXT NOT NULL,
+                credential TEXT NOT NULL,
+                period TEXT NOT NULL,
+                used INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (provider, credential, period)
+            )''')
+
+    def charge(self, provider, credential, period, cost, allowed):
+        '''
+            Adds cost to a counter unless that would take it beyond allowed
+
+            Returns:
+
+                (charged, used) tuple, used being the counter afterwards
+        '''
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT used FROM usage WHERE provider = ? AND credential = ? AND period = ?',
+                    (provider, credential, period)).fetchone()
+                used = row[0] if row else 0
+                if used + cost > allowed:
+                    self._db.execute('ROLLBACK')
+                    return False, used
+                self._db.execute(
+                    '''INSERT INTO usage VALUES (?, ?, ?, ?, ?) ON CONFLICT (provider, credential, period)
+                       DO UPDATE SET used = used + excluded.used, updated = excluded.updated''',
+                    (provider, credential, period, cost, time.time()))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return True, used + cost
+
+    def used(self, provider, credential, period):
+        ''' Returns the units counted so far '''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT used FROM usage WHERE provider = ? AND credential = ? AND period = ?',
+                (provider, credential, period)).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_store():
+    ''' Returns the process-wide UsageStore at 'config.Quotas.path' '''
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UsageStore(Quotas.path)
+    return _store
+
+
+def _executor():
+    global _writer
+    with _store_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(1, thread_name_prefix='seo_tools-quota')
+    return _writer
+
+
+def current_priority():
+    ''' Returns the priority of the work in the current context '''
+    level = _priority.get()
+    return Quotas.default_priority if level is None else level
+
+
+@contextmanager
+def priority(level):
+    '''
+        Runs the requests sent within, including those of batches and
+            synchronous calls, at a priority, see 'config.Quotas.shares'
+    '''
+    token = _priority.set(level)
+    try:
+        yield level
+    finally:
+        _priority.reset(token)
+
+
+def share(level):
+    ''' Returns the share of a budget that work of a priority may use '''
+    levels = sorted(Quotas.shares)
+    below = [l for l in levels if l <= level]
+    return Quotas.shares[below[-1] if below else levels[0]]
+
+
+def period(name, now=None):
+    ''' Returns the label and end (epoch time) of the current UTC 'day' or 'month' '''
+    now = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc)
+    if name == 'day':
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return start.strftime('%Y-%m-%d'), (start + timedelta(days=1)).timestamp()
+    if name == 'month':
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        return start.strftime('%Y-%m'), end.timestamp()
+    raise ValueError(f'Unknown quota period: {name!r}')
+
+
+def credential_name(credentials, provider):
+    ''' Names the credential a provider is billed to without exposing its key '''
+    auth = getattr(credentials, owners.get(provider, provider), None)
+    if auth is None:
+        return 'default'
+    if auth.id:
+        return str(auth.id)
+    return 'key-' + hashlib.sha256(str(auth.key).encode()).hexdigest()[:12]
+
+
+async def charge(provider, credentials, cost=1):
+    '''
+        Counts the units of a request against the budget of the credential
+            it is billed to. The counter is updated in a thread of its own,
+            so waiting on other processes does not block the event loop.
+
+        Args:
+
+            provider (str): Provider the request is sent to
+
+            credentials (object): Holds the credential, e.g.
+                'config.Credentials'
+
+        Kwargs:
+
+            cost (int): Units the request uses
+
+        Raises:
+
+            QuotaExceeded: Without counting anything, if the units would go
+                beyond the share of the budget allowed to the current
+                priority
+    '''
+    budget = Quotas.budgets.get(provider) if Quotas.enabled and provider else None
+    if not budget or cost <= 0:
+        return
+    units, name = budget
+    allowed = int(units * share(current_priority()))
+    label, reset = period(name)
+    credential = credential_name(credentials, provider)
+    charged, used = await asyncio.get_running_loop().run_in_executor(
+        _executor(), lambda: get_store().charge(provider, credential, label, cost, allowed))
+    if not charged:
+        raise QuotaExceeded(provider, credential, used, allowed, reset)
+
+
+def usage(credentials=None):
+    '''
+        Returns the usage of every budget in the current period
+
+        Kwargs:
+
+            credentials (object): Defaults to 'config.Credentials'
+
+        Returns:
+
+            A list of dicts with 'provider', 'credential', 'period', 'used',
+                'budget' and 'reset' (epoch time) keys
+    '''
+    credentials = credentials or Credentials
+    rows = []
+    for provider, budget in Quotas.budgets.items():
+        if not budget:
+            continue
+        units, name = budget
+        label, reset = period(name)
+        credential = credential_name(credentials, provider)
+        rows.append({'provider': provider, 'credential': credential, 'period': label,
+                     'used': get_store().used(provider, credential, label), 'budget': units, 'reset': reset})
+    return rows
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import socket
+import time
+
+from collections import deque
+
+from aiohttp.abc import AbstractResolver
+
+from seo_tools.config import Network
+
+'''
+
+==============
+Async Resolver
+==============
+
+Resolves host names concurrently on the event loop and keeps the answers in
+    an in-memory TTL cache shared by the connection pool and the network
+    checks in generic.py. Every lookup that reaches the system resolver is
+    timed, so slow resolvers can be spotted with 'Resolver.slowest'.
+
+'''
+
+_resolver = None
+
+
+class Resolver:
+    '''
+        An asyncio DNS resolver with an in-memory TTL cache
+
+        Answers are cached per host, whatever port and address family they
+            were asked for, and concurrent lookups of the same host share a
+            single query.
+
+        Kwargs:
+
+            ttl (int): Seconds an answer is cached for, defaults to
+                'config.Network.ttl_dns_cache'
+
+            slow (float): Lookups slower than this many seconds are logged
+                as warnings
+
+            history (int): Number of lookup timings kept
+    '''
+
+    def __init__(self, ttl=None, slow=1.0, history=10000):
+        self.ttl = Network.ttl_dns_cache if ttl is None else ttl
+        self.slow = slow
+        self.timings = deque(maxlen=history)
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._inflight = {}
+
+    async def getaddrinfo(self, host, port=0, family=socket.AF_INET):
+        '''
+            Returns the getaddrinfo entries of a host, from the cache when
+                possible
+        '''
+        entry = self._cache.get(host)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            infos = entry[1]
+        elif host in self._inflight:
+            infos = await asyncio.shield(self._inflight[host])
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._lookup(host))
+            self._inflight[host] = task
+            try:
+                infos = await asyncio.shield(task)
+            finally:
+                self._inflight.pop(host, None)
+            self._cache[host] = (time.monotonic() + self.ttl, infos)
+        # Every family is looked up with port 0, the answer is narrowed to
+        # the family and port asked for
+        infos = [(fam, kind, proto, name, (address[0], port) + tuple(address[2:]))
+                 for fam, kind, proto, name, address in infos
+                 if family in (socket.AF_UNSPEC, fam)]
+        if not infos:
+            raise socket.gaierror(socket.EAI_NONAME, f'No address of family {family} for {host}')
+        return infos
+
+    async def _lookup(self, host):
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().getaddrinfo(
+                host, 0, type=socket.SOCK_STREAM, family=socket.AF_UNSPEC, flags=socket.AI_ADDRCONFIG)
+        finally:
+            elapsed = time.monotonic() - start
+            self.timings.append((host, elapsed))
+            if elapsed >= self.slow:
+                logging.warning('Slow DNS lookup for %s: %.2fs', host, elapsed)
+            else:
+                logging.debug('Resolved %s in %.3fs', host, elapsed)
+
+    async def resolve(self, host, family=socket.AF_INET):
+        ''' Returns the list of IP addresses of a host '''
+        infos = await self.getaddrinfo(host, family=family)
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    def slowest(self, n=10):
+        ''' Returns the n slowest (host, seconds) lookups recorded '''
+        return sorted(self.timings, key=lambda t: t[1], reverse=True)[:n]
+
+    def clear(self):
+        self._cache.clear()
+
+
+class AiohttpResolver(AbstractResolver):
+    ''' Adapts a Resolver to the interface aiohttp connectors expect '''
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        infos = await self.resolver.getaddrinfo(host, port, family)
+        return [{
+            'hostname': host,
+            'host': address[0],
+            'port': address[1],
+            'family': fam,
+            'proto': proto,
+            'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV,
+        } for fam, _, proto, _, address in infos]
+
+    async def close(self):
+        pass
+
+
+def get_resolver():
+    ''' Returns the process-wide Resolver, creating it on first use '''
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+    return _resolver
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import random
+import time
+
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from seo_tools.config import Retries
+
+'''
+
+============
+Retry Policy
+============
+
+How failed API requests are retried: which statuses are retried, how long
+    to back off between attempts and when to give up, per provider. Each
+    provider also has a circuit breaker that pauses all of its requests
+    while its error rate is high, instead of spending quota on requests that
+    are likely to fail.
+
+'''
+
+_policies = {}
+_breakers = {}
+
+
+class RetryPolicy:
+    '''
+        The retry settings of a provider
+
+        Kwargs:
+
+            attempts (int): Attempts made in all, including the first
+
+            statuses (tuple): HTTP statuses that are retried
+
+            backoff (float), max_backoff (float): Retries wait a random time
+                between 0 and min(max_backoff, backoff * 2 ** attempt)
+                seconds
+
+            deadline (float): Seconds after the first attempt past which no
+                retry is made
+
+        Every setting defaults to the one in 'config.Retries'.
+    '''
+
+    def __init__(self, attempts=None, statuses=None, backoff=None, max_backoff=None, deadline=None):
+        self.attempts = max(attempts or Retries.attempts, 1)
+        self.statuses = frozenset(statuses if statuses is not None else Retries.statuses)
+        self.backoff = Retries.backoff if backoff is None else backoff
+        self.max_backoff = Retries.max_backoff if max_backoff is None else max_backoff
+        self.deadline = Retries.deadline if deadline is None else deadline
+
+    def retryable(self, status):
+        return status in self.statuses
+
+    def delay(self, attempt, retry_after=None):
+        '''
+            Returns the seconds to wait after the attempt numbered 'attempt'
+                (from 0) failed. A Retry-After sent by the server is a lower
+                bound.
+        '''
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return delay if retry_after is None else max(delay, retry_after)
+
+
+class CircuitBreaker:
+    '''
+        Pauses a provider while its error rate is high
+
+        The outcomes of the last 'window' attempts are kept. Once at least
+            half the window is filled and the share of failures reaches
+            'threshold', the breaker opens and 'wait' holds every caller for
+            'cooldown' seconds. It then closes with a clean window.
+
+        Kwargs:
+
+            name (str): Provider name, used in log messages
+
+            window (int), threshold (float), cooldown (float): Default to
+                the breaker settings of 'config.Retries'
+    '''
+
+    def __init__(self, name=None, window=None, threshold=None, cooldown=None):
+        self.name = name
+        self.window = window or Retries.breaker_window
+        self.threshold = Retries.breaker_threshold if threshold is None else threshold
+        self.cooldown = Retries.breaker_cooldown if cooldown is None else cooldown
+        self._outcomes = deque(maxlen=self.window)
+        self._open_until = 0
+
+    @property
+    def open(self):
+        return self._open_until > time.monotonic()
+
+    async def wait(self):
+        ''' Returns once the breaker is closed '''
+        while True:
+            delay = self._open_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def record(self, ok):
+        ''' Records the outcome of an attempt, opening the breaker if the error rate is too high '''
+        if self.open:
+            return
+        self._outcomes.append(ok)
+        if len(self._outcomes) * 2 < self.window:
+            return
+        failures = self._outcomes.count(False) / len(self._outcomes)
+        if failures >= self.threshold:
+            logging.warning('%.0f%% of recent %s requests failed, pausing it for %ss',
+                            failures * 100, self.name or 'provider', self.cooldown)
+            self._open_until = time.monotonic() + self.cooldown
+            self._outcomes.clear()
+
+
+def retry_policy(provider):
+    '''
+        Returns the RetryPolicy of a provider, built from 'config.Retries'
+            and its entry in 'config.Retries.providers'
+    '''
+    if provider not in _policies:
+        _policies[provider] = RetryPolicy(**Retries.providers.get(provider, {}))
+    return _policies[provider]
+
+
+def set_retry_policy(provider, **settings):
+    '''
+        Overrides the retry policy of a provider for the rest of the process.
+            Takes the keyword arguments of RetryPolicy.
+    '''
+    _policies[provider] = RetryPolicy(**settings)
+
+
+def breaker(provider):
+    ''' Returns the shared CircuitBreaker of a provider, None when no provider is given '''
+    if provider is None:
+        return None
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+
+def retry_after(value):
+    '''
+        Parses a Retry-After header, given in seconds or as an HTTP date, into
+            seconds from now. Returns None when missing or unreadable.
+    '''
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
@@ -1,94 +1,429 @@
 import aiohttp
 import asyncio
+import atexit
+import contextvars
 import inspect
+import json
 import logging
 import re
 import time
+import weakref
+
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from seo_tools.cache import get_cache, request_key
+from seo_tools.config import Credentials, Network, Limits, Cache, Decoding
+from seo_tools.metrics import RequestRecord, emit, trace_config
+from seo_tools.quota import QuotaExceeded, charge
+from seo_tools.resolver import AiohttpResolver, get_resolver
+from seo_tools.retry import breaker, retry_after, retry_policy
 
 
 user_agent = 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-US; rv:1.9.0.7) Gecko/2009021910 Firefox/3.0.7'
 headers={'User-Agent':user_agent,}
 
+_sessions = weakref.WeakKeyDictionary()
+_limiters = {}
+_pool = None
+# The SEOClient whose session, limiters, cache and credentials are in use
+_client = contextvars.ContextVar('seo_tools_client', default=None)
+# Rate limiters of the batch or stream call in progress, by provider
+_call_limiters = contextvars.ContextVar('seo_tools_call_limiters', default=None)
+
+
+class APIError(Exception):
+    ''' Raised when an API call fails or returns an error payload '''
 
-async def get(url, count=0, **kwargs,):
-    if 'session' in kwargs:
-        session = kwargs.get('session')
-        del kwargs['session']
-        return await _send_get_request(session=session, url=url, **kwargs)
-    else:
-        async with aiohttp.ClientSession() as session:
-            return await _send_get_request(session=session, url=url, **kwargs)
 
+class TokenBucket:
+    '''
+        A token bucket rate limiter.
+
+        Tokens refill continuously at 'rate' per second up to 'burst'. Callers
+            that find the bucket empty reserve a future token and sleep until
+            it is due, so waiting callers are served in arrival order.
 
-async def post(url, count=0, **kwargs,):
-    if 'session' in kwargs:
-        session = kwargs.get('session')
-        del kwargs['session']
-        return await _send_post_request(session=session, url=url, **kwargs)
-    else:
-        async with aiohttp.ClientSession() as session:
-            return await _send_post_request(session, url, count=count+1, **kwargs)
+        Args:
 
+            rate (float): Tokens added per second
+
+        Kwargs:
 
-async def _send_get_request(session, url, count=0, **kwargs):
+            burst (int): Maximum number of tokens that can be banked
     '''
-        Sends a standard get request to a url, passing the keyword arguments
 
-        If returned a non-200 status code 3 times, returns an error message
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst or 1, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
 
+    async def acquire(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+def limiter(provider):
+    '''
+        Returns the shared TokenBucket of a provider, or None if the provider
+            is not rate limited. Defaults are read from 'config.Limits.rates',
+            or from the rates of the active SEOClient, which keeps limiters
+            of its own. A rate given to the batch or stream call in progress
+            takes precedence.
+    '''
+    if provider is None:
+        return None
+    overrides = _call_limiters.get()
+    if overrides is not None and provider in overrides:
+        return overrides[provider]
+    client = _client.get()
+    limiters = _limiters if client is None else client._limiters
+    if provider not in limiters:
+        rates = Limits.rates if client is None else client.rates
+        rate, burst = rates.get(provider) or (None, None)
+        limiters[provider] = TokenBucket(rate, burst) if rate else None
+    return limiters[provider]
+
+
+def set_rate_limit(provider, rate, burst=None):
+    '''
+        Overrides the rate limit of a provider for the rest of the process,
+            or for the active SEOClient.
 
         Args:
-            url (str): the url to be called by the get request.
+
+            provider (str): Provider name, e.g. 'pagespeed' or 'moz'
+
+            rate (float): Queries per second, None to disable limiting
 
         Kwargs:
-            count (int): The recursion count, function will exit after three
-                attempts
 
-            **kwargs (any): additional arguments for the passing of the request
+            burst (int): Queries that may be sent back to back
+    '''
+    client = _client.get()
+    limiters = _limiters if client is None else client._limiters
+    limiters[provider] = TokenBucket(rate, burst) if rate else None
+
+
+def credentials():
+    ''' Returns the credentials of the active SEOClient, else 'config.Credentials' '''
+    client = _client.get()
+    return Credentials if client is None else client.credentials
+
+
+def new_session():
+    '''
+        Creates an aiohttp.ClientSession set up from 'config.Network': pool
+            sizes, keep-alive, timeouts, the shared 'resolver.Resolver' and
+            the request tracing of 'metrics'
+    '''
+    connector = aiohttp.TCPConnector(
+        limit=Network.limit,
+        limit_per_host=Network.limit_per_host,
+        ttl_dns_cache=Network.ttl_dns_cache,
+        keepalive_timeout=Network.keepalive_timeout,
+        resolver=AiohttpResolver(get_resolver()),
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=Network.timeout),
+        trace_configs=[trace_config()],
+    )
+
+
+def get_session():
+    '''
+        Returns the session of the active SEOClient, or else the shared
+            aiohttp.ClientSession of the running event loop, creating it on
+            first use.
+
+        Every request sent through 'get' and 'post' reuses this session, so
+            connections are kept alive and pooled per host instead of paying
+            a new TCP/TLS handshake for every call. See 'new_session'.
 
         Returns:
 
-            A tuple of a boolean for success and a reponse message or a error
-                message
+            aiohttp.ClientSession
     '''
-    try:
-        resp = await session.request('GET', url=url, **kwargs)
-    except:
-        if count == 2:
-            return None
-        return await _send_get_request(session, url, count=count+1, **kwargs)
-    return await resp.json()
+    client = _client.get()
+    if client is not None:
+        return client.session
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _sessions[loop] = new_session()
+    return session
+
 
+async def close_session():
+    ''' Closes the shared session of the running event loop, if any '''
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
 
-async def _send_post_request(session, url, count=0, **kwargs):
+
+def run(coro):
     '''
-        Sends a standard post request to a url, passing the keyword arguments
+        Runs a coroutine on a new event loop and shuts the shared session
+            down cleanly once it has finished.
+
+        Args:
 
-        If returned a non-200 status code 6 times, returns an error message
+            coro (coroutine): The coroutine to be run
 
+        Returns:
+
+            The result of the coroutine
+    '''
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_session()
+    return asyncio.run(_main())
+
+
+def loads(body):
+    ''' Decodes a JSON document, with orjson when it is installed '''
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def _process_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(Decoding.workers)
+        atexit.register(_pool.shutdown)
+    return _pool
+
+
+async def offload(func, body):
+    '''
+        Runs func(body) where 'config.Decoding' says to: inline for small
+            bodies or when no executor is configured, otherwise in a thread
+            or process pool. With a process pool, func and its result must
+            be picklable.
+    '''
+    if Decoding.executor is None or len(body) < Decoding.min_bytes:
+        return func(body)
+    loop = asyncio.get_running_loop()
+    if Decoding.executor == 'process':
+        return await loop.run_in_executor(_process_pool(), func, body)
+    return await loop.run_in_executor(None, func, body)
+
+
+async def get(url, session=None, cache=None, parse=None, provider=None, cost=1, record=None, retry=None, **kwargs):
+    '''
+        Sends a get request through the shared session and returns the decoded
+            JSON response.
 
         Args:
-            url (str): the url to be called by the get request.
+
+            url (str or callable): the url to be called by the get request.
+                A callable is called for the url before every attempt, once
+                the rate limit has been waited on, so a signature it carries
+                is fresh when the request is sent. Its responses are not
+                cached.
 
         Kwargs:
-            count (int): The recursion count, function will exit after three
-                attempts
 
-            **kwargs (any): additional arguments for the passing of the request
+            session (aiohttp.ClientSession): Session to send the request with,
+                defaults to the shared session
+
+            cache (bool or SQLiteCache): Serve the response from, and store it
+                in, the local response cache. True uses the cache of the
+                active SEOClient, or the default cache when
+                'config.Cache.enabled' is set. Cache hits are not sent and do
+                not count against the provider's rate limit.
+
+            parse (callable): Called with the raw response body in place of
+                the JSON decoder, see 'offload'. Responses it raises on are
+                not cached.
+
+            provider (str): Name of the API provider whose rate limit, retry
+                policy, quota and metrics the request counts against
+
+            cost (int): Quota units every attempt uses, see 'quota.charge'
+
+            record (metrics.RequestRecord): Filled in with the measurements of
+                the request in place of a new record, so the caller can tell
+                from its status why the request failed
+
+            retry (retry.RetryPolicy): Used in place of the provider's retry
+                policy, e.g. to not retry a request that is paid for
+
+            **kwargs (any): passed on to the aiohttp request
 
         Returns:
 
-            A tuple of a boolean for success and a reponse message or a error
-                message
+            The decoded response, or None if the request failed, see
+                '_send_request'
+
+        Raises:
+
+            quota.QuotaExceeded: If the provider's quota does not allow the
+                request to be sent
+    '''
+    if callable(url):
+        cache = None
+    elif cache is True:
+        client = _client.get()
+        if client is not None:
+            cache = client.cache
+        else:
+            cache = get_cache() if Cache.enabled else None
+    record = record or RequestRecord(provider, 'GET', None if callable(url) else url)
+    body = None
+    if cache is not None:
+        key = request_key('GET', url)
+        body = cache.get_bytes(key)
+        record.cached = body is not None
+    if not record.cached:
+        body = await _send_request(session or get_session(), 'GET', url, record, cost, retry, **kwargs)
+    data = await _decode(record, body, parse)
+    if cache is not None and not record.cached and record.error is None:
+        cache.set_bytes(key, body)
+    return data
+
+
+async def post(url, session=None, parse=None, provider=None, cost=1, retry=None, **kwargs):
+    ''' Sends a post request through the shared session, see 'get' '''
+    record = RequestRecord(provider, 'POST', None if callable(url) else url)
+    body = await _send_request(session or get_session(), 'POST', url, record, cost, retry, **kwargs)
+    return await _decode(record, body, parse)
+
+
+async def _decode(record, body, parse=None):
+    '''
+        Decodes a response body with 'parse', or as JSON, and ends its
+            record. JSON error payloads and bodies that cannot be decoded
+            are marked as errors on the record.
     '''
     try:
-        resp = await session.request('POST', url=url, **kwargs)
-    except:
-        if count == 2:
+        if body is None:
+            return None
+        start = time.perf_counter()
+        try:
+            if parse is not None:
+                return await offload(parse, body)
+            data = await offload(loads, body)
+        except ValueError:
+            if parse is not None:
+                raise
+            record.error = 'undecodable body'
+            logging.warning('Could not decode the response of %s', record.url)
             return None
-        return await _send_post_request(session, url, count=count+1, **kwargs)
+        finally:
+            record.decode = time.perf_counter() - start
+        if isinstance(data, dict) and data.get('error'):
+            record.error = 'error payload'
+        return data
+    except Exception as e:
+        record.error = record.error or repr(e)
+        raise
+    finally:
+        record.finish()
+        emit('end', record)
+
+
+async def _send_request(session, method, url, record, cost=1, retry=None, **kwargs):
+    '''
+        Sends a request under the retry policy, circuit breaker, rate limit
+            and quota of the record's provider and returns the raw response
+            body
+
+        Connection errors, timeouts and the retryable statuses of the
+            provider's policy are retried with jittered exponential backoff,
+            waiting at least as long as a Retry-After header asks. Other
+            error statuses are not retried.
+
+        Args:
 
-    return await resp.json()
+            session (aiohttp.ClientSession): Session to send the request with
+
+            method (str): 'GET' or 'POST'
+
+            url (str or callable): the url to be called, or a function
+                building it for each attempt, see 'get'
+
+            record (metrics.RequestRecord): Filled in with the measurements of
+                the request
+
+            cost (int): Quota units charged for every attempt
+
+            retry (retry.RetryPolicy): Defaults to the provider's policy
+
+            **kwargs (any): additional arguments for the passing of the request
+
+        Returns:
+
+            The response body (bytes), or None if every attempt failed or the
+                status was an error that is not retried. The status and error
+                are left on the record.
+
+        Raises:
+
+            quota.QuotaExceeded: Before an attempt the quota does not allow
+    '''
+    provider = record.provider
+    policy = retry or retry_policy(provider)
+    circuit = breaker(provider)
+    bucket = limiter(provider)
+    for attempt in range(policy.attempts):
+        record.begin(attempt)
+        if circuit is not None:
+            await circuit.wait()
+        if bucket is not None:
+            await bucket.acquire()
+        await charge(provider, credentials(), cost)
+        if callable(url):
+            record.url = url()
+        record.sent()
+        emit('start', record)
+        wait = None
+        try:
+            async with session.request(method, url=record.url, trace_request_ctx=record, **kwargs) as resp:
+                record.status = resp.status
+                start = time.perf_counter()
+                body = await resp.read()
+                record.body = time.perf_counter() - start
+                record.bytes_received = len(body)
+                if resp.status < 400:
+                    if circuit is not None:
+                        circuit.record(True)
+                    return body
+                record.error = f'HTTP {resp.status}'
+                if not policy.retryable(resp.status):
+                    if circuit is not None:
+                        circuit.record(True)
+                    logging.warning('%s %s returned %s: %s', method, record.url, resp.status,
+                                    body[:200].decode('utf-8', 'replace'))
+                    return None
+                wait = retry_after(resp.headers.get('Retry-After'))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record.error = repr(e)
+        if circuit is not None:
+            circuit.record(False)
+        if attempt + 1 == policy.attempts:
+            break
+        delay = policy.delay(attempt, wait)
+        if time.perf_counter() - record.started + delay > policy.deadline:
+            break
+        record.delay = delay
+        emit('retry', record)
+        logging.info('%s %s failed (%s), retrying in %.1fs', method, record.url, record.error, delay)
+        await asyncio.sleep(delay)
+    logging.warning('%s %s failed after %i attempts: %s', method, record.url, record.attempt + 1, record.error)
+    return None
 
 
 def clean_url(url):
@@ -99,8 +434,214 @@ def clean_url(url):
     return re.sub(r'(^\w+:|^)\/\/', "", url).replace('www.', '')
 
 
-async def batch(func, urls, **kwargs):
-    tasks = []
-    for url in urls:
-        tasks.append(func(url, **kwargs))
-    return await asyncio.gather(*tasks, return_exceptions=True)
+def hostname(url):
+    '''
+        Returns the lower-cased host name of a url, which may be given
+            without its protocol.
+    '''
+    if '//' not in url:
+        url = '//' + url
+    return urlsplit(url).hostname or ''
+
+
+def _call_context(provider, rate, burst):
+    '''
+        Returns a copy of the current context in which the provider is
+            limited to 'rate', for the calls of a single batch or stream,
+            or None when no rate is given
+    '''
+    if rate is None and burst is None:
+        return None
+    if provider is None:
+        raise ValueError('rate and burst only apply to calls made to an API provider')
+    if rate is None:
+        client = _client.get()
+        rate = ((Limits.rates if client is None else client.rates).get(provider) or (None, None))[0]
+    context = contextvars.copy_context()
+    overrides = dict(context.get(_call_limiters) or {})
+    overrides[provider] = TokenBucket(rate, burst) if rate else None
+    context.run(_call_limiters.set, overrides)
+    return context
+
+
+async def _imap(func, items, concurrency=None, ordered=False, buffer=None, provider=None, call_context=None,
+                **kwargs):
+    '''
+        Runs 'func' over 'items' with at most 'concurrency' calls in flight,
+            pulling items lazily from the iterable as slots free up.
+
+        Yields (index, item, result) tuples in completion order, or in input
+            order when 'ordered' is set. Ordered output holds at most 'buffer'
+            results back while waiting on a slower earlier item; no new item
+            is started further than 'buffer' places ahead of the last one
+            yielded. Exceptions raised by 'func' are yielded as the result, as
+            with asyncio.gather(return_exceptions=True). The calls run in
+            copies of 'call_context' when one is given, see '_call_context'.
+
+        Once a call raises QuotaExceeded for 'provider' no further item is
+            started. The items that were not are yielded, after those in
+            flight, with that same QuotaExceeded as their result.
+    '''
+    concurrency = concurrency or Limits.concurrency
+    buffer = buffer or 2 * concurrency
+    items = iter(items)
+    pending = {}
+    held = {}
+    scheduled = 0
+    released = 0
+    exceeded = None
+
+    def fill():
+        nonlocal scheduled
+        while exceeded is None and len(pending) < concurrency and (not ordered or scheduled < released + buffer):
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            if call_context is None:
+                task = asyncio.ensure_future(func(item, **kwargs))
+            else:
+                task = call_context.run(asyncio.ensure_future, func(item, **kwargs))
+            pending[task] = (scheduled, item)
+            scheduled += 1
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+            ready = []
+            for task in done:
+                i, item = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    result = e
+                if exceeded is None and isinstance(result, QuotaExceeded) and result.provider == provider:
+                    exceeded = result
+                if ordered:
+                    held[i] = (item, result)
+                else:
+                    ready.append((i, item, result))
+            while released in held:
+                ready.append((released,) + held.pop(released))
+                released += 1
+            fill()
+            for entry in ready:
+                yield entry
+        if exceeded is not None:
+            for item in items:
+                yield scheduled, item, exceeded
+                scheduled += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def stream(func, urls, concurrency=None, ordered=False, buffer=None, provider=None, rate=None, burst=None, **kwargs):
+    '''
+        Runs a coroutine function over an iterable of urls and yields
+            (url, result) pairs as each call completes.
+
+        Only the calls in flight and, for ordered output, the reorder buffer
+            are held in memory, so long url lists stream through in constant
+            space.
+
+        Args:
+
+            func (coroutine function): Called as func(url, **kwargs)
+
+            urls (iterable): Urls to be run, consumed lazily
+
+        Kwargs:
+
+            concurrency (int): Maximum calls in flight, defaults to
+                'config.Limits.concurrency'
+
+            ordered (bool): Yield results in input order instead of
+                completion order
+
+            buffer (int): Maximum results held back for ordered output,
+                defaults to twice the concurrency
+
+            provider, rate, burst: As for 'batch'
+
+        Yields:
+
+            (url, result) tuples, with exceptions in place of failed calls.
+                Once the provider's quota is used up no further url is run,
+                see 'batch'.
+    '''
+    call_context = _call_context(provider, rate, burst)
+    async for _, url, result in _imap(func, urls, concurrency, ordered=ordered, buffer=buffer, provider=provider,
+                                      call_context=call_context, **kwargs):
+        yield url, result
+
+
+def iterate(agen):
+    '''
+        Drives an async generator from synchronous code on a private event
+            loop, closing the generator and the shared session when the
+            iteration ends or is abandoned.
+
+        Args:
+
+            agen (async generator): The generator to be consumed
+
+        Yields:
+
+            The items of the async generator
+    '''
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(close_session())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def batch(func, urls, concurrency=None, provider=None, rate=None, burst=None, **kwargs):
+    '''
+        Runs a coroutine function over an iterable of urls with bounded
+            concurrency and returns the results in input order.
+
+        Args:
+
+            func (coroutine function): Called as func(url, **kwargs)
+
+            urls (iterable): Urls to be run, consumed lazily
+
+        Kwargs:
+
+            concurrency (int): Maximum calls in flight, defaults to
+                'config.Limits.concurrency'
+
+            provider (str): Provider whose rate limit is set by 'rate' and
+                'burst'. Once a call raises QuotaExceeded for it, no further
+                url is run: the urls not yet started are deferred, with that
+                same QuotaExceeded instance as their result
+
+            rate (float): Queries per second allowed for the provider during
+                this call only. Other calls, including those running at the
+                same time, keep the shared limit
+
+            burst (int): Queries that may be sent back to back
+
+        Raises:
+
+            ValueError: If a rate or burst is given without a provider
+
+        Returns:
+
+            A list of results, with exceptions in place of failed calls
+    '''
+    call_context = _call_context(provider, rate, burst)
+    results = {}
+    async for i, _, result in _imap(func, urls, concurrency, provider=provider, call_context=call_context, **kwargs):
+        results[i] = result
+    return [results[i] for i in range(len(results))]
@@ -14,6 +14,7 @@ setup(name='seo_tools',
       entry_points={
           'console_scripts': [
               'blighthouse = seo_tools.__main__:blighthouse',
+              'seo_tools = seo_tools.__main__:main',
               'convert_crawlreport = seo_tools.crawl_report:main'
           ]
       },
@@ -0,0 +1,81 @@
+import asyncio
+import time
+import zlib
+
+from aiohttp import web
+
+from seo_tools.cache import SQLiteCache, request_key
+from seo_tools.utils import get, new_session
+
+
+def test_store_and_hit(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.get('missing') is None
+    cache.set('a', {'score': 1})
+    cache.set_bytes('b', b'raw')
+    assert cache.get('a') == {'score': 1}
+    assert cache.get_bytes('b') == b'raw'
+    assert len(cache) == 2
+
+
+def test_ttl(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), ttl=0.05)
+    cache.set('short', 1)
+    cache.set('long', 2, ttl=60)
+    time.sleep(0.1)
+    assert cache.get('short') is None
+    assert cache.get('long') == 2
+
+
+def test_lru_eviction(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    blob = bytes(range(256)) * 4
+    size = len(zlib.compress(blob))
+    cache.max_bytes = 2 * size
+    cache.set_bytes('old', blob)
+    cache.set_bytes('used', blob)
+    time.sleep(0.01)
+    cache.get_bytes('old')
+    cache.set_bytes('new', blob)
+    assert cache.get_bytes('used') is None
+    assert cache.get_bytes('old') == blob
+    assert cache.get_bytes('new') == blob
+
+
+def test_request_key():
+    api = 'https://www.googleapis.com/pagespeedonline/v5/runPagespeed'
+    a = request_key('GET', f'{api}?url=https://Example.com/&strategy=mobile&key=secret')
+    b = request_key('GET', f'{api}?key=other&strategy=mobile&url=https://example.com:443')
+    assert a == b
+    assert 'secret' not in a
+    assert a != request_key('GET', f'{api}?url=https://example.com&strategy=desktop')
+
+
+def test_get_stores_into_empty_cache(tmp_path):
+    # An empty SQLiteCache is falsy, the first response must still be stored
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    hits = []
+
+    async def handler(request):
+        hits.append(request.path)
+        return web.json_response({'ok': True})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/api', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        session = new_session()
+        try:
+            url = f'http://127.0.0.1:{port}/api?url=https://a.com'
+            return [await get(url, session=session, cache=cache) for _ in range(2)]
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == [{'ok': True}, {'ok': True}]
+    assert hits == ['/api']
+    assert len(cache) == 1
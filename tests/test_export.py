@@ -0,0 +1,68 @@
+import math
+
+import pandas as pd
+import pytest
+
+from seo_tools._lighthouse import LighthouseReport
+from seo_tools.export import to_frame, write_csv, write_parquet
+
+
+def _report(url, strategy='mobile', audits=('first-contentful-paint',)):
+    return LighthouseReport(strategy, {'lighthouseResult': {
+        'finalUrl': url,
+        'fetchTime': '2026-10-18T12:00:00.000Z',
+        'categories': {'performance': {'score': 0.5}, 'seo': {'score': None}},
+        'audits': {a: {'score': 1, 'numericValue': 100.0 + i} for i, a in enumerate(audits)},
+    }}, details=False)
+
+
+def _pairs():
+    # A chunk of failures first, then a report with an audit the first
+    # report did not have
+    return [('https://a.com', None), ('https://b.com', ValueError()),
+            ('https://c.com', [_report('https://c.com'), None]),
+            ('https://d.com', _report('https://d.com', 'desktop', ('first-contentful-paint', 'speed-index')))]
+
+
+def test_to_frame():
+    frame = to_frame(_pairs())
+    assert list(frame['url']) == ['https://c.com', 'https://d.com']
+    assert list(frame.columns) == ['url', 'strategy', 'fetch_time', 'category.performance', 'category.seo',
+                                   'audit.first-contentful-paint', 'audit.speed-index']
+    assert frame['category.performance'].tolist() == [0.5, 0.5]
+    assert math.isnan(frame.loc[0, 'audit.speed-index'])
+    assert frame.loc[1, 'audit.speed-index'] == 101.0
+
+
+def test_write_csv_in_chunks(tmp_path):
+    path = tmp_path / 'out.csv'
+    assert write_csv(_pairs(), path, chunksize=1) == 2
+    frame = pd.read_csv(path)
+    # The columns are those of the first chunk with a report
+    assert list(frame.columns) == ['url', 'strategy', 'fetch_time', 'category.performance', 'category.seo',
+                                   'audit.first-contentful-paint']
+    assert list(frame['url']) == ['https://c.com', 'https://d.com']
+
+
+def test_write_csv_with_fixed_columns(tmp_path):
+    path = tmp_path / 'out.csv'
+    write_csv(_pairs(), path, chunksize=1, columns=['audit.speed-index', 'category.pwa'])
+    frame = pd.read_csv(path)
+    assert list(frame.columns) == ['url', 'strategy', 'fetch_time', 'audit.speed-index', 'category.pwa']
+    assert frame['audit.speed-index'].isna().tolist() == [True, False]
+
+
+def test_write_parquet_in_chunks(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = tmp_path / 'out.parquet'
+    pairs = [(f'https://{i}.com', _report(f'https://{i}.com')) for i in range(5)]
+    assert write_parquet(pairs, path, chunksize=2) == 5
+    frame = pd.read_parquet(path)
+    assert list(frame['url']) == [f'https://{i}.com' for i in range(5)]
+    assert frame['audit.first-contentful-paint'].tolist() == [100.0] * 5
+
+
+def test_write_without_reports(tmp_path):
+    path = tmp_path / 'out.csv'
+    assert write_csv([('https://a.com', None)], path) == 0
+    assert list(pd.read_csv(path).columns) == ['url', 'strategy', 'fetch_time']
@@ -0,0 +1,102 @@
+import asyncio
+import glob
+import importlib.util
+import os
+
+import pytest
+from aiohttp import web
+
+from seo_tools import _google_search, retry, utils
+from seo_tools.config import APIs
+from seo_tools.utils import close_session
+
+benchmarks = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+fixtures = os.path.join(benchmarks, 'fixtures')
+
+
+def _pages():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(fixtures, 'serp_*.html'))):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+
+def test_parse_serp_fixtures():
+    pages = _pages()
+    assert pages
+    for page in pages:
+        records = _google_search.parse_serp(page, 'shoes', offset=20)
+        assert records
+        assert [r['Rank'] for r in records] == list(range(21, 21 + len(records)))
+        for record in records:
+            assert record['Query'] == 'shoes'
+            assert record['Title'] and record['Description']
+            assert record['URL'].startswith('http') and '/url?q=' not in record['URL']
+
+
+def test_parse_serp_matches_the_previous_parser():
+    # The select() based parser it replaced, kept in the benchmark
+    pytest.importorskip('bs4')
+    spec = importlib.util.spec_from_file_location('serp_parse', os.path.join(benchmarks, 'serp_parse.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for page in _pages():
+        assert _google_search.parse_serp(page, 'shoes') == module._soup_parse(page, 'shoes')
+
+
+def test_parse_serp_without_results():
+    with pytest.raises(_google_search.APIError):
+        _google_search.parse_serp(b'<html><body><p>Nothing</p></body></html>')
+
+
+def _serve(monkeypatch, handler, func):
+    async def main():
+        app = web.Application()
+        app.router.add_get('/search', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(APIs, 'google_search', f'http://127.0.0.1:{port}/search?start=%i&num=%i&q=%s')
+        try:
+            return await func()
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+    monkeypatch.setitem(utils._limiters, 'google', None)
+    monkeypatch.setitem(retry._policies, 'google', retry.RetryPolicy(statuses=(500, 502, 504), backoff=0.01))
+    return asyncio.run(main())
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    with open(os.path.join(fixtures, 'serp_1.html'), 'rb') as f:
+        page = f.read()
+    calls = []
+
+    async def handler(request):
+        calls.append(request.query['q'])
+        if len(calls) == 1:
+            return web.Response(status=502)
+        return web.Response(body=page, content_type='text/html')
+
+    records = _serve(monkeypatch, handler, lambda: _google_search.search_records('shoes', num=10))
+    assert len(calls) == 2
+    assert records and records[0]['Rank'] == 1 and records[0]['Query'] == 'shoes'
+
+
+def test_block_backs_off(monkeypatch):
+    monkeypatch.setattr(_google_search, '_backoff', 0.01)
+    monkeypatch.setattr(_google_search, '_retries', 1)
+    calls = []
+
+    async def handler(request):
+        calls.append(request.query['q'])
+        return web.Response(status=429)
+
+    with pytest.raises(_google_search.Blocked):
+        _serve(monkeypatch, handler, lambda: _google_search.search_records('shoes'))
+    # One request per backoff attempt, 429 is not retried by the send path
+    assert len(calls) == 2
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from seo_tools import retry, utils
+from seo_tools._gt_metrix import GTMetrixPoller
+from seo_tools.config import APIs, Retries
+from seo_tools.utils import APIError, close_session
+
+completed = {'state': 'completed', 'results': {'page_load_time': 1}}
+
+
+async def _start(request):
+    url = (await request.post())['url']
+    return web.json_response({'test_id': url, 'poll_state_url': f'{request.url.origin()}/poll/{url}'})
+
+
+def _run(monkeypatch, poll, func, start=_start):
+    async def main():
+        app = web.Application()
+        app.router.add_post('/start', start)
+        app.router.add_get('/poll/{id}', poll)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        monkeypatch.setattr(APIs, 'gtm_start', f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/start')
+        try:
+            return await func(GTMetrixPoller())
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+    monkeypatch.setattr(GTMetrixPoller, 'min_interval', 0.01)
+    monkeypatch.setitem(utils._limiters, 'gt_metrix', None)
+    settings = dict(Retries.providers.get('gt_metrix', {}), backoff=0.01)
+    monkeypatch.setitem(retry._policies, 'gt_metrix', retry.RetryPolicy(**settings))
+    return asyncio.run(main())
+
+
+def test_slow_poll_does_not_hold_up_others(monkeypatch):
+    polls = []
+
+    async def poll(request):
+        polls.append(request.match_info['id'])
+        if request.match_info['id'] == 'slow':
+            await asyncio.sleep(1)
+        elif polls.count('fast') < 3:
+            return web.json_response({'state': 'started'})
+        return web.json_response(completed)
+
+    async def main(poller):
+        start = time.monotonic()
+        finished = {}
+
+        async def test(url):
+            await poller.test(url)
+            finished[url] = time.monotonic() - start
+
+        await asyncio.gather(test('slow'), test('fast'))
+        return finished
+
+    finished = _run(monkeypatch, poll, main)
+    assert finished['fast'] < 0.5 <= finished['slow']
+
+
+def test_poll_retries_server_errors(monkeypatch):
+    polls = []
+
+    async def poll(request):
+        polls.append(request.match_info['id'])
+        if len(polls) == 1:
+            return web.Response(status=500)
+        return web.json_response(completed)
+
+    result = _run(monkeypatch, poll, lambda poller: poller.test('a'))
+    assert result.page_load_time == 1
+    assert polls == ['a', 'a']
+
+
+def test_start_is_not_retried_on_server_errors(monkeypatch):
+    starts = []
+
+    async def start(request):
+        starts.append(request)
+        return web.Response(status=500)
+
+    async def poll(request):
+        return web.json_response(completed)
+
+    with pytest.raises(APIError):
+        _run(monkeypatch, poll, lambda poller: poller.test('a'), start)
+    assert len(starts) == 1
@@ -0,0 +1,117 @@
+import asyncio
+import sqlite3
+import time
+
+from seo_tools import jobs
+from seo_tools.config import Jobs
+from seo_tools.pipeline import available_checks
+
+
+def _queue(tmp_path, **kwargs):
+    return jobs.JobQueue(str(tmp_path / 'jobs.sqlite'), **kwargs)
+
+
+def test_lease_expiry(tmp_path):
+    queue = _queue(tmp_path, visibility=0.05, max_attempts=2)
+    queue.enqueue(['https://a.com'], ['https'])
+    first = queue.lease('a')
+    assert len(first) == 1 and queue.lease('b') == []
+    time.sleep(0.1)
+    # The lease ran out, the job goes to the next worker and the first
+    # one can no longer store its result
+    second = queue.lease('b')
+    assert [j.id for j in second] == [first[0].id] and second[0].attempts == 2
+    assert not queue.complete(first[0], {'https': True}, 'a')
+    assert queue.complete(second[0], {'https': True}, 'b')
+    assert queue.status()['https']['done'] == 1
+
+
+def test_lease_expiry_on_last_attempt_fails(tmp_path):
+    queue = _queue(tmp_path, visibility=0.05, max_attempts=1)
+    queue.enqueue(['https://a.com'], ['https'])
+    queue.lease('a')
+    time.sleep(0.1)
+    assert queue.lease('b') == []
+    assert [e[3] for e in queue.errors()] == ['lease expired']
+
+
+def test_fail_retries_with_backoff_then_fails(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2, retry_delay=0.05)
+    queue.enqueue(['https://a.com'], ['https'])
+    job, = queue.lease('a')
+    assert queue.fail(job, 'boom', 'a')
+    assert queue.lease('a') == []
+    time.sleep(0.1)
+    job, = queue.lease('a')
+    assert job.attempts == 2
+    queue.fail(job, 'boom again', 'a')
+    assert queue.status()['https']['failed'] == 1
+    assert list(queue.errors()) == [('https://a.com', 'https', 2, 'boom again')]
+    assert queue.retry_failed() == 1
+    assert queue.lease('a')[0].attempts == 1
+
+
+def test_priority_and_release(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue(['https://low.com'], ['https'], priority=0)
+    queue.enqueue(['https://high.com'], ['https'], priority=2)
+    job, = queue.lease('a')
+    assert job.url == 'https://high.com' and job.priority == 2
+    # A released job does not count the attempt
+    queue.release([job.id], 'a')
+    again = queue.lease('a', 2)
+    assert again[0].id == job.id and again[0].attempts == 1
+
+
+async def _check_ok(url, context):
+    await asyncio.sleep(0.01)
+    return {'ok': url}
+
+
+def test_worker_survives_locked_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(Jobs, 'poll_interval', 0.01)
+    monkeypatch.setitem(available_checks, 'ok', _check_ok)
+    queue = jobs.JobQueue(str(tmp_path / 'jobs.sqlite'), visibility=0.2, retry_delay=0)
+    queue.enqueue(['https://a.com'], ['ok'])
+    lease, complete = queue.lease, queue.complete
+    calls = {'lease': 0, 'complete': 0}
+
+    def slow_lease(*args):
+        # Waits on the lock of another worker
+        calls['lease'] += 1
+        if calls['lease'] == 1:
+            time.sleep(0.3)
+        return lease(*args)
+
+    def locked_complete(*args):
+        calls['complete'] += 1
+        if calls['complete'] == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return complete(*args)
+
+    monkeypatch.setattr(queue, 'lease', slow_lease)
+    monkeypatch.setattr(queue, 'complete', locked_complete)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        try:
+            counts = await jobs.work(queue, concurrency=1, exit_when_done=True)
+        finally:
+            ticker.cancel()
+        return counts, ticks
+
+    counts, ticks = asyncio.run(main())
+    # The loop kept running while the lease waited, and the job whose
+    # result could not be stored ran again once its lease expired
+    assert ticks > 10
+    assert counts['done'] == 1
+    assert calls['complete'] == 2
+    assert list(queue.results()) == [('https://a.com', 'ok', {'ok': 'https://a.com'})]
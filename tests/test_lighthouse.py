@@ -0,0 +1,61 @@
+import json
+import pickle
+
+import pytest
+
+from seo_tools._lighthouse import LighthouseReport, parse_report
+from seo_tools.utils import APIError
+
+response = {'lighthouseResult': {
+    'requestedUrl': 'https://a.com',
+    'finalUrl': 'https://www.a.com/',
+    'fetchTime': '2026-10-18T12:00:00.000Z',
+    'categories': {'performance': {'score': 0.93}, 'pwa': {'score': None}},
+    'audits': {
+        'first-contentful-paint': {'score': 0.9, 'numericValue': 1203.5, 'displayValue': '1.2 s',
+                                   'title': 'First Contentful Paint'},
+        'final-screenshot': {'score': None, 'details': {'type': 'screenshot', 'data': 'image'}},
+        'uses-long-cache-ttl': {'score': 0, 'numericValue': 3, 'details': {'type': 'table', 'items': [1, 2]}},
+    },
+}}
+
+
+def test_round_trip():
+    report = LighthouseReport('mobile', response)
+    assert (report.strategy, report.url) == ('mobile', 'https://www.a.com/')
+    assert report.fetch_time == '2026-10-18T12:00:00.000Z'
+    assert report.score('performance') == 0.93
+    assert report.score('pwa') is None
+    assert report.categories == {'performance': {'score': 0.93}, 'pwa': {'score': None}}
+    assert report.audit_score('uses-long-cache-ttl') == 0
+    assert report.numeric_value('first-contentful-paint') == 1203.5
+    assert report.numeric_value('final-screenshot') is None
+    assert report.display_value('first-contentful-paint') == '1.2 s'
+    assert report.audits['first-contentful-paint'] == {'score': 0.9, 'numericValue': 1203.5, 'displayValue': '1.2 s'}
+    # Screenshots are only kept with details='all'
+    assert report.details() == {'uses-long-cache-ttl': {'type': 'table', 'items': [1, 2]}}
+    assert LighthouseReport('mobile', response, details='all').details('final-screenshot')['data'] == 'image'
+    assert LighthouseReport('mobile', response, details=False).details() is None
+
+
+def test_fields():
+    report = LighthouseReport('desktop', response, fields=['title'])
+    assert report.audit_scores is None and report.numeric_values is None
+    assert report.audits['first-contentful-paint'] == {'title': 'First Contentful Paint'}
+
+
+def test_pickle():
+    report = LighthouseReport('mobile', response)
+    copy = pickle.loads(pickle.dumps(report))
+    assert copy.url == report.url
+    assert copy.categories == report.categories
+    assert copy.audits == report.audits
+    assert copy.details() == report.details()
+    assert copy.numeric_value('first-contentful-paint') == 1203.5
+
+
+def test_parse_report():
+    report = parse_report('mobile', None, False, json.dumps(response).encode())
+    assert report.score('performance') == 0.93
+    with pytest.raises(APIError):
+        parse_report('mobile', None, False, b'{"error": {"code": 500}}')
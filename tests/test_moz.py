@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from seo_tools import _moz
+from seo_tools.config import APIs
+from seo_tools.utils import APIError, close_session
+
+
+def test_signed_after_rate_limit_wait(monkeypatch):
+    # Chunks wait on the limiter for longer than a signature lives, every
+    # request must still carry one that has not expired
+    expired = []
+
+    async def handler(request):
+        expired.append(int(request.query['Expires']) < time.time())
+        return web.json_response([{'pda': 1, 'upa': 2} for _ in await request.json()])
+
+    async def main():
+        app = web.Application()
+        app.router.add_post('/batch', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(APIs, 'moz_batch_api', f'http://127.0.0.1:{port}/batch?%s')
+        try:
+            return await _moz.moz_batch([f'https://a{i}.com' for i in range(6)], chunk_size=1, rate=2)
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+    monkeypatch.setattr(_moz, '_lifetime', 1)
+    monkeypatch.setattr(_moz, '_renew', 0.2)
+    monkeypatch.setattr(_moz, '_signature', None)
+    assert asyncio.run(main()) == [(1, 2)] * 6
+    assert expired == [False] * 6
+
+
+def test_failed_single_lookup_raises_api_error(monkeypatch):
+    async def handler(request):
+        return web.Response(status=404)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/metrics/{url}', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(APIs, 'moz_api', f'http://127.0.0.1:{port}/metrics/%s?%s')
+        try:
+            with pytest.raises(APIError, match='Moz'):
+                await _moz.moz_single('https://a.com')
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+    asyncio.run(main())
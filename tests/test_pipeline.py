@@ -0,0 +1,35 @@
+import asyncio
+
+from seo_tools.pipeline import audit_frame, available_checks
+
+
+def test_audit_frame_without_urls():
+    frame = asyncio.run(audit_frame([], ['https', 'moz']))
+    assert frame.empty
+    assert frame.index.name == 'url'
+    assert list(frame.columns) == ['https', 'final_url', 'redirects', 'redirect_time', 'moz_da', 'moz_pa', 'errors']
+
+
+async def _check_length(url, context):
+    # Later urls finish first
+    await asyncio.sleep(0.05 / len(url))
+    return {'length': len(url)}
+
+
+async def _check_broken(url, context):
+    if url.endswith('/b'):
+        raise ValueError(url)
+    return {'broken': False}
+
+
+def test_audit_frame_rows(monkeypatch):
+    monkeypatch.setitem(available_checks, 'length', _check_length)
+    monkeypatch.setitem(available_checks, 'broken', _check_broken)
+    urls = ['127.0.0.1/a', 'http://127.0.0.1/b', '127.0.0.1/a', 'http://127.0.0.1/ccc']
+    frame = asyncio.run(audit_frame(urls, ['length', 'broken'], concurrency=3))
+    # One row per unique url, in input order
+    assert list(frame.index) == ['http://127.0.0.1/a', 'http://127.0.0.1/b', 'http://127.0.0.1/ccc']
+    assert frame.index.name == 'url'
+    assert frame['length'].tolist() == [18, 18, 20]
+    assert frame['errors'].isna().tolist() == [True, False, True]
+    assert frame.loc['http://127.0.0.1/b', 'errors'].startswith('broken: ValueError')
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+from datetime import datetime, timezone
+
+import pytest
+
+from seo_tools import quota
+from seo_tools.config import Credentials, Quotas
+from seo_tools.quota import QuotaExceeded, UsageStore, charge, period, priority, usage
+from seo_tools.utils import batch
+
+
+@pytest.fixture
+def quotas(tmp_path, monkeypatch):
+    monkeypatch.setattr(Quotas, 'enabled', True)
+    monkeypatch.setattr(Quotas, 'path', str(tmp_path / 'quotas.sqlite'))
+    monkeypatch.setattr(Quotas, 'budgets', {'pagespeed': (10, 'day'), 'moz': None})
+    monkeypatch.setattr(Quotas, 'shares', {0: 0.5, 1: 0.8, 2: 1.0})
+    monkeypatch.setattr(Quotas, 'default_priority', 1)
+    monkeypatch.setattr(quota, '_store', None)
+    yield
+    quota.get_store().close()
+    quota._store = None
+
+
+def _charge(n, level=None, provider='pagespeed'):
+    async def main():
+        with priority(level):
+            for _ in range(n):
+                await charge(provider, Credentials)
+    asyncio.run(main())
+
+
+def test_charge_up_to_the_share_of_the_priority(quotas):
+    _charge(8)
+    with pytest.raises(QuotaExceeded) as e:
+        _charge(1)
+    assert (e.value.used, e.value.allowed) == (8, 8)
+    assert e.value.reset > time.time()
+    # Higher priority work may use the rest of the budget
+    _charge(2, level=2)
+    with pytest.raises(QuotaExceeded):
+        _charge(1, level=2)
+    assert usage()[0]['used'] == 10
+
+
+def test_charge_without_a_budget(quotas):
+    _charge(100, provider='moz')
+    _charge(100, provider=None)
+    assert [row['provider'] for row in usage()] == ['pagespeed']
+
+
+def test_usage_store_is_shared(tmp_path):
+    path = str(tmp_path / 'quotas.sqlite')
+    a, b = UsageStore(path), UsageStore(path)
+    assert a.charge('moz', 'key', '2026-10', 3, 5) == (True, 3)
+    assert b.charge('moz', 'key', '2026-10', 3, 5) == (False, 3)
+    assert b.charge('moz', 'key', '2026-10', 2, 5) == (True, 5)
+    assert a.used('moz', 'key', '2026-10') == 5
+
+
+def test_period():
+    now = datetime(2026, 12, 31, 23, 0, tzinfo=timezone.utc).timestamp()
+    assert period('day', now) == ('2026-12-31', datetime(2027, 1, 1, tzinfo=timezone.utc).timestamp())
+    assert period('month', now) == ('2026-12', datetime(2027, 1, 1, tzinfo=timezone.utc).timestamp())
+    with pytest.raises(ValueError):
+        period('week', now)
+
+
+def test_batch_stops_at_quota():
+    started = []
+
+    async def call(url):
+        started.append(url)
+        await asyncio.sleep(0.01)
+        if url >= 5:
+            raise QuotaExceeded('pagespeed', 'default', 5, 5, 0)
+        return url
+
+    results = asyncio.run(batch(call, range(100), concurrency=2, provider='pagespeed'))
+    assert len(results) == 100
+    assert results[:5] == list(range(5))
+    deferred = results[len(started):]
+    assert len(started) < 10
+    assert deferred and all(r is deferred[0] for r in deferred)
+    assert isinstance(deferred[0], QuotaExceeded)
+
+
+def test_batch_runs_on_after_another_providers_quota():
+    async def call(url):
+        raise QuotaExceeded('moz', 'default', 5, 5, 0)
+
+    results = asyncio.run(batch(call, range(10), provider='pagespeed'))
+    assert len({id(r) for r in results}) == 10
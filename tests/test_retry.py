@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from aiohttp import web
+
+from seo_tools import retry
+from seo_tools.retry import CircuitBreaker, RetryPolicy, retry_after
+from seo_tools.utils import get, new_session
+
+
+def _serve(monkeypatch, handler):
+    async def main():
+        app = web.Application()
+        app.router.add_get('/api', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        session = new_session()
+        start = time.monotonic()
+        try:
+            url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/api'
+            return await get(url, session=session, provider='test'), time.monotonic() - start
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    monkeypatch.setitem(retry._policies, 'test', RetryPolicy(attempts=3, backoff=0.01))
+    monkeypatch.setitem(retry._breakers, 'test', CircuitBreaker('test'))
+    return asyncio.run(main())
+
+
+def test_retry_after():
+    assert retry_after('2') == 2
+    assert retry_after(None) is None
+    assert retry_after('soon') is None
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < retry_after(format_datetime(when, usegmt=True)) <= 30
+    assert RetryPolicy(backoff=0.01).delay(0, retry_after=5) == 5
+
+
+def test_retry_after_is_waited_on(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return web.json_response({}, status=503, headers={'Retry-After': '0.3'})
+        return web.json_response({'ok': True})
+
+    data, elapsed = _serve(monkeypatch, handler)
+    assert data == {'ok': True}
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.3
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return web.json_response({'error': 'bad request'}, status=400)
+
+    data, _ = _serve(monkeypatch, handler)
+    assert data is None
+    assert len(calls) == 1
+
+
+def test_retries_give_up(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return web.Response(status=500)
+
+    data, _ = _serve(monkeypatch, handler)
+    assert data is None
+    assert len(calls) == 3
+
+
+def test_breaker_opens_and_closes():
+    breaker = CircuitBreaker('test', window=4, threshold=0.5, cooldown=0.1)
+    breaker.record(True)
+    assert not breaker.open
+    breaker.record(False)
+    assert breaker.open
+
+    async def wait():
+        start = time.monotonic()
+        await breaker.wait()
+        return time.monotonic() - start
+
+    assert asyncio.run(wait()) >= 0.09
+    assert not breaker.open
+    breaker.record(False)
+    assert not breaker.open
@@ -0,0 +1,160 @@
+import asyncio
+import time
+
+import pytest
+
+from seo_tools import utils
+from seo_tools.utils import TokenBucket, _imap, batch, limiter
+
+
+def _collect(agen):
+    async def main():
+        return [entry async for entry in agen]
+    return asyncio.run(main())
+
+
+async def _delayed(item):
+    await asyncio.sleep(item / 100)
+    return item * 2
+
+
+def test_imap_completion_order():
+    results = _collect(_imap(_delayed, [3, 1, 2], concurrency=3))
+    assert [r for _, _, r in results] == [2, 4, 6]
+    assert sorted((i, item) for i, item, _ in results) == [(0, 3), (1, 1), (2, 2)]
+
+
+def test_imap_input_order():
+    results = _collect(_imap(_delayed, [3, 1, 2], concurrency=3, ordered=True))
+    assert results == [(0, 3, 6), (1, 1, 2), (2, 2, 4)]
+
+
+def test_imap_bounded_concurrency():
+    running = peak = 0
+
+    async def call(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return item
+
+    assert len(_collect(_imap(call, range(50), concurrency=4))) == 50
+    assert peak == 4
+
+
+def test_imap_reorder_buffer():
+    # The first item is slow: no item is started further than 'buffer'
+    # places ahead of it until it is yielded
+    started = []
+
+    async def call(item):
+        started.append(item)
+        await asyncio.sleep(0.05 if item == 0 else 0)
+        return item
+
+    async def main():
+        agen = _imap(call, range(20), concurrency=10, ordered=True, buffer=3)
+        first = await agen.__anext__()
+        seen = len(started)
+        rest = [entry async for entry in agen]
+        return first, seen, rest
+
+    first, seen, rest = asyncio.run(main())
+    assert first == (0, 0, 0)
+    assert seen <= 4
+    assert [i for i, _, _ in rest] == list(range(1, 20))
+
+
+def test_imap_yields_exceptions():
+    async def call(item):
+        if item == 1:
+            raise ValueError(item)
+        return item
+
+    results = _collect(_imap(call, range(3), ordered=True))
+    assert isinstance(results[1][2], ValueError)
+    assert [r for _, _, r in results[::2]] == [0, 2]
+
+
+def test_token_bucket():
+    async def main():
+        bucket = TokenBucket(20, burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # Two tokens are banked, the other two take 1/20s each
+    assert 0.08 <= asyncio.run(main()) < 0.3
+
+
+def test_rate_applies_to_its_call_only(monkeypatch):
+    monkeypatch.setattr(utils, '_limiters', {})
+    seen = []
+
+    async def call(item):
+        seen.append(limiter('pagespeed'))
+        return item
+
+    async def main():
+        shared = limiter('pagespeed')
+        await batch(call, range(3), provider='pagespeed', rate=1000, burst=5)
+        return shared
+
+    shared = asyncio.run(main())
+    assert len(set(map(id, seen))) == 1
+    assert seen[0] is not shared and seen[0].rate == 1000 and seen[0].burst == 5
+    assert limiter('pagespeed') is shared
+
+
+def test_rate_needs_a_provider():
+    async def call(item):
+        return item
+
+    with pytest.raises(ValueError):
+        asyncio.run(batch(call, range(3), rate=5))
+    with pytest.raises(ValueError):
+        asyncio.run(batch(call, range(3), burst=5))
+
+
+def test_iterate_closes_an_abandoned_stream():
+    cancelled = []
+
+    async def call(item):
+        try:
+            await asyncio.sleep(0 if item < 2 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+        return item
+
+    results = utils.iterate(utils.stream(call, range(10), concurrency=4, ordered=True))
+    assert [next(results), next(results)] == [(0, 0), (1, 1)]
+    start = time.monotonic()
+    results.close()
+    # The calls in flight are cancelled rather than waited on
+    assert time.monotonic() - start < 1
+    assert sorted(cancelled) == [2, 3, 4, 5]
+
+
+def test_stream_aclose_cancels_pending_calls():
+    cancelled = []
+
+    async def call(item):
+        try:
+            await asyncio.sleep(0 if item == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+        return item
+
+    async def main():
+        agen = utils.stream(call, range(100), concurrency=3)
+        first = await agen.__anext__()
+        await agen.aclose()
+        return first
+
+    assert asyncio.run(main()) == (0, 0)
+    assert sorted(cancelled) == [1, 2, 3]